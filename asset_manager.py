@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Central loading of images
+
+Each image file is loaded once, converted to the display pixel format and shared.
+Scaled copies are cached by target size so every widget asking for the same size gets the same surface.
+Images loaded before the display exists are converted as soon as a display is available.
+Images can be loaded from worker threads with convert=False, they are then converted
+the first time they are requested from the main thread.
+Shared surfaces must not be drawn on, copy them first if needed.
+"""
+import time
+import threading
+import pygame
+from map_pyramid import load_map_surface
+
+
+class AssetManager():
+    '''
+    Cache of image surfaces
+    Keys are (file, size) with size None for the original image
+    '''
+    def __init__(self) -> None:
+        self.surface_dict = {}  # key: surface
+        self.converted_dict = {}  # key: True if surface is in the display format
+        self.alpha_dict = {}  # key: True if the surface keeps per pixel alpha
+        self.load_time_dict = {}  # key: time in ms to load (and scale) the surface
+        self.lock = threading.Lock()  # loads can come from worker threads
+
+
+    def _get(self, key: tuple) -> pygame.Surface:
+        '''
+        return a cached surface, converting it first if a display appeared since it was loaded
+        '''
+        if not self.converted_dict[key] and pygame.display.get_surface() is not None:
+            surface = self.surface_dict[key]
+            self.surface_dict[key] = surface.convert_alpha() if self.alpha_dict[key] else surface.convert()
+            self.converted_dict[key] = True
+        return(self.surface_dict[key])
+
+
+    def _add(self, key: tuple, surface: pygame.Surface, alpha: bool, start_time: float, convert: bool=True) -> pygame.Surface:
+        with self.lock:
+            self.surface_dict[key] = surface
+            self.converted_dict[key] = False
+            self.alpha_dict[key] = alpha
+            self.load_time_dict[key] = (time.perf_counter() - start_time) * 1000
+        if convert:
+            surface = self._get(key)
+        return(surface)
+
+
+    def _lookup(self, key: tuple, convert: bool) -> pygame.Surface|None:
+        if key not in self.surface_dict:
+            return(None)
+        if convert:
+            return(self._get(key))
+        return(self.surface_dict[key])
+
+
+    def get_image(self, file: str, alpha: bool=True, convert: bool=True) -> pygame.Surface:
+        '''
+        return the image at its original size
+        alpha: keep the transparency (markers...), False for opaque images
+        convert: False to leave the conversion to the display format for later (worker threads)
+        '''
+        key = (file, None)
+        surface = self._lookup(key, convert)
+        if surface is not None:
+            return(surface)
+        start_time = time.perf_counter()
+        surface = pygame.image.load(file)
+        return(self._add(key, surface, alpha, start_time, convert))
+
+
+    def get_scaled(self, file: str, size: tuple[int|float, int|float], alpha: bool=True, convert: bool=True) -> pygame.Surface:
+        '''
+        return the image scaled to size (float sizes are truncated like pygame.transform.scale does)
+        '''
+        size = (int(size[0]), int(size[1]))
+        key = (file, size)
+        surface = self._lookup(key, convert)
+        if surface is not None:
+            return(surface)
+        start_time = time.perf_counter()
+        surface = pygame.transform.scale(self.get_image(file, alpha=alpha, convert=convert), size)
+        return(self._add(key, surface, alpha, start_time, convert))
+
+
+    def get_map(self, file: str, width: int, height: int, convert: bool=True) -> pygame.Surface:
+        '''
+        return the map at the given size, from its prescaled variant when available
+        '''
+        key = (file, (width, height))
+        surface = self._lookup(key, convert)
+        if surface is not None:
+            return(surface)
+        start_time = time.perf_counter()
+        # load_map_surface converts when asked to and a display exists
+        surface = load_map_surface(file, width, height, convert=convert)
+        has_alpha = surface.get_flags() & pygame.SRCALPHA != 0
+        return(self._add(key, surface, has_alpha, start_time, convert))
+
+
+    def report(self) -> list[dict]:
+        '''
+        Load time and memory of each cached surface
+        '''
+        report_lst = []
+        for key, surface in self.surface_dict.items():
+            file, size = key
+            report_lst.append({
+                'file': file,
+                'size': surface.get_size(),
+                'scaled': size is not None,
+                'converted': self.converted_dict[key],
+                'load_time_ms': self.load_time_dict[key],
+                'memory_kb': surface.get_pitch() * surface.get_height() / 1024})
+        return(report_lst)
+
+
+    def print_report(self) -> None:
+        total_memory_kb = 0
+        for asset_dict in self.report():
+            total_memory_kb += asset_dict['memory_kb']
+            width, height = asset_dict['size']
+            print(f"{asset_dict['file']:<45} {width:>5}x{height:<5} {asset_dict['load_time_ms']:>8.2f} ms {asset_dict['memory_kb']:>9.1f} kB")
+        print(f"{'total':<45} {'':>11} {'':>11} {total_memory_kb:>9.1f} kB")
+
+
+# Process wide instance
+asset_manager = AssetManager()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the hot functions of the game
+
+Runs without a display (SDL dummy driver). Results can be saved as a json baseline and later runs
+are compared to it: functions slower than the baseline by more than the tolerance are flagged.
+Baselines are machine specific, save one on the machine you compare on.
+
+Run with:
+    python benchmark.py --save-baseline   # record the reference times
+    python benchmark.py                   # compare to the baseline, exit code 1 on regression
+    python benchmark.py --suite projection
+"""
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import sys
+import json
+import time
+import timeit
+import itertools
+import argparse
+import platform
+import numpy as np
+from config import config_dict
+from helper import print_color
+
+
+def time_function(func, number: int|None=1000, repeat: int=5) -> float:
+    '''
+    Return the best time per call in microseconds
+    number None: loop enough times for each repeat to last at least 0.2 s (stable for very fast calls)
+    '''
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    best_time = min(timer.repeat(repeat=repeat, number=number))
+    return(best_time / number * 1e6)
+
+
+def benchmark_projection() -> dict[str:float]:
+    '''
+    Compare the built-in mercator projection with the pyproj reference
+    Times are in microseconds
+    '''
+    from projection import MercatorProjection, PyprojProjection
+
+    result_dict = {}
+    result_dict['pyproj_init'] = time_function(PyprojProjection, number=20)
+    result_dict['mercator_init'] = time_function(MercatorProjection, number=20)
+
+    mercator = MercatorProjection()
+    reference = PyprojProjection()
+    result_dict['pyproj_gps2pixel'] = time_function(lambda: reference.gps2pixel(2.35, 48.85))
+    result_dict['mercator_gps2pixel'] = time_function(lambda: mercator.gps2pixel(2.35, 48.85))
+    result_dict['pyproj_pixel2gps'] = time_function(lambda: reference.pixel2gps(400, 400))
+    result_dict['mercator_pixel2gps'] = time_function(lambda: mercator.pixel2gps(400, 400))
+
+    # Vectorized conversion of random points of the map
+    lim = config_dict['COORD_LIMITS_DICT']
+    lon = np.random.uniform(lim['lon_min'], lim['lon_max'], 100000)
+    lat = np.random.uniform(lim['lat_max'], lim['lat_min'], 100000)
+    result_dict['pyproj_gps2pixel_array_100k'] = time_function(lambda: reference.gps2pixel_array(lon, lat), number=5)
+    result_dict['mercator_gps2pixel_array_100k'] = time_function(lambda: mercator.gps2pixel_array(lon, lat), number=5)
+    return(result_dict)
+
+
+def benchmark_hot_functions() -> dict[str:float]:
+    '''
+    Time the functions called while playing
+    Times are in microseconds
+    '''
+    import pygame
+    from geo_math import haversine, calculate_score
+    from database_class import Database
+    from gui_classes import Location, Text
+    from main import Game
+
+    result_dict = {}
+    result_dict['haversine'] = time_function(lambda: haversine(2.35, 48.85, 5.37, 43.30), number=None)
+    result_dict['calculate_score'] = time_function(lambda: calculate_score(123.4, config_dict), number=None)
+
+    # Game setup, display elements need a (dummy) window
+    game = Game(seed=0)
+    geo_map = game.geo_map
+    marker_surface = game.target_marker_surface
+
+    result_dict['location_init_gps'] = time_function(
+        lambda: Location(marker_surface=marker_surface, loc=(2.35, 48.85), coord_type='gps', geo_map=geo_map), number=None)
+
+    def location_gps2pixel() -> None:
+        location = Location(marker_surface=marker_surface, loc=(2.35, 48.85), coord_type='gps', geo_map=geo_map)
+        location.gps2pixel()
+    result_dict['location_gps2pixel'] = time_function(location_gps2pixel, number=None)
+
+    def location_pixel2gps() -> None:
+        location = Location(marker_surface=marker_surface, loc=(400, 500), coord_type='pixel', geo_map=geo_map)
+        location.pixel2gps()
+    result_dict['location_pixel2gps'] = time_function(location_pixel2gps, number=None)
+
+    result_dict['database_init'] = time_function(Database, number=3, repeat=3)
+    database = Database(seed=0)
+    result_dict['get_city_data'] = time_function(database.get_city_data, number=None)
+
+    # Text.update with a new text each call (render cache hits after the first round) and unchanged text
+    text = Text(text='Score: 0')
+    value_lst = [f'Score: {value}' for value in range(100)]
+    value_iter = itertools.cycle(value_lst)
+    def text_update_changed() -> None:
+        text.text = next(value_iter)
+        text.update()
+    result_dict['text_update_changed'] = time_function(text_update_changed, number=None)
+    result_dict['text_update_same'] = time_function(text.update, number=None)
+
+    # One frame of the main loop redrawing the whole window
+    def full_frame() -> None:
+        for name in game.scene.element_dict:
+            game.scene.mark_dirty(name)
+        game.update()
+        game.render()
+    result_dict['full_frame'] = time_function(full_frame, number=50)
+
+    # One round: guess frame then next city frame
+    guess_pos = geo_map.rect.center
+    def round_frames() -> None:
+        game.current_game_number = 1  # never reach the end of the game
+        game.handle_event(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=guess_pos, button=1))
+        game.update()
+        game.render()
+        game.handle_event(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=guess_pos, button=1))
+        game.update()
+        game.render()
+    result_dict['round_frames'] = time_function(round_frames, number=50)
+
+    pygame.quit()
+    return(result_dict)
+
+
+def benchmark_name_normalization() -> dict[str:float]:
+    '''
+    Compare the regex passes and the single pass normalizer on the city names
+    Times are in microseconds
+    '''
+    import pandas as pd
+    from name_normalizer import normalize_column, normalize_column_regex, normalize_name, clear_memo
+
+    name_series = pd.read_csv(config_dict['city_data_file'], sep=';', usecols=['city_name_raw'])['city_name_raw']
+    if not normalize_column_regex(name_series).equals(normalize_column(name_series)):
+        print_color('WARNING: normalizers give different results', color='red')
+
+    result_dict = {}
+    result_dict['regex_column_35k'] = time_function(lambda: normalize_column_regex(name_series), number=1, repeat=3)
+    def normalize_cold() -> None:
+        clear_memo()
+        normalize_column(name_series)
+    result_dict['single_pass_column_35k'] = time_function(normalize_cold, number=1, repeat=3)
+    # names already seen (second side of the join, re-runs)
+    result_dict['single_pass_memo_column_35k'] = time_function(lambda: normalize_column(name_series), number=1, repeat=3)
+    result_dict['regex_name'] = time_function(lambda: normalize_column_regex(pd.Series(['Saint-Étienne-du-Rouvray'])), number=100)
+    def normalize_name_cold() -> None:
+        clear_memo()
+        normalize_name('Saint-Étienne-du-Rouvray')
+    result_dict['single_pass_name'] = time_function(normalize_name_cold, number=None)
+    return(result_dict)
+
+
+def save_baseline(result_dict: dict[str:float], baseline_file: str=config_dict['benchmark_baseline_file']) -> None:
+    os.makedirs(os.path.dirname(baseline_file), exist_ok=True)
+    baseline_dict = {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'results_us': result_dict}
+    with open(baseline_file, 'w') as f:
+        json.dump(baseline_dict, f, indent=4)
+
+
+def load_baseline(baseline_file: str=config_dict['benchmark_baseline_file']) -> dict[str:float]|None:
+    if not os.path.exists(baseline_file):
+        return(None)
+    with open(baseline_file, 'r') as f:
+        return(json.load(f)['results_us'])
+
+
+def compare_to_baseline(
+        result_dict: dict[str:float],
+        baseline_dict: dict[str:float],
+        tolerance: float=config_dict['benchmark_tolerance']
+            ) -> list[str]:
+    '''
+    Print each result against its baseline and return the names of the regressions
+    (slower than baseline * (1 + tolerance))
+    '''
+    regression_lst = []
+    for key, value in result_dict.items():
+        if key not in baseline_dict:
+            print(f'{key:<40} {value:>12.2f} us   (no baseline)')
+            continue
+        ratio = value / baseline_dict[key]
+        line = f'{key:<40} {value:>12.2f} us {baseline_dict[key]:>12.2f} us  x{ratio:.2f}'
+        if ratio > 1 + tolerance:
+            regression_lst.append(key)
+            print_color(line + '  SLOWER', color='red')
+        else:
+            print_color(line, color='green')
+    return(regression_lst)
+
+
+def print_results(result_dict: dict[str:float]) -> None:
+    for key, value in result_dict.items():
+        print(f'{key:<40} {value:>12.2f} us')
+
+
+def print_speedup(result_dict: dict[str:float], slow_prefix: str, fast_prefix: str) -> None:
+    '''
+    Print the ratio between keys sharing the same name after their prefix
+    '''
+    for key in result_dict:
+        if key.startswith(slow_prefix):
+            name = key[len(slow_prefix):]
+            if fast_prefix + name in result_dict:
+                speedup = result_dict[key] / result_dict[fast_prefix + name]
+                print_color(f'{name:<30} x{speedup:.1f}', color='green')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the hot functions of the game')
+    parser.add_argument('--suite', choices=['hot', 'projection', 'normalize'], default='hot', help='set of benchmarks to run')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--baseline', default=None, help='baseline json file (default from config_dict)')
+    parser.add_argument('--tolerance', type=float, default=config_dict['benchmark_tolerance'],
+                        help='allowed slowdown before flagging a regression, 0.25 means 25%%')
+    args = parser.parse_args()
+
+    if args.suite == 'projection':
+        projection_result_dict = benchmark_projection()
+        print_results(projection_result_dict)
+        print_speedup(projection_result_dict, 'pyproj_', 'mercator_')
+        sys.exit(0)
+    if args.suite == 'normalize':
+        normalize_result_dict = benchmark_name_normalization()
+        print_results(normalize_result_dict)
+        print_speedup(normalize_result_dict, 'regex_', 'single_pass_')
+        print_speedup(normalize_result_dict, 'regex_', 'single_pass_memo_')
+        sys.exit(0)
+
+    baseline_file = args.baseline or config_dict['benchmark_baseline_file']
+    result_dict = benchmark_hot_functions()
+    if args.save_baseline:
+        save_baseline(result_dict, baseline_file)
+        print_results(result_dict)
+        print_color(f'Baseline saved to {baseline_file}', color='green')
+        sys.exit(0)
+
+    baseline_dict = load_baseline(baseline_file)
+    if baseline_dict is None:
+        print_results(result_dict)
+        print(f'WARNING: no baseline in {baseline_file}, run with --save-baseline to create one')
+        sys.exit(0)
+
+    regression_lst = compare_to_baseline(result_dict, baseline_dict, args.tolerance)
+    if regression_lst:
+        print_color(f'{len(regression_lst)} regression(s) above {args.tolerance:.0%}: {", ".join(regression_lst)}', color='red')
+        sys.exit(1)
+    print_color('No regression', color='green')
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled on-disk version of data/cities_data.csv
+
+The csv is converted once into a directory of .npy files that are memory-mapped at startup:
+    - fixed-width arrays for coordinates, population and region number
+    - packed string tables (utf-8 buffer + offsets) for city names
+    - dictionary encoding (int codes + packed string table) for departments and regions
+The store keeps the hash of the csv and is rebuilt when the csv changes
+Types are the smallest that fit: float32 coordinates (< 1 m error), int32 offsets, int8 codes...
+Memory-mapped files are in the page cache, shared by every game process of the host.
+"""
+import os
+import json
+import shutil
+import tempfile
+import hashlib
+import numpy as np
+from config import config_dict
+
+STORE_VERSION = 2
+
+# column name: dtype of the fixed width array
+numeric_column_dict = {
+    'latitude': np.float32,
+    'longitude': np.float32,
+    'city_population': np.int32,
+    'region_number': np.int16}
+
+# One string per row
+string_column_lst = ['city_name', 'city_name_raw']
+
+# Few distinct values, stored as codes into a table of unique values
+category_column_lst = ['department_name', 'department_number', 'region_name', 'region_name_raw']
+
+
+class StringTable():
+    '''
+    Packed strings: all utf-8 bytes in one buffer, string i is data[offsets[i]:offsets[i+1]]
+    Strings are only decoded when accessed
+    '''
+    def __init__(self, offsets: np.ndarray, data: np.ndarray) -> None:
+        self.offsets = offsets
+        self.data = data
+
+
+    @classmethod
+    def from_strings(cls, string_lst: list[str]) -> 'StringTable':
+        encoded_lst = [elem.encode('utf-8') for elem in string_lst]
+        length_lst = [len(elem) for elem in encoded_lst]
+        offsets = np.zeros(len(encoded_lst) + 1, dtype=np.int32 if sum(length_lst) < 2**31 else np.int64)
+        np.cumsum(length_lst, out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded_lst), dtype=np.uint8)
+        return(cls(offsets, data))
+
+
+    def __len__(self) -> int:
+        return(len(self.offsets) - 1)
+
+
+    def __getitem__(self, i: int) -> str:
+        return(self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8'))
+
+
+    @property
+    def nbytes(self) -> int:
+        return(self.offsets.nbytes + self.data.nbytes)
+
+
+    def to_list(self) -> list[str]:
+        '''
+        Decode every string at once
+        '''
+        buffer = self.data.tobytes()
+        offset_lst = self.offsets.tolist()
+        return([buffer[start:end].decode('utf-8') for start, end in zip(offset_lst[:-1], offset_lst[1:])])
+
+
+    def save(self, store_dir: str, name: str) -> None:
+        np.save(os.path.join(store_dir, f'{name}.offsets.npy'), self.offsets)
+        np.save(os.path.join(store_dir, f'{name}.data.npy'), self.data)
+
+
+    @classmethod
+    def load(cls, store_dir: str, name: str) -> 'StringTable':
+        offsets = np.load(os.path.join(store_dir, f'{name}.offsets.npy'), mmap_mode='r')
+        data = np.load(os.path.join(store_dir, f'{name}.data.npy'), mmap_mode='r')
+        return(cls(offsets, data))
+
+
+class CategoryColumn():
+    '''
+    Dictionary encoded column: codes[i] is the index of the value of row i in categories
+    Categories are sorted so codes follow the same order as the values
+    '''
+    def __init__(self, codes: np.ndarray, categories: StringTable) -> None:
+        self.codes = codes
+        self.categories = categories
+        self._category_lst = None
+
+
+    @classmethod
+    def from_strings(cls, string_lst: list[str]) -> 'CategoryColumn':
+        category_lst, codes = np.unique(np.asarray(string_lst, dtype=object), return_inverse=True)
+        code_dtype = np.int8 if len(category_lst) <= 2**7 else np.int16
+        return(cls(codes.astype(code_dtype), StringTable.from_strings(list(category_lst))))
+
+
+    @property
+    def category_lst(self) -> list[str]:
+        # Few values, decoded once
+        if self._category_lst is None:
+            self._category_lst = self.categories.to_list()
+        return(self._category_lst)
+
+
+    def __len__(self) -> int:
+        return(len(self.codes))
+
+
+    def __getitem__(self, i: int) -> str:
+        return(self.category_lst[self.codes[i]])
+
+
+    @property
+    def nbytes(self) -> int:
+        return(self.codes.nbytes + self.categories.nbytes)
+
+
+    def to_list(self) -> list[str]:
+        category_lst = self.category_lst
+        return([category_lst[code] for code in self.codes.tolist()])
+
+
+    def save(self, store_dir: str, name: str) -> None:
+        np.save(os.path.join(store_dir, f'{name}.codes.npy'), self.codes)
+        self.categories.save(store_dir, f'{name}.categories')
+
+
+    @classmethod
+    def load(cls, store_dir: str, name: str) -> 'CategoryColumn':
+        codes = np.load(os.path.join(store_dir, f'{name}.codes.npy'), mmap_mode='r')
+        categories = StringTable.load(store_dir, f'{name}.categories')
+        return(cls(codes, categories))
+
+
+def hash_file(file: str) -> str:
+    '''
+    Return the sha256 of a file
+    '''
+    file_hash = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            file_hash.update(chunk)
+    return(file_hash.hexdigest())
+
+
+def build_city_store(csv_file: str=config_dict['city_data_file'], store_dir: str=config_dict['city_store_dir']) -> None:
+    '''
+    Convert the city csv into the binary store
+    Files are written in a temporary directory which then replaces the old store
+    The directory has a unique name: processes building the store at the same time do not mix their files
+    '''
+    import pandas as pd
+
+    df = pd.read_csv(csv_file, sep=";", header=0, dtype={'department_number': str})
+
+    store_parent_dir = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(store_parent_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=store_parent_dir, prefix=os.path.basename(store_dir) + '.tmp')
+    os.chmod(tmp_dir, 0o755)  # mkdtemp only allows the owner
+
+    for column, dtype in numeric_column_dict.items():
+        np.save(os.path.join(tmp_dir, f'{column}.npy'), df[column].to_numpy(dtype=dtype))
+    for column in string_column_lst:
+        StringTable.from_strings(df[column].astype(str).to_list()).save(tmp_dir, column)
+    for column in category_column_lst:
+        CategoryColumn.from_strings(df[column].astype(str).to_list()).save(tmp_dir, column)
+
+    file_stat = os.stat(csv_file)
+    meta_dict = {
+        'version': STORE_VERSION,
+        'source_file': csv_file,
+        'source_hash': hash_file(csv_file),
+        'source_size': file_stat.st_size,
+        'source_mtime_ns': file_stat.st_mtime_ns,
+        'nb_rows': len(df),
+        'columns': list(df.columns)}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta_dict, f, indent=4)
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, store_dir)
+    except OSError:
+        # another process put its store in place in the meantime (built from the same csv), keep it
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_store_meta(store_dir: str) -> dict|None:
+    meta_file = os.path.join(store_dir, 'meta.json')
+    if not os.path.exists(meta_file):
+        return(None)
+    with open(meta_file, 'r') as f:
+        return(json.load(f))
+
+
+def is_store_up_to_date(csv_file: str, store_dir: str) -> bool:
+    '''
+    Check the store against the csv
+    The csv is only hashed when its size or modification time changed
+    '''
+    meta_dict = read_store_meta(store_dir)
+    if meta_dict is None or meta_dict['version'] != STORE_VERSION:
+        return(False)
+    file_stat = os.stat(csv_file)
+    if file_stat.st_size == meta_dict['source_size'] and file_stat.st_mtime_ns == meta_dict['source_mtime_ns']:
+        return(True)
+    if hash_file(csv_file) != meta_dict['source_hash']:
+        return(False)
+
+    # Same content, only the timestamp changed: remember it to skip hashing next time
+    meta_dict['source_mtime_ns'] = file_stat.st_mtime_ns
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump(meta_dict, f, indent=4)
+    return(True)
+
+
+class CityStore():
+    '''
+    Read only access to the memory-mapped city data
+    Numeric columns are numpy arrays, text columns are StringTable or CategoryColumn
+    '''
+    def __init__(self, store_dir: str=config_dict['city_store_dir']) -> None:
+        self.store_dir = store_dir
+        self.meta_dict = read_store_meta(store_dir)
+        self.source_hash = self.meta_dict['source_hash']
+        self.nb_rows = self.meta_dict['nb_rows']
+        self.column_lst = self.meta_dict['columns']
+
+        self.column_dict = {}
+        for column in numeric_column_dict:
+            self.column_dict[column] = np.load(os.path.join(store_dir, f'{column}.npy'), mmap_mode='r')
+        for column in string_column_lst:
+            self.column_dict[column] = StringTable.load(store_dir, column)
+        for column in category_column_lst:
+            self.column_dict[column] = CategoryColumn.load(store_dir, column)
+
+
+    def __len__(self) -> int:
+        return(self.nb_rows)
+
+
+    def __getitem__(self, column: str) -> np.ndarray|StringTable|CategoryColumn:
+        return(self.column_dict[column])
+
+
+    def memory_report(self) -> dict[str:int]:
+        '''
+        Bytes of each column (memory-mapped)
+        '''
+        return({column: values.nbytes for column, values in self.column_dict.items()})
+
+
+    def get_row(self, i: int) -> dict:
+        '''
+        Return all the values of a row in a dict
+        '''
+        return({column: self.column_dict[column][i] for column in self.column_lst})
+
+
+    def to_dataframe(self) -> 'pd.DataFrame':
+        '''
+        Return the full data as a dataframe with the same columns as the csv
+        '''
+        import pandas as pd
+
+        data_dict = {}
+        for column in self.column_lst:
+            values = self.column_dict[column]
+            if isinstance(values, np.ndarray):
+                data_dict[column] = np.asarray(values)
+            else:
+                data_dict[column] = values.to_list()
+        return(pd.DataFrame(data_dict))
+
+
+def load_city_store(csv_file: str=config_dict['city_data_file'], store_dir: str=config_dict['city_store_dir']) -> CityStore:
+    '''
+    Return the city store, (re)building it first if the csv changed
+    '''
+    if not is_store_up_to_date(csv_file, store_dir):
+        build_city_store(csv_file, store_dir)
+    return(CityStore(store_dir))
+
+
+if __name__ == '__main__':
+    build_city_store()
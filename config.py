@@ -23,15 +23,45 @@ config_dict = {
     
     # map location
     'map_file' : 'data/geo_data/france_map.png',
+    # prescaled copies of the map saved by map_pyramid.py (must contain the map size)
+    'map_pyramid_sizes' : [(400, 400), (800, 800), (1200, 1200)],
+    # 'mercator' (built-in, no pyproj needed) or 'pyproj' (reference implementation)
+    'projection_backend' : 'mercator',
+    
+    # city data, the csv is compiled into a memory-mapped store in the cache directory
+    'city_data_file' : 'data/cities_data.csv',
+    'city_store_dir' : 'data/cache/city_store',
+    'pool_cache_dir' : 'data/cache/pools',
+    'prefecture_file' : 'data/prefecture_data.csv',  # department_number;city_name_raw of each prefecture
+    'game_mode' : 'classique',  # key of game_mode_dict in game_mode.py
+    
+    # database_generation.py
+    'population_cache_dir' : 'data/cache/population',  # parsed INSEE xlsx files
+    'generation_workers' : None,  # processes parsing the xlsx files, None: one per core
+    'generation_cache_dir' : 'data/cache/generation',  # source manifest and merged data of each department
+    'fuzzy_match_threshold' : 0.8,  # min name similarity (edit distance) of the approximate join, above 1 to disable
     
     'max_score' : 1000,
-    'max_fps': 60,
+    'max_fps': 60,  # frame cap while something is animated
+    'idle_timeout_ms' : 1000,  # longest sleep between two frames when idle, 0 to only wake up on events
+    'text_cache_size' : 256,  # Number of rendered text surfaces kept in memory
+    'loader_workers' : None,  # threads loading the map, markers and database at startup, None: up to one per core
+    'perf_hud' : False,  # frame timing overlay (also GEOGAME_PERF_HUD=1), F3 toggles it, F4 dumps the frames to csv
+    'perf_hud_samples' : 300,  # last frames used for the overlay statistics
+    'perf_hud_refresh_ms' : 250,  # overlay text refresh period
+    'perf_record_frames' : 100000,  # frames kept for the csv dump
+    'perf_csv_file' : 'data/cache/perf_frames.csv',
     
     'target_marker_file' : 'data/assets/target_marker_v2.png',
     'player_marker_file' : 'data/assets/player_marker_v2.png',   
     'marker_map_ratio' : 0.03,  # Determine the relative size of the markers on the map
     
-    'max_game_number' : 10
+    'max_game_number' : 10,
+    'game_seed' : None,  # int to replay the same sequence of cities, None for a random one
+    
+    # benchmark.py, baseline results are machine specific
+    'benchmark_baseline_file' : 'data/cache/benchmark_baseline.json',
+    'benchmark_tolerance' : 0.25  # flag functions slower than the baseline by more than 25%
     }
 
 # Dict with preset colors
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Loading of data files
+
+Used by the data pipeline (database_generation.py): does not import pygame,
+pandas is only imported when a dataframe is requested
+"""
+import csv
+
+
+def csv2dict(csv_file:str, separator: str = ",", header: bool = False) -> dict[str:str]:
+    '''
+    csv_file : str of path
+    separator : str
+    header : BOOL
+    
+    load a 2 column csv into a dict
+    return a dict with dict[col1] = col2
+    '''
+    data_dict = {}
+    with open(csv_file, 'r') as file:
+        reader = csv.reader(file, delimiter=separator,)
+        if header:
+            next(reader)
+        for row in reader:
+            key, value = row
+            data_dict[key] = value
+    return(data_dict)
+
+
+def load_database() -> 'pd.DataFrame':
+    '''
+    return city data in a dataframe
+    Data comes from the compiled city store (rebuilt from the csv if needed)
+    '''
+    from city_store import load_city_store
+    df = load_city_store().to_dataframe()
+    return(df)
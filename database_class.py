@@ -2,42 +2,149 @@
 """
 Helper classes
 """
-from helper import load_database
-import pandas as pd
+from collections import namedtuple
+from city_store import load_city_store
+from game_mode import SelectionRule, game_mode_dict, get_city_pool, compile_modes
+from config import config_dict
+from spatial_index import SpatialIndex
+import numpy as np
+
+# Data needed to play a round
+CityRecord = namedtuple('CityRecord', ['city_name_raw', 'latitude', 'longitude'])
+
+
+class RoundSampler():
+    '''
+    Draw cities from a pool without repetition
+    The pool is shuffled once per game with a seeded generator so a game can be replayed from its seed
+    Each draw is a constant time read in the shuffled permutation
+    When every city was drawn the pool is shuffled again (same generator, still reproducible)
+    '''
+    def __init__(self, pool: np.ndarray, seed: int|None=None) -> None:
+        self.pool = pool
+        self.shuffle(seed)
+
+
+    def shuffle(self, seed: int|None=None) -> None:
+        '''
+        Start a new sequence, a random seed is picked (and kept) if none is given
+        '''
+        if seed is None:
+            seed = int(np.random.SeedSequence().entropy % 2**32)
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.order = self.rng.permutation(self.pool)
+        self.position = 0
+
+
+    def draw(self) -> int:
+        '''
+        return the next row index of the sequence
+        '''
+        if self.position >= len(self.order):
+            self.order = self.rng.permutation(self.pool)
+            self.position = 0
+        index = int(self.order[self.position])
+        self.position += 1
+        return(index)
+
 
 class Database:
-    def __init__(self) -> None:
-        # set game mode parameters
-        
-        # Maybe get to top 3 or 5 cities for each department
-        # self.pop_threshold = 30000
-        self.top_city_to_keep = 2  # Number of city per group (eg department) to keep
-        
+    def __init__(self, rule: SelectionRule|None=None, seed: int|None=None) -> None:
+        # load memory-mapped city data
+        self.store = load_city_store()
+        # index over every commune to find where the player clicked
+        self.spatial_index = SpatialIndex(self.store['longitude'], self.store['latitude'])
+
         # load subset of database according to gamemode
-        self.database = load_database()
-        # Sort by dpt and pop
-        self.database = self.database.sort_values(by = ['department_number', 'city_population'],
-                                      ascending = [True, False])
-        # Group by dpt and only keep top sities after sorting
-        grouped_db = self.database.groupby('department_number')
-        self.database = grouped_db.head(self.top_city_to_keep)
-        
-        
-    def get_city_data(self) -> pd.DataFrame:
-        '''
-        return a random city data 
-        '''
-        sample_df = self.database.sample(n=1)
-        # only keep relevant columns
-        sample_df = sample_df.loc[:,['city_name_raw', 'latitude', 'longitude']]
-        return(sample_df)
-    
-    
-    def get_paris_data(self) -> pd.DataFrame:
+        if rule is None:
+            rule = game_mode_dict[config_dict['game_mode']]
+        self.set_rule(rule, seed=seed)
+
+
+    def set_rule(self, rule: SelectionRule, seed: int|None=None) -> None:
+        '''
+        Change the pool of cities to play with
+        Pools are cached on disk so this is a lookup after the first time
+        '''
+        self.rule = rule
+        self.city_index = get_city_pool(rule, self.store)
+        self.sampler = RoundSampler(self.city_index, seed=seed)
+
+
+    def set_mode(self, mode_name: str, seed: int|None=None) -> None:
+        '''
+        Play one of the preset modes of game_mode_dict
+        '''
+        self.set_rule(game_mode_dict[mode_name], seed=seed)
+
+
+    def compile_modes(self, mode_lst: list[SelectionRule]|None=None) -> None:
+        '''
+        Prepare the pools of the modes (default all presets) so set_rule/set_mode do not compute anything
+        '''
+        if mode_lst is None:
+            mode_lst = list(game_mode_dict.values())
+        compile_modes(mode_lst, self.store)
+
+
+    def new_game(self, seed: int|None=None) -> int:
+        '''
+        Reshuffle the pool for a new game
+        return the seed of the game
+        '''
+        self.sampler.shuffle(seed)
+        return(self.sampler.seed)
+
+
+    @property
+    def seed(self) -> int:
+        return(self.sampler.seed)
+
+
+    def memory_report(self) -> dict[str:int]:
+        '''
+        Bytes of the city data by part
+        'store.<column>' are memory-mapped: in the page cache, shared by all the game processes of the host
+        the others are arrays of this process
+        '''
+        store_dict = {f'store.{column}': nbytes for column, nbytes in self.store.memory_report().items()}
+        private_dict = {'spatial_index': self.spatial_index.nbytes,
+                        'pool': self.city_index.nbytes,
+                        'sampler': self.sampler.order.nbytes}
+        report_dict = store_dict | private_dict
+        report_dict['shared'] = sum(store_dict.values())
+        report_dict['private'] = sum(private_dict.values())
+        return(report_dict)
+
+
+    def get_city_record(self, index: int) -> CityRecord:
+        '''
+        return the data needed to play a round for a row of the store
+        '''
+        return(CityRecord(city_name_raw=self.store['city_name_raw'][index],
+                          latitude=float(self.store['latitude'][index]),
+                          longitude=float(self.store['longitude'][index])))
+
+
+    def get_city_data(self) -> CityRecord:
+        '''
+        return the next city of the game, no city is repeated until the pool is exhausted
+        '''
+        return(self.get_city_record(self.sampler.draw()))
+
+
+    def get_paris_data(self) -> CityRecord|None:
         '''
         test function that always return paris data if possible
         '''
-        sample_df = self.database.loc[self.database['city_name_raw'] == 'Paris']
-        # only keep relevant columns
-        sample_df = sample_df.loc[:,['city_name_raw', 'latitude', 'longitude']]
-        return(sample_df)
\ No newline at end of file
+        city_names = self.store['city_name_raw']
+        for index in self.city_index.tolist():
+            if city_names[index] == 'Paris':
+                return(self.get_city_record(index))
+        return(None)
+
+
+if __name__ == '__main__':
+    for name, nbytes in Database().memory_report().items():
+        print(f'{name:<30} {nbytes / 1024:>10.1f} KiB')
@@ -21,6 +21,20 @@ Data is a json file with following information
 
 Population data was taken from the 2021 INSEE census.
 Data is divided stored in xslx files, one per department, named after department number
+Parsing the xlsx files is slow: they are parsed in parallel (one process per core) and each parsed
+department is cached as a pickle in config_dict['population_cache_dir']. Later runs only parse the files that changed.
+
+Regeneration is incremental (generate_database). A manifest in config_dict['generation_cache_dir'] keeps the
+hash of the source files and a key for each department computed from its inputs:
+    - its xlsx file hash
+    - its department name
+    - its rows of the (cleaned) location data, cached as a pickle while the json is unchanged
+The merged data of each department is cached, only the departments whose key changed are merged again.
+The csv is then written to a temporary file and moved over the previous one.
+
+The exact merge on the normalized name loses towns spelled differently in the two sources.
+The towns it leaves in a department are then joined on their name (trigram index and edit distance, see fuzzy_join.py),
+the matches and their score are saved in fuzzy_matches.csv in the generation cache directory.
 
 A table with correspondance between department name and number was also made. 
 
@@ -39,56 +53,274 @@ Merge all databases to have the following informations at minimal:
 
 import pandas as pd
 import os
+import re
 import json
-from helper import csv2dict
+import hashlib
+from itertools import compress
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from data_loading import csv2dict
+from name_normalizer import normalize_column
+from fuzzy_join import match_names
+from city_store import hash_file
+from config import config_dict
+
+
+POPULATION_CACHE_VERSION = 1  # increase when parse_department_file changes
+GENERATION_VERSION = 4  # increase when the cleaning or merging of the data changes
+
+NB2NAME_FILE = 'raw_data/dpt_numer2_name_table.csv'
+LOCATION_FILE = 'raw_data/cities_location.json'
+POPULATION_DIR = 'raw_data/department_population'  # one INSEE xlsx file per department
+
+# Cities split into arrondissements (Paris, Marseille, Lyon) are summed into one row per city
+ARRONDISSEMENT_REGEX = r'\s[0-9]+(?:e|er)\sarrondissement$'  # end of the population names, eg 'Paris 1er Arrondissement'
+DISTRICT_LOC_REGEX = r'^(.+?)\s[0-9]+\b'  # location names of arrondissements, eg 'paris 01'
+CITY_ORDER = 10**9  # cities split into arrondissements come after the other towns in the csv
+
+# Fields of the location json kept, in the csv order (insee_code, zip_code, label... are skipped)
+LOC_FIELD_LST = ['city_code', 'latitude', 'longitude', 'department_name', 'department_number', 'region_name']
+LOC_CATEGORY_LST = ['department_name', 'region_name']  # few distinct values, stored as categories
 
 
 def load_nb2name_dict() -> dict[str:str]:
     # Import name/department table
-    nb2name_dict = csv2dict(os.path.join('raw_data/dpt_numer2_name_table.csv'),
+    nb2name_dict = csv2dict(os.path.join(NB2NAME_FILE),
                              separator = ";",
                              header = True)
     return(nb2name_dict)
 
 
-def load_loc_data() -> pd.DataFrame:
-    # Import localization data
-    with open(os.path.join('raw_data/cities_location.json'), 'r') as f:
-        loc_dict = json.load(f, encoding = 'latin1')
-    loc_df = pd.DataFrame(loc_dict['cities'])
+_json_separator_regex = re.compile(r'[ \t\n\r,]*')
+
+
+def _decode_json_objects(decoder: json.JSONDecoder, buffer: str, pos: int) -> tuple[list, int]:
+    '''
+    Decode the complete array items of buffer from pos
+    returns the items and the position after the last one
+    '''
+    # Fast path, all the items up to the last '}' in one call
+    cut = buffer.rfind('}', pos) + 1
+    if cut > pos:
+        try:
+            return(json.loads(''.join(['[', buffer[pos:cut], ']'])), cut)
+        except json.JSONDecodeError:
+            pass  # this '}' is in a string, a nested object or after the array
+    # One item at a time until the first incomplete one
+    item_lst = []
+    while True:
+        pos = _json_separator_regex.match(buffer, pos).end()
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            return(item_lst, pos)
+        item_lst.append(item)
+        pos = end
+
+
+def iter_json_array(file: str, key: str, chunk_size: int=1 << 20) -> 'Iterator[list[dict]]':
+    '''
+    Yield the objects of the array under key by batches, the file is read by chunks
+    The array must follow the first occurrence of "key" in the file, eg {"cities": [{...}, {...}]}
+    '''
+    decoder = json.JSONDecoder()
+    with open(file, 'r') as f:
+        # Find the start of the array
+        buffer = ''
+        array_pos = -1
+        while array_pos < 0:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError(f'"{key}" array not found in {file}')
+            buffer += chunk
+            key_pos = buffer.find(f'"{key}"')
+            if key_pos >= 0:
+                array_pos = buffer.find('[', key_pos)
+
+        pos = array_pos + 1
+        while True:
+            item_lst, pos = _decode_json_objects(decoder, buffer, pos)
+            if item_lst:
+                yield item_lst
+            pos = _json_separator_regex.match(buffer, pos).end()
+            if buffer.startswith(']', pos):
+                return
+            # The next item is cut by the end of the buffer
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError(f'"{key}" array is invalid or not closed in {file}')
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+
+def load_loc_data(file: str=LOCATION_FILE) -> pd.DataFrame:
+    '''
+    Import localization data
+    The json is streamed: only towns in metropolitan area and the fields of LOC_FIELD_LST are kept
+    The index is the position of the town in the json
+    '''
+    field_getter = itemgetter(*LOC_FIELD_LST)
+    dpt_column = LOC_FIELD_LST.index('department_number')
+    row_lst = []  # tuples of the kept fields
+    index_lst = []
+    nb_read = 0
+    for city_lst in iter_json_array(file, 'cities'):
+        try:
+            batch_row_lst = list(map(field_getter, city_lst))
+        except KeyError:
+            # some towns lack a field
+            batch_row_lst = [tuple(city_dict.get(field) for field in LOC_FIELD_LST) for city_dict in city_lst]
+        is_kept_lst = [isinstance(row[dpt_column], str) and len(row[dpt_column]) < 3 for row in batch_row_lst]
+        row_lst.extend(compress(batch_row_lst, is_kept_lst))
+        index_lst.extend(compress(range(nb_read, nb_read + len(city_lst)), is_kept_lst))
+        nb_read += len(city_lst)
+
+    loc_df = pd.DataFrame(row_lst, columns=LOC_FIELD_LST, index=index_lst)
+    for field in LOC_CATEGORY_LST:
+        loc_df[field] = loc_df[field].astype('category')
     return(loc_df)
 
 
 def clean_loc_data(loc_df: pd.DataFrame) -> pd.DataFrame:
     '''
-    Only keep town in metropolitan area
+    Remove duplicates and add the join key
+    (overseas towns and unneeded columns are dropped by load_loc_data)
     '''
-    loc_df = loc_df[loc_df['department_number'].str.len() < 3]
-
-    # Drop unneeded columns
-    col_to_drop = [
-        'insee_code',
-        'zip_code',
-        'region_geojson_name',
-        'label'
-        ]
-    loc_df.drop(columns=col_to_drop, inplace = True)
     loc_df = loc_df.drop_duplicates()  # remove duplicates
+
+    # join key, normalized like the population names
+    loc_df['cleaned_name'] = normalize_column(loc_df['city_code'])
+    nb_changed = (loc_df['cleaned_name'] != loc_df['city_code']).sum()
+    if nb_changed:
+        print(f"WARNING: {nb_changed} city_code values differ from their normalized form, the normalized form is used to merge")
     return(loc_df)
 
 
-def load_population_data() -> pd.DataFrame:
-    # Import population data
-    df_lst = []
+def get_department_file(dpt_number: str, source_dir: str=POPULATION_DIR) -> str:
+    return(os.path.join(source_dir, f'dep{dpt_number}.xlsx'))
+
+
+def parse_department_file(excel_file: str, cache_file: str) -> str:
+    '''
+    Parse one INSEE xlsx file and save the table as a pickle (runs in a worker process)
+    '''
+    df = pd.read_excel(excel_file,
+                       sheet_name='Communes',
+                       skiprows = 7)
+    df.to_pickle(cache_file)
+    return(cache_file)
+
+
+def read_population_manifest(cache_dir: str) -> dict:
+    '''
+    Source file state of each cached department
+    '''
+    manifest_file = os.path.join(cache_dir, 'manifest.json')
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as f:
+            manifest_dict = json.load(f)
+        if manifest_dict.get('version') == POPULATION_CACHE_VERSION:
+            return(manifest_dict)
+    return({'version': POPULATION_CACHE_VERSION, 'files': {}})
+
+
+def get_file_state(file: str, file_dict: dict|None=None) -> dict:
+    '''
+    Size, modification time and hash of a file
+    The file is only hashed when its size or modification time differ from file_dict
+    '''
+    file_stat = os.stat(file)
+    if file_dict is not None and file_stat.st_size == file_dict['size'] and file_stat.st_mtime_ns == file_dict['mtime_ns']:
+        return(file_dict)
+    return({'size': file_stat.st_size,
+            'mtime_ns': file_stat.st_mtime_ns,
+            'hash': hash_file(file)})
+
+
+def is_department_cached(excel_file: str, cache_file: str, file_dict: dict|None) -> bool:
+    '''
+    Updates file_dict if only the timestamp changed
+    '''
+    if file_dict is None or not os.path.exists(cache_file):
+        return(False)
+    new_file_dict = get_file_state(excel_file, file_dict)
+    if new_file_dict['hash'] != file_dict['hash']:
+        return(False)
+    file_dict.update(new_file_dict)
+    return(True)
+
+
+def update_population_cache(
+        nb2name_dict: dict[str:str],
+        cache_dir: str=config_dict['population_cache_dir'],
+        max_workers: int|None=config_dict['generation_workers'],
+        source_dir: str=POPULATION_DIR,
+        parse_func: 'callable'=parse_department_file
+            ) -> dict:
+    '''
+    Parse the changed or new xlsx files in parallel
+    parse_func(excel_file, cache_file) runs in the worker processes (replaced in the tests)
+    If a file fails, the departments parsed before are still saved in the manifest, then the error is raised
+    returns the manifest (state of the xlsx file of each department)
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_dict = read_population_manifest(cache_dir)
+
+    parse_lst = []  # (dpt_number, excel_file, cache_file)
     for dpt_number in nb2name_dict:
-        df = pd.read_excel(os.path.join("".join(['raw_data/department_population/dep', dpt_number, '.xlsx']))
-                           ,sheet_name='Communes',
-                           skiprows = 7)
-        df['department_number'] = dpt_number
-        df['department_name'] = nb2name_dict[dpt_number] 
-        df_lst.append(df)
-
-    # Concatenate all
+        excel_file = get_department_file(dpt_number, source_dir)
+        cache_file = os.path.join(cache_dir, f'dep{dpt_number}.pkl')
+        if not is_department_cached(excel_file, cache_file, manifest_dict['files'].get(dpt_number)):
+            parse_lst.append((dpt_number, excel_file, cache_file))
+
+    try:
+        if parse_lst:
+            # Biggest files first so no worker is left with a big file at the end
+            parse_lst.sort(key=lambda item: os.path.getsize(item[1]), reverse=True)
+            parse_error = None
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                future_dict = {executor.submit(parse_func, excel_file, cache_file): (dpt_number, excel_file)
+                               for dpt_number, excel_file, cache_file in parse_lst}
+                for future in as_completed(future_dict):
+                    dpt_number, excel_file = future_dict[future]
+                    try:
+                        future.result()
+                    except Exception as error:
+                        # record the other departments first, the first error is raised after the loop
+                        if parse_error is None:
+                            parse_error = error
+                        manifest_dict['files'].pop(dpt_number, None)
+                        continue
+                    manifest_dict['files'][dpt_number] = get_file_state(excel_file)
+            if parse_error is not None:
+                raise parse_error
+    finally:
+        # keep the departments parsed so far even if one failed
+        with open(os.path.join(cache_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest_dict, f, indent=4)
+    print(f"Population data: {len(parse_lst)} department files parsed, {len(nb2name_dict) - len(parse_lst)} from cache")
+    return(manifest_dict)
+
+
+def read_population_table(dpt_number: str, dpt_name: str, cache_dir: str=config_dict['population_cache_dir']) -> pd.DataFrame:
+    df = pd.read_pickle(os.path.join(cache_dir, f'dep{dpt_number}.pkl'))
+    df['department_number'] = dpt_number
+    df['department_name'] = dpt_name
+    return(df)
+
+
+def load_population_data(
+        nb2name_dict: dict[str:str],
+        cache_dir: str=config_dict['population_cache_dir'],
+        max_workers: int|None=config_dict['generation_workers']
+            ) -> pd.DataFrame:
+    '''
+    Import population data of every department
+    Changed or new xlsx files are parsed in parallel, the others are read from the cache
+    '''
+    update_population_cache(nb2name_dict, cache_dir, max_workers)
+    # Concatenate all, in the department table order
+    df_lst = [read_population_table(dpt_number, dpt_name, cache_dir) for dpt_number, dpt_name in nb2name_dict.items()]
     population_df = pd.concat(df_lst)
     return(population_df)
 
@@ -97,26 +329,8 @@ def clean_population_data(population_df: pd.DataFrame) -> pd.DataFrame:
     # remove duplicates
     # create a column to clean city name before merge with location data
     # returns cleaned dataset
-    population_df['cleaned_name']= population_df['Nom de la commune']
-    population_df['cleaned_name']= population_df['cleaned_name'].str.lower()
-    # Pattern to change to make loc and pop data match
-    pattern_lst = [
-        [r"[\' ]", " "],
-        [r'[éèêë]','e'],
-        [r'œ','oe'],
-        [r'ñ','n'],
-        [r'ÿ','y'],
-        [r'\bsaint\b','st'],
-        [r'\bsainte\b','ste'],
-        [r'[ûùúü]','u'],
-        [r'[îìíï]','i'],
-        [r'[ôòóõö]','o'],
-        [r'[àâáãä]','a'],
-        [r'[ç]','c'],
-        [r'-',' '],
-        [r' +',' ']]
-    for search, replace in pattern_lst:
-        population_df['cleaned_name'] = population_df['cleaned_name'].str.replace(search,replace, regex=True)    
+    # same normalization as the location data (see name_normalizer.py)
+    population_df['cleaned_name'] = normalize_column(population_df['Nom de la commune'])
     
     #remove uneeded columns
     col_to_drop = [
@@ -132,77 +346,93 @@ def clean_population_data(population_df: pd.DataFrame) -> pd.DataFrame:
     return(population_df)
 
 
-def extract_big_city_pop_data(city: str, discarded_pop_df: pd.DataFrame) -> pd.Series:
-    # Sum population data for cities with 'arrondissement'
-    # city = city name (str)
-    city_lower = city.lower()
-    regex = r''.join([city_lower, '\s[0-9]+(?:e|er)\sarrondissement'])
-    city_pop_df = discarded_pop_df[discarded_pop_df['cleaned_name'].str.contains(regex)]
-    city_data = city_pop_df.iloc[0,:].copy()
-    # Change manually the required values
-    city_data['Nom de la commune'] = city
-    city_data['cleaned_name'] = city_lower
-    city_data['Population municipale'] = sum(city_pop_df['Population municipale'].to_list())
-    return(city_data)
-
-
-def extract_big_city_loc_data(city:str, discarded_loc_df:pd.DataFrame) -> pd.Series:
-    # Extract location (GPS) data for wities with 'arrondissement'
-    # city = city name (str)
-    city_lower = city.lower()
-    regex = r''.join([city_lower, '\s[0-9]+'])
-    city_loc_df = discarded_loc_df[discarded_loc_df['city_code'].str.contains(regex)]
-    city_data = city_loc_df.iloc[0,:].copy()
-    # Change manually the required values
-    city_data['city_code'] = city_lower
-    return(city_data)
-
-
-def extract_big_city_data(city:str, merge_df: pd.DataFrame, population_df: pd.DataFrame, location_df:pd.DataFrame) -> pd.Series:
-    # Returns a pandas series with the proper data for cities with arrondissements
-    
-    discarded_loc_df = location_df[ ~location_df['city_code'].isin(merge_df['city_code'])]
-    discarded_pop_df = population_df[ ~population_df['cleaned_name'].isin(merge_df['cleaned_name'])]
-    
-    #rename and drop colums to match the merge df
-    discarded_loc_df = discarded_loc_df.rename(columns={'department_name': 'department_name_x'})
-    discarded_pop_df = discarded_pop_df.rename(columns={'department_name': 'department_name_y'})
-    discarded_pop_df = discarded_pop_df.drop(columns='department_number')
-    
-    pop_data = extract_big_city_pop_data(city, discarded_pop_df)
-    loc_data = extract_big_city_loc_data(city, discarded_loc_df)
-    
-    city_data = pd.concat([pop_data, loc_data], axis=0)
-    return(city_data)
-
-
-
-'''
-Dataset generation
-'''
-if __name__ == '__main__':
-
-    # load and clean a bit data
-    nb2name_dict = load_nb2name_dict()
-    loc_df = load_loc_data()
-    loc_df = clean_loc_data(loc_df)
-
-    population_df = load_population_data()
-    population_df = clean_population_data(population_df)
-
+def aggregate_arrondissements(loc_df: pd.DataFrame, population_df: pd.DataFrame) -> tuple[pd.DataFrame|None, pd.DataFrame, pd.DataFrame]:
+    '''
+    One row per city split into arrondissements, found from the rows the exact merge left
+    Population: sum of the arrondissements, the other population data from the first one
+    Location: first location row named after the city followed by a number
+    returns (city rows with the columns of the exact merge or None, location rows left, population rows left)
+    '''
+    # one regex pass for all the cities
+    pop_city_series = population_df['cleaned_name'].str.extract(r''.join(['^(.+?)', ARRONDISSEMENT_REGEX]), expand=False)
+    is_district_series = pop_city_series.notna()
+    if not is_district_series.any():
+        return(None, loc_df, population_df)
+
+    district_df = population_df[is_district_series].assign(_city=pop_city_series[is_district_series])
+    key_lst = ['department_number', '_city']
+    city_pop_df = district_df.drop_duplicates(key_lst).set_index(key_lst)
+    city_pop_df['Population municipale'] = district_df.groupby(key_lst)['Population municipale'].sum()
+    city_pop_df = city_pop_df.reset_index()
+    city_pop_df['Nom de la commune'] = city_pop_df['Nom de la commune'].str.replace(ARRONDISSEMENT_REGEX, '', case=False, regex=True)
+    city_pop_df['cleaned_name'] = city_pop_df['_city']
+
+    loc_city_series = loc_df['cleaned_name'].str.extract(DISTRICT_LOC_REGEX, expand=False)
+    district_loc_df = loc_df.assign(_city=loc_city_series)
+    district_loc_df = district_loc_df[district_loc_df.set_index(key_lst).index.isin(city_pop_df.set_index(key_lst).index)]
+    city_loc_df = district_loc_df.drop_duplicates(key_lst)
+    city_loc_df = city_loc_df.assign(city_code=city_loc_df['_city'], _loc_order=CITY_ORDER + city_loc_df['_loc_order'])
+
+    city_df = pd.merge(left=city_loc_df.drop(columns='cleaned_name'),
+                       right=city_pop_df,
+                       on=key_lst)
+    city_df = city_df.drop(columns='_city')
+    city_df['_match_score'] = 1.0
+    return(city_df, loc_df.drop(index=district_loc_df.index), population_df[~is_district_series])
+
+
+def fuzzy_merge(loc_df: pd.DataFrame, population_df: pd.DataFrame, threshold: float) -> pd.DataFrame:
+    '''
+    Approximate join on the name, one population row per town at most
+    Same columns as the exact merge plus the '_match_score', None if nothing matched
+    '''
+    match_lst = match_names(loc_df['cleaned_name'].tolist(), population_df['cleaned_name'].tolist(), threshold)
+    if not match_lst:
+        return(None)
+    loc_index_lst = [loc_index for loc_index, _, _ in match_lst]
+    pop_index_lst = [pop_index for _, pop_index, _ in match_lst]
+
+    matched_loc_df = loc_df.iloc[loc_index_lst].reset_index(drop=True)
+    matched_loc_df = matched_loc_df.rename(columns={'department_name': 'department_name_x'})
+    matched_pop_df = population_df.iloc[pop_index_lst].reset_index(drop=True)
+    matched_pop_df = matched_pop_df.drop(columns=['cleaned_name', 'department_number'])
+    matched_pop_df = matched_pop_df.rename(columns={'department_name': 'department_name_y'})
+
+    fuzzy_df = pd.concat([matched_loc_df, matched_pop_df], axis=1)
+    fuzzy_df['_match_score'] = [score for _, _, score in match_lst]
+    return(fuzzy_df)
+
+
+def merge_department_data(
+        loc_df: pd.DataFrame,
+        population_df: pd.DataFrame,
+        fuzzy_threshold: float=config_dict['fuzzy_match_threshold']
+            ) -> pd.DataFrame:
+    '''
+    Merge the location and population data of one department, columns renamed to their final names
+    The '_loc_order' column keeps the row order of a merge of all the departments at once
+    The '_match_score' column is 1 for the exact matches and the name similarity for the approximate ones
+    '''
     merge_df = pd.merge(left=loc_df,
                         right=population_df,
-                        left_on=['city_code', 'department_number'],
-                        right_on=['cleaned_name', 'department_number']
+                        on=['cleaned_name', 'department_number']
                         )
+    merge_df['_match_score'] = 1.0
+
+    # rows left by the exact merge
+    left_loc_df = loc_df[~loc_df['_loc_order'].isin(merge_df['_loc_order'])]
+    left_pop_df = population_df[~population_df['cleaned_name'].isin(merge_df['cleaned_name'])]
 
-    # add data for big cities with arrondissement
-    big_cities_lst = ['Paris', 'Marseille', 'Lyon']
-    for city in big_cities_lst:
-        city_data = extract_big_city_data(city, merge_df, population_df, loc_df)
-        # add to merge df
-        merge_df = pd.concat([merge_df, pd.DataFrame([city_data])], ignore_index=True)
-        # print(city_data)
+    # add data for cities with arrondissements
+    city_df, left_loc_df, left_pop_df = aggregate_arrondissements(left_loc_df, left_pop_df)
+    if city_df is not None and len(city_df):
+        merge_df = pd.concat([merge_df, city_df], ignore_index=True)
+
+    # second stage: approximate join of the towns left on both sides
+    if len(left_loc_df) and len(left_pop_df):
+        fuzzy_df = fuzzy_merge(left_loc_df, left_pop_df, fuzzy_threshold)
+        if fuzzy_df is not None:
+            merge_df = pd.concat([merge_df, fuzzy_df], ignore_index=True)
 
     # Change columns names to final names for usages
     merge_df = merge_df.drop(columns=['department_name_y',
@@ -214,7 +444,125 @@ if __name__ == '__main__':
                                         'Nom de la commune':'city_name_raw',
                                         'Population municipale':'city_population',
                                         'city_code':'city_name'})
+    return(merge_df)
+
+
+def read_generation_manifest(cache_dir: str) -> dict:
+    '''
+    Source file states and key of each merged department
+    '''
+    manifest_file = os.path.join(cache_dir, 'manifest.json')
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as f:
+            manifest_dict = json.load(f)
+        if manifest_dict.get('version') == GENERATION_VERSION:
+            return(manifest_dict)
+    return({'version': GENERATION_VERSION, 'sources': {}, 'departments': {}})
+
+
+def load_cached_loc_data(cache_dir: str, source_dict: dict) -> pd.DataFrame:
+    '''
+    Cleaned location data, the json is only read again when it changed
+    Updates the json state in source_dict
+    '''
+    cache_file = os.path.join(cache_dir, 'location.pkl')
+    previous_dict = source_dict.get(LOCATION_FILE)
+    source_dict[LOCATION_FILE] = get_file_state(LOCATION_FILE, previous_dict)
+    if previous_dict is not None and previous_dict['hash'] == source_dict[LOCATION_FILE]['hash'] and os.path.exists(cache_file):
+        return(pd.read_pickle(cache_file))
+
+    loc_df = clean_loc_data(load_loc_data())
+    # row order of the json, kept through the department merges
+    loc_df['_loc_order'] = loc_df.index
+    loc_df.to_pickle(cache_file)
+    return(loc_df)
+
+
+def get_department_key(dpt_name: str, excel_hash: str, dpt_loc_df: pd.DataFrame, fuzzy_threshold: float) -> str:
+    '''
+    Hash of everything the merged data of a department depends on
+    '''
+    key_hash = hashlib.sha256()
+    key_hash.update(json.dumps([GENERATION_VERSION, fuzzy_threshold, dpt_name, excel_hash]).encode('utf-8'))
+    key_hash.update(pd.util.hash_pandas_object(dpt_loc_df, index=True).values.tobytes())
+    return(key_hash.hexdigest())
+
+
+def write_csv_atomic(df: pd.DataFrame, output_file: str) -> None:
+    '''
+    Write to a temporary file then replace: the csv is never left half written
+    '''
+    tmp_file = output_file + '.tmp'
+    df.to_csv(tmp_file, sep = ";",
+              header = True, index=False)
+    os.replace(tmp_file, output_file)
+
+
+def save_fuzzy_report(merge_df: pd.DataFrame, nb_town: int, report_file: str) -> None:
+    '''
+    Save the approximate matches with their score and print the match rate
+    '''
+    fuzzy_match_df = merge_df.loc[merge_df['_match_score'] < 1, ['department_number', 'city_name', 'city_name_raw', '_match_score']]
+    fuzzy_match_df = fuzzy_match_df.rename(columns={'_match_score': 'score'})
+    fuzzy_match_df.to_csv(report_file, sep = ";",
+                          header = True, index=False)
+    nb_matched = merge_df.loc[merge_df['_loc_order'] < CITY_ORDER, '_loc_order'].nunique()
+    print(f"Towns matched: {nb_matched}/{nb_town} ({nb_matched / max(nb_town, 1):.1%}), "
+          f"{len(fuzzy_match_df)} by approximate name (see {report_file})")
+
+
+def generate_database(
+        output_file: str=config_dict['city_data_file'],
+        cache_dir: str=config_dict['generation_cache_dir'],
+        fuzzy_threshold: float=config_dict['fuzzy_match_threshold']
+            ) -> None:
+    '''
+    Generate the csv, only the departments whose sources changed are merged again
+    '''
+    os.makedirs(os.path.join(cache_dir, 'departments'), exist_ok=True)
+    manifest_dict = read_generation_manifest(cache_dir)
+    source_dict = manifest_dict['sources']
+
+    # load and clean a bit data
+    nb2name_dict = load_nb2name_dict()
+    source_dict[NB2NAME_FILE] = get_file_state(NB2NAME_FILE, source_dict.get(NB2NAME_FILE))
+    loc_df = load_cached_loc_data(cache_dir, source_dict)
+    dpt_loc_dict = dict(tuple(loc_df.groupby('department_number', sort=False)))
+    population_manifest_dict = update_population_cache(nb2name_dict)
+
+    department_df_lst = []
+    rebuilt_lst = []
+    for dpt_number, dpt_name in nb2name_dict.items():
+        dpt_loc_df = dpt_loc_dict.get(dpt_number, loc_df.iloc[:0])
+        key = get_department_key(dpt_name, population_manifest_dict['files'][dpt_number]['hash'], dpt_loc_df, fuzzy_threshold)
+        dpt_file = os.path.join(cache_dir, 'departments', f'dep{dpt_number}.pkl')
+        if manifest_dict['departments'].get(dpt_number) == key and os.path.exists(dpt_file):
+            department_df_lst.append(pd.read_pickle(dpt_file))
+            continue
+
+        population_df = clean_population_data(read_population_table(dpt_number, dpt_name))
+        dpt_df = merge_department_data(dpt_loc_df, population_df, fuzzy_threshold)
+        dpt_df.to_pickle(dpt_file)
+        manifest_dict['departments'][dpt_number] = key
+        department_df_lst.append(dpt_df)
+        rebuilt_lst.append(dpt_number)
+    print(f"Merged data: {len(rebuilt_lst)} departments rebuilt, {len(nb2name_dict) - len(rebuilt_lst)} from cache")
+
+    # same row order as a merge of all the departments at once
+    merge_df = pd.concat(department_df_lst, ignore_index=True)
+    merge_df = merge_df.sort_values('_loc_order', kind='stable')
+    save_fuzzy_report(merge_df, len(loc_df), os.path.join(cache_dir, 'fuzzy_matches.csv'))
+    merge_df = merge_df.drop(columns=['_loc_order', '_match_score'])
 
     # save merge df:
-    merge_df.to_csv('data/cities_data.csv', sep = ";",
-                    header = True, index=False)
+    write_csv_atomic(merge_df, output_file)
+    # saved last: if anything failed, the next run does not trust a partial state
+    with open(os.path.join(cache_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest_dict, f, indent=4)
+
+
+'''
+Dataset generation
+'''
+if __name__ == '__main__':
+    generate_database()
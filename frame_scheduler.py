@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Frame pacing for the main loop
+
+When nothing is animated the loop sleeps in pygame.event.wait until an input arrives
+(or a scheduled wake up is due) instead of spinning at max_fps.
+While an animation runs, frames are capped at max_fps like with pygame.time.Clock.tick.
+"""
+import pygame
+from config import config_dict
+
+
+class FrameScheduler():
+    '''
+    Replace the pygame.event.get() + clock.tick(max_fps) pair of the main loop
+    Usage:
+        for event in scheduler.get_events():
+            ...
+    request_frames(duration_ms) keeps the loop running at max_fps for an animation
+    schedule_wakeup(delay_ms) makes an idle loop run one frame after delay_ms
+    '''
+    def __init__(
+            self,
+            max_fps: int=config_dict['max_fps'],
+            idle_timeout_ms: int=config_dict['idle_timeout_ms']
+                ) -> None:
+
+        self.max_fps = max_fps  # cap for active phases
+        self.idle_timeout_ms = idle_timeout_ms  # longest sleep when idle, 0 to sleep until an event
+        self.clock = pygame.time.Clock()
+
+        self.active_until_ms = 0  # run at max_fps until this time
+        self.wakeup_lst = []  # times (ms) where an idle loop must run a frame
+
+        # Frame counters
+        self.nb_active_frames = 0
+        self.nb_idle_frames = 0
+
+
+    def request_frames(self, duration_ms: int) -> None:
+        '''
+        Run at max_fps for the next duration_ms (eg an animation)
+        '''
+        self.active_until_ms = max(self.active_until_ms, pygame.time.get_ticks() + duration_ms)
+
+
+    def schedule_wakeup(self, delay_ms: int) -> None:
+        '''
+        Run one frame in delay_ms even if no event arrives
+        '''
+        self.wakeup_lst.append(pygame.time.get_ticks() + delay_ms)
+
+
+    def is_active(self) -> bool:
+        return(pygame.time.get_ticks() < self.active_until_ms)
+
+
+    def get_idle_timeout(self) -> int:
+        '''
+        Time to sleep in ms before the next scheduled wake up (0 means no limit)
+        '''
+        now = pygame.time.get_ticks()
+        timeout = self.idle_timeout_ms
+        if self.wakeup_lst:
+            next_wakeup = max(min(self.wakeup_lst) - now, 1)
+            timeout = next_wakeup if timeout == 0 else min(timeout, next_wakeup)
+        return(timeout)
+
+
+    def get_events(self) -> list[pygame.event.Event]:
+        '''
+        Wait for the next frame and return the pending events
+        '''
+        if self.is_active():
+            self.nb_active_frames += 1
+            self.clock.tick(self.max_fps)
+            return(pygame.event.get())
+
+        # Idle: sleep until an event or a scheduled wake up
+        self.nb_idle_frames += 1
+        now = pygame.time.get_ticks()
+        if any(wakeup <= now for wakeup in self.wakeup_lst):
+            # A wake up is due, run the frame now
+            self.wakeup_lst = [wakeup for wakeup in self.wakeup_lst if wakeup > now]
+            self.clock.tick()
+            return(pygame.event.get())
+
+        timeout = self.get_idle_timeout()
+        if timeout:
+            event = pygame.event.wait(timeout)
+        else:
+            event = pygame.event.wait()
+        self.clock.tick()  # only to keep frame timings
+        # the wake ups that came due during the wait are served by this frame
+        now = pygame.time.get_ticks()
+        self.wakeup_lst = [wakeup for wakeup in self.wakeup_lst if wakeup > now]
+
+        if event.type == pygame.NOEVENT:
+            return([])
+        return([event] + pygame.event.get())
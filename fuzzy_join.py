@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Approximate join of city names
+
+Used by database_generation.py for the towns the exact merge on the normalized name misses
+(spelling differences between the location and population data).
+Two stages, so that only a few pairs of names are compared instead of every pair:
+    - candidates: an inverted index of the name trigrams (trigram: names containing it) gives the
+      names sharing trigrams with a searched name. Those with a Dice coefficient of the trigram sets
+      (2 * nb shared / (nb trigrams A + nb trigrams B)) of at least candidate_threshold are kept
+    - score: similarity based on the edit distance (a swap of two letters counts as one edit),
+      1 - distance / length of the longest name
+One typo removes up to 3 trigrams of a short name, the trigrams alone are too strict to score.
+"""
+
+
+def get_ngrams(name: str, n: int=3) -> set[str]:
+    '''
+    Character n-grams of the name padded with spaces, eg 'nice' --> {'  n', ' ni', 'nic', 'ice', 'ce '}
+    '''
+    padded_name = ''.join([' ' * (n - 1), name, ' '])
+    return({padded_name[i:i + n] for i in range(len(padded_name) - n + 1)})
+
+
+def edit_distance(name_a: str, name_b: str, max_distance: int|None=None) -> int:
+    '''
+    Insertions, deletions, substitutions and swaps of adjacent letters to change name_a into name_b
+    (optimal string alignment distance)
+    Stops as soon as the distance is known to be over max_distance and returns max_distance + 1
+    '''
+    previous_row = None
+    row = list(range(len(name_b) + 1))
+    for i in range(1, len(name_a) + 1):
+        new_row = [i] + [0] * len(name_b)
+        for j in range(1, len(name_b) + 1):
+            new_row[j] = min(row[j] + 1,
+                             new_row[j - 1] + 1,
+                             row[j - 1] + (name_a[i - 1] != name_b[j - 1]))
+            if i > 1 and j > 1 and name_a[i - 1] == name_b[j - 2] and name_a[i - 2] == name_b[j - 1]:
+                new_row[j] = min(new_row[j], previous_row[j - 2] + 1)
+        if max_distance is not None and min(new_row) > max_distance and (previous_row is None or min(row) > max_distance):
+            # the distance only grows from here (a swap looks two rows back)
+            return(max_distance + 1)
+        previous_row, row = row, new_row
+    if max_distance is not None:
+        return(min(row[-1], max_distance + 1))
+    return(row[-1])
+
+
+def name_similarity(name_a: str, name_b: str, threshold: float=0.0) -> float:
+    '''
+    1 for identical names, 0 when every letter differs
+    Under threshold, the exact value is not computed: a similarity under threshold is returned
+    '''
+    max_length = max(len(name_a), len(name_b))
+    if max_length == 0:
+        return(1.0)
+    max_distance = int((1 - threshold) * max_length + 1e-9)
+    return(1 - edit_distance(name_a, name_b, max_distance) / max_length)
+
+
+class NgramIndex():
+    '''
+    Inverted index of the n-grams of a list of names
+    '''
+    def __init__(self, name_lst: list[str], n: int=3) -> None:
+        self.n = n
+        self.ngram_count_lst = []  # number of n-grams of each name
+        self.posting_dict = {}  # n-gram: indexes of the names containing it
+        for name_index, name in enumerate(name_lst):
+            ngram_set = get_ngrams(name, n)
+            self.ngram_count_lst.append(len(ngram_set))
+            for ngram in ngram_set:
+                self.posting_dict.setdefault(ngram, []).append(name_index)
+
+
+    def search(self, name: str, threshold: float) -> list[tuple[int, float]]:
+        '''
+        Indexes and Dice coefficients of the indexed names scoring at least threshold, best first
+        '''
+        ngram_set = get_ngrams(name, self.n)
+        shared_dict = {}  # name index: nb of shared n-grams
+        for ngram in ngram_set:
+            for name_index in self.posting_dict.get(ngram, ()):
+                shared_dict[name_index] = shared_dict.get(name_index, 0) + 1
+
+        result_lst = []
+        for name_index, nb_shared in shared_dict.items():
+            score = 2 * nb_shared / (len(ngram_set) + self.ngram_count_lst[name_index])
+            if score >= threshold:
+                result_lst.append((name_index, score))
+        result_lst.sort(key=lambda item: (-item[1], item[0]))
+        return(result_lst)
+
+
+def match_names(
+        left_name_lst: list[str],
+        right_name_lst: list[str],
+        threshold: float,
+        candidate_threshold: float=0.5
+            ) -> list[tuple[int, int, float]]:
+    '''
+    One to one matching of two lists of names
+    Pairs with a similarity of at least threshold are taken best first, each name is matched once
+    returns [(left index, right index, similarity), ...]
+    '''
+    index = NgramIndex(right_name_lst)
+    pair_lst = []
+    for left_index, name in enumerate(left_name_lst):
+        for right_index, _ in index.search(name, candidate_threshold):
+            right_name = right_name_lst[right_index]
+            if abs(len(name) - len(right_name)) > (1 - threshold) * max(len(name), len(right_name)):
+                continue  # too many letters missing to reach the threshold
+            similarity = name_similarity(name, right_name, threshold)
+            if similarity >= threshold:
+                pair_lst.append((left_index, right_index, similarity))
+    pair_lst.sort(key=lambda pair: (-pair[2], pair[0], pair[1]))
+
+    match_lst = []
+    used_left_set = set()
+    used_right_set = set()
+    for left_index, right_index, similarity in pair_lst:
+        if left_index in used_left_set or right_index in used_right_set:
+            continue
+        used_left_set.add(left_index)
+        used_right_set.add(right_index)
+        match_lst.append((left_index, right_index, similarity))
+    return(match_lst)
@@ -2,6 +2,11 @@
 """
 All functions regarding the selections of the target city to locate
 Functions relevant to GUI changes during difficulty selection (drop down menu ?) will be elsewhere.
+
+A game mode is a list of rules (population range, departments, regions, top N per group, prefectures).
+Each rule gives a boolean mask over the rows of the city store, masks are cached by rule
+so modes sharing a rule (eg several regions with the same population range) compute it once.
+The pool of a mode is the intersection of the masks of its rules.
 """
 
 '''
@@ -23,3 +28,257 @@ Would like to have:
 '''   
     
 
+
+import os
+import csv
+import json
+import hashlib
+import tempfile
+import numpy as np
+from config import config_dict
+from city_store import hash_file
+
+
+class SelectionRule():
+    '''
+    Rule selecting the pool of cities to play with
+    Subclasses implement select() which returns the row indices of the selected cities in the city store
+    and/or mask() which returns a boolean array (True for the selected rows), each defaults to the other
+    The key identifies the rule and its parameters for caching
+    '''
+    name = 'rule'
+
+    def __init__(self, **param_dict) -> None:
+        self.param_dict = param_dict
+
+
+    @property
+    def key(self) -> str:
+        return(self.name + json.dumps(self.param_dict, sort_keys=True))
+
+
+    def select(self, store: 'CityStore') -> np.ndarray:
+        return(np.flatnonzero(self.mask(store)))
+
+
+    def mask(self, store: 'CityStore') -> np.ndarray:
+        mask = np.zeros(len(store), dtype=bool)
+        mask[self.select(store)] = True
+        return(mask)
+
+
+class TopPerGroupRule(SelectionRule):
+    '''
+    Keep the top_n most populated cities of each group (eg department)
+    Cities are ordered by group then decreasing population
+    '''
+    name = 'top_per_group'
+
+    def __init__(self, top_n: int=2, group: str='department_number') -> None:
+        super().__init__(top_n=top_n, group=group)
+        self.top_n = top_n
+        self.group = group
+
+
+    def select(self, store: 'CityStore') -> np.ndarray:
+        group_codes = store[self.group].codes
+        population = store['city_population']
+        # Sort by group and pop (stable sort, same order as pandas sort_values)
+        sorted_index = np.lexsort((-population, group_codes))
+        # Only keep the top cities of each group after sorting
+        sorted_codes = group_codes[sorted_index]
+        group_start = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        group_size = np.diff(np.r_[group_start, len(sorted_index)])
+        rank_in_group = np.arange(len(sorted_index)) - np.repeat(group_start, group_size)
+        return(sorted_index[rank_in_group < self.top_n])
+
+
+class PopulationRule(SelectionRule):
+    '''
+    Keep cities with min_population <= population (< max_population if given)
+    '''
+    name = 'population'
+
+    def __init__(self, min_population: int=0, max_population: int|None=None) -> None:
+        super().__init__(min_population=min_population, max_population=max_population)
+        self.min_population = min_population
+        self.max_population = max_population
+
+
+    def mask(self, store: 'CityStore') -> np.ndarray:
+        population = store['city_population']
+        mask = population >= self.min_population
+        if self.max_population is not None:
+            mask &= population < self.max_population
+        return(mask)
+
+
+class RegionRule(SelectionRule):
+    '''
+    Keep cities of the given regions (names as in the region_name column)
+    '''
+    name = 'region'
+
+    def __init__(self, region_lst: list[str]) -> None:
+        super().__init__(region_lst=sorted(region_lst))
+        self.region_lst = region_lst
+
+
+    def mask(self, store: 'CityStore') -> np.ndarray:
+        return(category_mask(store['region_name'], self.region_lst))
+
+
+class DepartmentRule(SelectionRule):
+    '''
+    Keep cities of the given departments (numbers as in the department_number column, eg '2A')
+    '''
+    name = 'department'
+
+    def __init__(self, department_lst: list[str]) -> None:
+        super().__init__(department_lst=sorted(department_lst))
+        self.department_lst = department_lst
+
+
+    def mask(self, store: 'CityStore') -> np.ndarray:
+        return(category_mask(store['department_number'], self.department_lst))
+
+
+class PrefectureRule(SelectionRule):
+    '''
+    Keep the prefecture of each department
+    The prefectures are listed in a csv (department_number;city_name_raw)
+    The hash of the csv is part of the key: cached pools are not reused after it changes
+    '''
+    name = 'prefecture'
+
+    def __init__(self, prefecture_file: str=config_dict['prefecture_file']) -> None:
+        super().__init__(prefecture_file=prefecture_file, prefecture_hash=hash_file(prefecture_file))
+        self.prefecture_file = prefecture_file
+
+
+    def mask(self, store: 'CityStore') -> np.ndarray:
+        with open(self.prefecture_file, 'r', encoding='utf-8', newline='') as f:
+            prefecture_set = {(row['department_number'], row['city_name_raw']) for row in csv.DictReader(f, delimiter=';')}
+        name_set = {name for dpt, name in prefecture_set}
+        department_column = store['department_number']
+        mask = np.zeros(len(store), dtype=bool)
+        for i, name in enumerate(store['city_name_raw'].to_list()):
+            # the department is only read for the few rows with a prefecture name
+            if name in name_set and (department_column[i], name) in prefecture_set:
+                mask[i] = True
+        nb_missing = len(prefecture_set) - int(mask.sum())
+        if nb_missing > 0:
+            print(f"Warning: {nb_missing} prefectures of {self.prefecture_file} are not in the city data")
+        return(mask)
+
+
+class GameMode(SelectionRule):
+    '''
+    Cities selected by all the rules of the list
+    A mode with a single rule keeps the pool order of the rule (same games for the same seed)
+    '''
+    name = 'mode'
+
+    def __init__(self, label: str, rule_lst: list[SelectionRule]) -> None:
+        # the label is only displayed, it is not part of the key
+        super().__init__(rule_lst=sorted(rule.key for rule in rule_lst))
+        self.label = label
+        self.rule_lst = rule_lst
+
+
+    def select(self, store: 'CityStore') -> np.ndarray:
+        if len(self.rule_lst) == 1:
+            return(self.rule_lst[0].select(store))
+        return(np.flatnonzero(self.mask(store)))
+
+
+    def mask(self, store: 'CityStore') -> np.ndarray:
+        return(np.logical_and.reduce([get_rule_mask(rule, store) for rule in self.rule_lst]))
+
+
+def category_mask(column: 'CategoryColumn', value_lst: list[str]) -> np.ndarray:
+    '''
+    True for the rows of a category column whose value is in value_lst
+    '''
+    value_set = set(value_lst)
+    selected_codes = [i for i, value in enumerate(column.category_lst) if value in value_set]
+    return(np.isin(column.codes, selected_codes))
+
+
+# Masks already computed in this process, by (data hash, rule key)
+_mask_cache_dict = {}
+
+
+def get_rule_mask(rule: SelectionRule, store: 'CityStore') -> np.ndarray:
+    '''
+    Return the boolean mask of a rule, computed once per process
+    '''
+    mask_key = (store.source_hash, rule.key)
+    if mask_key not in _mask_cache_dict:
+        mask = rule.mask(store)
+        mask.flags.writeable = False  # shared by every mode using the rule
+        _mask_cache_dict[mask_key] = mask
+    return(_mask_cache_dict[mask_key])
+
+
+# Pools already loaded in this process, by cache file name
+_pool_cache_dict = {}
+
+
+def get_city_pool(rule: SelectionRule, store: 'CityStore', cache_dir: str=config_dict['pool_cache_dir']) -> np.ndarray:
+    '''
+    Return the row indices selected by a rule (int32)
+    Pools are saved on disk, keyed by the rule and the hash of the city data
+    '''
+    pool_hash = hashlib.sha256((rule.key + store.source_hash).encode('utf-8')).hexdigest()[:16]
+    pool_file = os.path.join(cache_dir, f'{rule.name}_{pool_hash}.npy')
+
+    if pool_file in _pool_cache_dict:
+        return(_pool_cache_dict[pool_file])
+
+    if os.path.exists(pool_file):
+        pool = np.load(pool_file).astype(np.int32, copy=False)
+    else:
+        pool = rule.select(store).astype(np.int32)
+        os.makedirs(cache_dir, exist_ok=True)
+        # unique temporary file, processes saving the same pool do not write into the same file
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.npy', delete=False) as f:
+            np.save(f, pool)
+        os.replace(f.name, pool_file)
+
+    _pool_cache_dict[pool_file] = pool
+    return(pool)
+
+
+def compile_modes(mode_lst: list[SelectionRule], store: 'CityStore') -> None:
+    '''
+    Load or compute the pools of all the modes (eg those of a menu)
+    so that switching to any of them afterwards is a dict lookup
+    '''
+    for mode in mode_lst:
+        get_city_pool(mode, store)
+
+
+def department_mode(department_lst: list[str], min_population: int=0) -> GameMode:
+    '''
+    Mode restricted to some departments
+    '''
+    return(GameMode(f"Départements {', '.join(department_lst)}",
+                    [DepartmentRule(department_lst), PopulationRule(min_population=min_population)]))
+
+
+def region_mode(region_lst: list[str], min_population: int=0) -> GameMode:
+    '''
+    Mode restricted to some regions
+    '''
+    return(GameMode(f"Régions {', '.join(region_lst)}",
+                    [RegionRule(region_lst), PopulationRule(min_population=min_population)]))
+
+
+# Preset modes, by name
+game_mode_dict = {
+    'classique': GameMode("Classique", [TopPerGroupRule(top_n=2, group='department_number')]),
+    'facile': GameMode("Facile", [PopulationRule(min_population=100000)]),
+    'prefectures': GameMode("Préfectures", [PrefectureRule()]),
+    'difficile': GameMode("Difficile", [PopulationRule(min_population=5000, max_population=20000)]),
+    'expert': GameMode("Expert", [PopulationRule(min_population=1000, max_population=5000)])}
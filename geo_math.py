@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Distance and score functions
+
+Pure math, numpy is only imported by the array versions
+"""
+import math
+
+
+def haversine(lon1: int|float, lat1: int|float, lon2: int|float, lat2: int|float) -> int:
+    '''
+    Calculated distance in km between two points in GPS (WSG84) Coordinates
+    '''
+    # Convert latitude and longitude from degrees to radians
+    lat1_rad = math.radians(lat1)
+    lon1_rad = math.radians(lon1)
+    lat2_rad = math.radians(lat2)
+    lon2_rad = math.radians(lon2)
+
+    # Haversine formula
+    dlon = lon2_rad - lon1_rad
+    dlat = lat2_rad - lat1_rad
+    a = math.sin(dlat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    # Radius of the Earth in kilometers
+    R = 6371.0
+
+    # Calculate the distance
+    distance = R * c
+    return distance
+
+
+def haversine_array(lon1: 'np.ndarray|float', lat1: 'np.ndarray|float', lon2: 'np.ndarray|float', lat2: 'np.ndarray|float') -> 'np.ndarray':
+    '''
+    Vectorized haversine, same formula as haversine
+    Inputs are broadcasted: N guesses vs N targets or one guess vs all cities
+    Return an array of distances in km
+    '''
+    import numpy as np
+
+    # Convert latitude and longitude from degrees to radians
+    lat1_rad = np.radians(lat1)
+    lon1_rad = np.radians(lon1)
+    lat2_rad = np.radians(lat2)
+    lon2_rad = np.radians(lon2)
+
+    # Haversine formula
+    dlon = lon2_rad - lon1_rad
+    dlat = lat2_rad - lat1_rad
+    a = np.sin(dlat / 2)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    # Radius of the Earth in kilometers
+    R = 6371.0
+    return(R * c)
+
+
+def calculate_score(distance:int, config_dict:dict) -> int:
+    '''
+    Return a score based on distance in km to target
+    Score is defined by a A*exp(B*x) equation
+    A is max score (for perfect max)
+    B is the number that gives half score for a distance of N km
+        B = ln(0.5) / N
+    '''
+    x = distance  # distance in km to target
+    N = 200  # Distance in km for half max score
+    A = config_dict['max_score']  # max score
+    B = math.log(0.5) / N  # Coefficient for decreasing
+
+    score = A * math.exp(B * x)
+    return(int(score))
+
+
+def calculate_score_array(distance: 'np.ndarray', config_dict: dict) -> 'np.ndarray':
+    '''
+    Vectorized calculate_score
+    Return an integer array of scores for an array of distances in km
+    '''
+    import numpy as np
+
+    x = np.asarray(distance, dtype=np.float64)  # distance in km to target
+    N = 200  # Distance in km for half max score
+    A = config_dict['max_score']  # max score
+    B = math.log(0.5) / N  # Coefficient for decreasing
+
+    score = A * np.exp(B * x)
+    # int() truncates toward zero
+    return(np.trunc(score).astype(np.int64))
@@ -3,10 +3,12 @@
 clases for object to display using pygames
 """
 import pygame
-from helper import haversine, print_color
-from pyproj import CRS, Transformer
+from helper import print_color
+from geo_math import haversine
+from projection import make_projection, default_projection
+from text_render import font_registry, text_render_cache
+from asset_manager import asset_manager
 from config import color_dict, config_dict
-import math
 import numpy as np
 
 class Location():
@@ -68,17 +70,19 @@ class Location():
             self.y = loc[1]
 
 
+        # projection to convert between projected and geographic pos data
+        # shared with the GeoMap so coord systems and map bounds are only computed once
         if map_lim == 'auto':
             self.map_lim = config_dict['COORD_LIMITS_DICT']
-        
-        # projection to convert between projected and geographic pos data
-            # initialize coord systems
-        self.proj_map = CRS('epsg:3857')
-        self.proj_gps = CRS("WGS84")
-            # create functions to transform coord from one system to another
-            # usage : self.to_gps.transform(map_coord_x, map_coord_y) = (gps_x, gps_y)
-        self.to_gps = Transformer.from_crs(self.proj_map, self.proj_gps, always_xy=True)
-        self.to_map = Transformer.from_crs(self.proj_gps, self.proj_map, always_xy=True)
+            if geo_map is not None:
+                self.projection = geo_map.projection
+            else:
+                self.projection = default_projection(self.map_width, self.map_height)
+        else:
+            self.map_lim = map_lim
+            self.projection = make_projection(map_width=self.map_width,
+                                              map_height=self.map_height,
+                                              map_lim=self.map_lim)
         
         
     def pixel2gps(self) -> None:
@@ -89,20 +93,8 @@ class Location():
             print('WARNING coord are already in gsp system')
             return
         
-        # convert map corner coordiantes to proj map coord
-        # x axis is lon and y axis is lat
-        xmin_map, ymin_map = self.to_map.transform(self.map_lim['lon_min'], self.map_lim['lat_min'])
-        xmax_map, ymax_map = self.to_map.transform(self.map_lim['lon_max'], self.map_lim['lat_max'])
-        
-        # Find pixel coord in 3857 system
-            # Get map scale in map proj unit/px
-        map_scale_x = (xmax_map - xmin_map) / self.map_width
-        map_scale_y = (ymax_map - ymin_map) / self.map_height
-            # Extrapolate pixels to map proj units (linear in proj system, not linear in GPS system)
-        x_map = xmin_map + self.x * map_scale_x
-        y_map = ymin_map + self.y * map_scale_y  # ymin_map refers to the value at the top of the map and the scale should be negative here
         # Convert to GPS system
-        self.x, self.y = self.to_gps.transform(x_map, y_map)
+        self.x, self.y = self.projection.pixel2gps(self.x, self.y)
         self.coord_type = 'gps'
     
     
@@ -114,17 +106,8 @@ class Location():
             print('WARNING coord are already in pixel system')
             return
         
-        # Convert GPS to 3857 system
-        self.x, self.y = self.to_map.transform(self.x, self.y)
-        
-        # Find extreme values of the map in 3857 coord
-        # x axis is lon and y axis is lat
-        xmin_map, ymin_map = self.to_map.transform(self.map_lim['lon_min'], self.map_lim['lat_min'])
-        xmax_map, ymax_map = self.to_map.transform(self.map_lim['lon_max'], self.map_lim['lat_max'])
-        
-        # Find the pixel for each coordiante
-        self.x = math.floor((self.x - xmin_map) / (xmax_map - xmin_map) * self.map_width)
-        self.y = math.floor((self.y - ymin_map) / (ymax_map - ymin_map) * self.map_width)
+        # Convert GPS to 3857 system then find the pixel for each coordinate
+        self.x, self.y = self.projection.gps2pixel(self.x, self.y)
         self.coord_type = 'pixel'
         
         # Create the pixel coor if not existant
@@ -146,6 +129,54 @@ class Location():
         return(distance_km)
 
     
+    def find_nearest_cities(self, spatial_index: 'SpatialIndex', k: int=1) -> tuple[np.ndarray, np.ndarray]|None:
+        '''
+        Find the k communes closest to the location (eg the commune the player clicked on)
+        return distances in km and row indices in the city data, sorted by distance
+        '''
+        if self.coord_type == 'gps':
+            lon, lat = self.x, self.y
+        elif hasattr(self, 'x_gps'):
+            lon, lat = self.x_gps, self.y_gps
+        else:
+            print("WARNING convert coord to gps before looking for the nearest cities")
+            return
+        
+        self.nearest_city_distance, self.nearest_city_index = spatial_index.query(lon, lat, k=k)
+        return(self.nearest_city_distance, self.nearest_city_index)
+
+    
+    def get_marker_rects(self) -> tuple[pygame.Rect, 'Text|None']:
+        '''
+        Return the rect of the marker and the Text of its name (None if not named)
+        Put the arrow tip at the location --> middle bottom position
+        '''
+        marker_rect = self.marker_surface.get_rect()
+        marker_rect.midbottom = (self.x_pixel, self.y_pixel)
+        
+        marker_text = None
+        if hasattr(self, 'marker_name'):
+            x_text, y_text = marker_rect.midtop
+            marker_text = Text(
+                text=self.marker_name,
+                x=x_text,
+                y=y_text,
+                anchor='midbottom',
+                color=self.marker_color)
+        return(marker_rect, marker_text)
+
+
+    @property
+    def rect(self) -> pygame.Rect:
+        '''
+        Area covered by the marker and its name
+        '''
+        marker_rect, marker_text = self.get_marker_rects()
+        if marker_text is not None:
+            return(marker_rect.union(marker_text.rect))
+        return(marker_rect)
+
+
     def place_marker(self, window):
         '''
         Place a marker at the location.
@@ -160,22 +191,18 @@ class Location():
             print("WARNING converting coord to pixel before plotting")
             self.gps2pixel(self)
         
-        marker_rect = self.marker_surface.get_rect()
-        marker_rect.midbottom = (self.x_pixel, self.y_pixel)
+        marker_rect, marker_text = self.get_marker_rects()
         window.blit(self.marker_surface, marker_rect)
         
         # Blit the marker name if it has one
-        if hasattr(self, 'marker_name'):
-            x_text, y_text = marker_rect.midtop
-            marker_text = Text(
-                text=self.marker_name,
-                x=x_text,
-                y=y_text,
-                anchor='midbottom',
-                color=self.marker_color)
+        if marker_text is not None:
             marker_text.display(window)
 
 
+    def display(self, window: pygame.Surface) -> None:
+        self.place_marker(window)
+
+
     def name_marker(self, name="Lorem Ipsum", color=color_dict['white']):
         '''
         Give a name to the marker
@@ -203,13 +230,16 @@ class GeoMap():
         self.height = map_height
         self.file = map_file
         
-        # Load map
-        self.surface = pygame.image.load(self.file)
-        self.surface = pygame.transform.scale(self.surface, (self.width, self.height))
+        # Load map (prescaled variant of the right size if available, shared through the asset manager)
+        self.surface = asset_manager.get_map(self.file, self.width, self.height)
         
         # Find topleft coordinates
         self.topleft_x = window_width - self.width
         self.topleft_y = window_height - self.height
+        self.rect = self.surface.get_rect(topleft=(self.topleft_x, self.topleft_y))
+        
+        # Shared coordinate conversion for every Location on this map
+        self.projection = make_projection(map_width=self.width, map_height=self.height)
     
     
     def display(self, window: pygame.Surface, pos: str='auto') -> None:
@@ -281,11 +311,13 @@ class Text():
         self.anchor = anchor  # key word to dicate text postioning relative to the x-y position
         
         # create GUI elements
-        self.font = pygame.font.SysFont(self.font_name, self.font_size)
-        self.surface = self.font.render(self.text, True, self.color)
+        self.font = font_registry.get_font(self.font_name, self.font_size)
+        self.surface = text_render_cache.render(self.text, self.font_name, self.font_size, self.color)
         self.rect = self.surface.get_rect()
         # Position the text
         setattr(self.rect, self.anchor, (self.x, self.y))
+        # What was rendered, to skip update when nothing changed
+        self.render_key = (self.text, self.font_name, self.font_size, self.color)
 
     
     def rotate(self, angle: int|float) -> None:
@@ -295,6 +327,7 @@ class Text():
         '''
         self.surface = pygame.transform.rotate(self.surface, angle) 
         self.rect = self.surface.get_rect()    
+        self.render_key = None  # surface is no longer the plain rendered text
     
 
     def move(self, x: int|float, y: int|float, anchor: str|None=None) -> None:
@@ -312,10 +345,13 @@ class Text():
         '''
         Update surface if text was changed
         '''
-        # update GUI elements
-        self.font = pygame.font.SysFont(self.font_name, self.font_size)
-        self.surface = self.font.render(self.text, True, self.color)
-        self.rect = self.surface.get_rect()
+        render_key = (str(self.text), self.font_name, self.font_size, self.color)
+        if render_key != self.render_key:
+            # update GUI elements, fonts and surfaces come from the shared caches
+            self.font = font_registry.get_font(self.font_name, self.font_size)
+            self.surface = text_render_cache.render(str(self.text), self.font_name, self.font_size, self.color)
+            self.rect = self.surface.get_rect()
+            self.render_key = render_key
         # Position the text
         setattr(self.rect, self.anchor, (self.x, self.y))
 
@@ -401,9 +437,9 @@ class Button():
         self.surface = self.surface_normal
         self.rect = self.surface.get_rect()
         
-        self.font = pygame.font.Font(self.font_name, self.font_size)
+        self.font = font_registry.get_font(self.font_name, self.font_size, sys_font=False)
         
-        self.text_image = self.font.render(self.text, True, (255, 255, 255))
+        self.text_image = text_render_cache.render(self.text, self.font_name, self.font_size, (255, 255, 255), sys_font=False)
         
         # For text in the center of button
         self.text_rect = self.text_image.get_rect(center = self.rect.center)
@@ -451,12 +487,14 @@ class Line():
             distance: int|float=0,
             color: tuple[int, int, int]=(0,0,0),
             width: int=2,
-            offset: int=10
+            offset: int=10,
+            draw: bool=True
                 ) -> None:
         
         '''
         window is the display surface
         marker_A and marker_B are Location objects
+        The line is drawn right away unless draw is False (then use display)
         
         Generate Text objects to print the score and distance along the line
         offset controls how far they are printed from the line
@@ -484,12 +522,16 @@ class Line():
         self.start_pos = (marker_A.x_pixel, marker_A.y_pixel)
         self.end_pos = (marker_B.x_pixel, marker_B.y_pixel)
         
+        # Area covered by the line
+        self.line_rect = pygame.Rect(min(self.start_pos[0], self.end_pos[0]),
+                                     min(self.start_pos[1], self.end_pos[1]),
+                                     abs(self.end_pos[0] - self.start_pos[0]) + 1,
+                                     abs(self.end_pos[1] - self.start_pos[1]) + 1)
+        self.rect = self.line_rect.inflate(self.width * 2, self.width * 2)
+        
         # Display line
-        self.line_rect = pygame.draw.line(window,
-                                         color=self.color,
-                                         start_pos=self.start_pos,
-                                         end_pos=self.end_pos,
-                                         width=self.width)
+        if draw:
+            self.line_rect = self.display(window)
         
         # Calculate where to display score and distance along the line
         self.score = score
@@ -497,7 +539,8 @@ class Line():
         self.offset = offset
         
         # Find line slope
-        if marker_A.x_pixel == marker_B.x_pixel:
+        # +1 offsets below give a zero denominator when B is one pixel left of A: vertical too
+        if marker_A.x_pixel == marker_B.x_pixel or marker_B.x_pixel - marker_A.x_pixel + 1 == 0:
             self.slope = 'inf'
             self.angle = 90
         else:
@@ -524,6 +567,14 @@ class Line():
         self.window_height = window.get_height()
 
 
+    def display(self, window: pygame.Surface) -> pygame.Rect:
+        return(pygame.draw.line(window,
+                                color=self.color,
+                                start_pos=self.start_pos,
+                                end_pos=self.end_pos,
+                                width=self.width))
+
+
     def find_score_distance_positions(self) -> None:
         
         # Find if markers are too close to print along the line
@@ -1,68 +1,32 @@
 # -*- coding: utf-8 -*-
 """
 helper functions
+
+Functions were split by what they need to import:
+    geo_math       distances and scores (math only)
+    data_loading   csv and city data (no pygame)
+    text_render    text surfaces (pygame)
+They can still be imported from here, the module holding them is only imported on first use.
 """
-import csv
-import re
-import pandas as pd
-import math
 from config import print_color_dict
-import pygame
-import numpy as np
-
-# for font work before pygame.init()
-pygame.font.init()
-
-def csv2dict(csv_file:str, separator: str = ",", header: bool = False) -> dict[str:str]:
-    '''
-    csv_file : str of path
-    separator : str
-    header : BOOL
-    
-    load a 2 column csv into a dict
-    return a dict with dict[col1] = col2
-    '''
-    data_dict = {}
-    with open(csv_file, 'r') as file:
-        reader = csv.reader(file, delimiter=separator,)
-        if header:
-            next(reader)
-        for row in reader:
-            key, value = row
-            data_dict[key] = value
-    return(data_dict)
 
 
-def load_database() -> pd.DataFrame:
-    '''
-    return city data in a dataframe
-    '''
-    df = pd.read_csv('data/cities_data.csv', sep=";", header=0)
-    return(df)
-
-
-def haversine(lon1: int|float, lat1: int|float, lon2: int|float, lat2: int|float) -> int:
-    '''
-    Calculated distance in km between two points in GPS (WSG84) Coordinates
-    '''
-    # Convert latitude and longitude from degrees to radians
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
+# name: module, for the functions that moved
+_moved_function_dict = {
+    'haversine': 'geo_math',
+    'haversine_array': 'geo_math',
+    'calculate_score': 'geo_math',
+    'calculate_score_array': 'geo_math',
+    'csv2dict': 'data_loading',
+    'load_database': 'data_loading',
+    'render_text': 'text_render'}
 
-    # Haversine formula
-    dlon = lon2_rad - lon1_rad
-    dlat = lat2_rad - lat1_rad
-    a = math.sin(dlat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
 
-    # Radius of the Earth in kilometers
-    R = 6371.0
-
-    # Calculate the distance
-    distance = R * c
-    return distance
+def __getattr__(name: str) -> object:
+    if name in _moved_function_dict:
+        import importlib
+        return(getattr(importlib.import_module(_moved_function_dict[name]), name))
+    raise AttributeError(f"module 'helper' has no attribute '{name}'")
 
 
 def print_color(txt: str, color:str='red') -> None:
@@ -80,45 +44,6 @@ def print_color(txt: str, color:str='red') -> None:
         print(txt)
 
 
-def render_text(topleft_x:int, topleft_y:int, text:int, font_name:str, font_size:int, color:str) -> tuple[pygame.Surface, pygame.Rect]:
-    '''
-    Display some text
-    Pass argument as a dict with following keys:
-        font, font_size, text, topleft_x, topleft_y, color
-    '''
-    # Load arg
-    x = topleft_x
-    y = topleft_y
-    textMessage = text
-    fontName = font_name
-    fontSize = font_size
-    colorMessage = color
-
-    # Create text objects
-    font = pygame.font.SysFont(fontName, fontSize)
-    text_surface = font.render(textMessage, True, colorMessage)
-    text_rect = text_surface.get_rect()
-    text_rect.topleft = (x, y)
-    return(text_surface, text_rect)
-
-
-def calculate_score(distance:int, config_dict:dict) -> int:
-    '''
-    Return a score based on distance in km to target
-    Score is defined by a A*exp(B*x) equation
-    A is max score (for perfect max)
-    B is the number that gives half score for a distance of N km
-        B = ln(0.5) / N
-    '''
-    x = distance  # distance in km to target
-    N = 200  # Distance in km for half max score
-    A = config_dict['max_score']  # max score
-    B = math.log(0.5) / N  # Coefficient for decreasing
-
-    score = A * math.exp(B * x)
-    return(int(score))
-
-
 # def place_text_along_line(target_pos, player_pos, line_rect, text, value_type='score', is_close=0, offset=10):
 #     '''
 #     Take two Location objects, a rect, a text to print and a qualifyier
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Background loading at startup
+
+The slow startup steps (map, markers, city database) run on a pool of worker threads
+while the main thread keeps the window responsive and draws a progress screen.
+Workers must not touch the display: surfaces are loaded with convert=False and converted
+by the main thread when the game asks the asset manager for them.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pygame
+from gui_classes import Text
+from config import config_dict, color_dict
+
+
+class BackgroundLoader():
+    '''
+    Run named loading tasks on worker threads
+    Usage:
+        loader.submit('database', 'Villes', Database, seed=seed)
+        ...
+        database = loader.result('database')  # waits, raises the error of the task if it failed
+    '''
+    def __init__(self, max_workers: int|None=config_dict['loader_workers']) -> None:
+        if max_workers is None:
+            # one thread per task at most, more threads than cores only adds GIL contention
+            max_workers = min(3, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='loader')
+        self.future_dict = {}  # name: Future
+        self.label_dict = {}  # name: text shown on the loading screen
+        self.start_time = time.perf_counter()
+        self.load_time_dict = {}  # name: ms from start to the end of the task
+
+
+    def submit(self, name: str, label: str, func: 'callable', *args, **kwargs) -> None:
+        def timed_task():
+            result = func(*args, **kwargs)
+            self.load_time_dict[name] = (time.perf_counter() - self.start_time) * 1000
+            return(result)
+        self.label_dict[name] = label
+        self.future_dict[name] = self.executor.submit(timed_task)
+
+
+    def is_ready(self, name_lst: list[str]|None=None) -> bool:
+        '''
+        True when all the given tasks (all tasks by default) are finished
+        '''
+        if name_lst is None:
+            name_lst = list(self.future_dict)
+        return(all(self.future_dict[name].done() for name in name_lst))
+
+
+    def wait(self, timeout: float, name_lst: list[str]|None=None) -> None:
+        '''
+        Sleep until one of the tasks finishes or timeout (s)
+        '''
+        if name_lst is None:
+            name_lst = list(self.future_dict)
+        pending_lst = [self.future_dict[name] for name in name_lst if not self.future_dict[name].done()]
+        if pending_lst:
+            wait(pending_lst, timeout=timeout, return_when=FIRST_COMPLETED)
+
+
+    def progress(self) -> float:
+        '''
+        Share of finished tasks, between 0 and 1
+        '''
+        if not self.future_dict:
+            return(1.0)
+        return(sum(future.done() for future in self.future_dict.values()) / len(self.future_dict))
+
+
+    def get_pending_labels(self) -> list[str]:
+        return([self.label_dict[name] for name, future in self.future_dict.items() if not future.done()])
+
+
+    def result(self, name: str) -> object:
+        return(self.future_dict[name].result())
+
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LoadingScreen():
+    '''
+    Progress bar drawn while the loader works
+    '''
+    def __init__(self, window: pygame.Surface, fps: int=30) -> None:
+        self.window = window
+        self.fps = fps
+
+        window_rect = self.window.get_rect()
+        self.bar_rect = pygame.Rect(0, 0, window_rect.width * 0.6, 24)
+        self.bar_rect.center = window_rect.center
+
+        self.title_text = Text(text="Chargement...",
+                               x=self.bar_rect.centerx,
+                               y=self.bar_rect.top - 20,
+                               anchor='midbottom')
+        self.step_text = Text(text="",
+                              x=self.bar_rect.centerx,
+                              y=self.bar_rect.bottom + 20,
+                              anchor='midtop',
+                              fontSize=20,
+                              color=color_dict['grey'])
+
+
+    def draw(self, loader: BackgroundLoader) -> None:
+        self.window.fill(color_dict['white'])
+        self.title_text.display(self.window)
+
+        # Bar filled with the share of finished tasks
+        fill_rect = self.bar_rect.copy()
+        fill_rect.width = self.bar_rect.width * loader.progress()
+        pygame.draw.rect(self.window, color_dict['grey'], fill_rect)
+        pygame.draw.rect(self.window, color_dict['black'], self.bar_rect, width=2)
+
+        self.step_text.text = ', '.join(loader.get_pending_labels())
+        self.step_text.update()
+        self.step_text.display(self.window)
+        pygame.display.flip()
+
+
+    def run(self, loader: BackgroundLoader, name_lst: list[str]|None=None) -> bool:
+        '''
+        Draw the progress until the tasks in name_lst (default all) are finished
+        return False as soon as the player closes the window (without waiting for the tasks)
+        '''
+        while not loader.is_ready(name_lst):
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return(False)
+            self.draw(loader)
+            # returns as soon as a task is done so the game starts without delay
+            loader.wait(1 / self.fps, name_lst)
+        return(True)
@@ -3,261 +3,397 @@
 All functions related to displaying and interacting with the gui
 """
 
+import sys
+import argparse
+from startup_report import startup_report
+if '--startup-report' in sys.argv:
+    # time the imports below
+    startup_report.start()
+
 import pygame
 
 from database_class import Database
 from gui_classes import GeoMap, Location, TopBand, Text, Button, FakeWindow, Line
+from scene import Scene
+from frame_scheduler import FrameScheduler
+from perf_hud import PerfHUD
+from loading import BackgroundLoader, LoadingScreen
+from asset_manager import asset_manager
 from config import config_dict, color_dict
-from helper import render_text, calculate_score
+from geo_math import calculate_score
 
-if __name__ == '__main__':
-    # load some colors
-    black = color_dict['black']
-    white = color_dict['white']
-    grey = color_dict['grey'] 
-    red = color_dict['red']
-
-    # Some base variable
-    total_score = 0  # Cummulated score
-    has_guessed = 0  # To control display if player just made a guess
-    current_game_number = 1  # Game number to know when to end the game
-    max_game_number = config_dict['max_game_number']
-    has_game_ended = 0
-
-    # pygame setup
-    pygame.init()
-    # Limit FPS to 60
-    clock = pygame.time.Clock()
-    max_fps = config_dict['max_fps']
-
-    # Setup window
-    window = pygame.display.set_mode((config_dict['WINDOW_WIDTH'], config_dict['WINDOW_HEIGHT']))
-    pygame.display.set_caption("Geo game v2")
-
-    # Load the map
-    geo_map = GeoMap()
-
-    # Create top band
-    top_band = TopBand(height=geo_map.topleft_y)
-
-    # Create marker assets to print
+startup_report.stop_import_timing()
+
+
+def load_marker_surfaces(map_width: int, map_height: int, convert: bool=True) -> tuple[pygame.Surface, pygame.Surface]:
+    '''
+    Target and player markers scaled to the map (loaded once, converted to the display format and shared)
+    convert=False when called from a worker thread
+    '''
     marker_map_ratio = config_dict['marker_map_ratio']
     target_marker_file = config_dict['target_marker_file']
     player_marker_file = config_dict['player_marker_file']
 
-    target_marker_surface = pygame.image.load(target_marker_file)
-    player_marker_surface = pygame.image.load(player_marker_file)
-
-    marker_width, marker_height = target_marker_surface.get_size()
+    marker_width, marker_height = asset_manager.get_image(target_marker_file, convert=convert).get_size()
     marker_dim_ratio = marker_height / marker_width
-    
+
     # Scale marker size to map
-    target_marker_surface = pygame.transform.scale(target_marker_surface, (geo_map.width * marker_map_ratio, geo_map.height * marker_map_ratio * marker_dim_ratio))
-    player_marker_surface = pygame.transform.scale(player_marker_surface, (geo_map.width * marker_map_ratio, geo_map.height * marker_map_ratio * marker_dim_ratio))
-
-    # Load and initialize city database
-    database = Database()
-
-    # Get first target data
-    city_data = database.get_city_data()
-    city_name = city_data['city_name_raw'].iloc[0]
-
-    target_pos = Location(marker_surface=target_marker_surface,
-                        loc=(city_data['longitude'].iloc[0], city_data['latitude'].iloc[0]),
-                        coord_type='gps',
-                        geo_map=geo_map)
-    target_pos.gps2pixel()
-    target_pos.name_marker(name=city_name)
-
-
-
-    # Prepare text to display
-    score_text = Text(
-        text=f"Score: {total_score}",
-        x=geo_map.width * 0.78,
-        y=top_band.height / 2 - 0.2 * top_band.height,
-        anchor='topleft')
-
-    target_city_text = Text(
-        text=f"{city_name}",
-        x=geo_map.width * 0.01,
-        y=score_text.y,
-        anchor='topleft')
-
-    guess_number_text = Text(
-        text=f"Ville {current_game_number} / {max_game_number}",
-        x=score_text.rect.bottomright[0] - geo_map.width * 0.2,
-        y=score_text.rect.bottomright[1],
-        anchor='bottomright')
-
-    # Initial display of the screen
-    # Clear the screen
-    window.fill(white)
-    # Draw the map
-    window.blit(geo_map.surface, (geo_map.topleft_x, geo_map.topleft_y))
-
-    # draw the topband
-    window.blit(top_band.image, top_band.rect.topleft)
-    # Display topband text
-    score_text.display(window)
-    target_city_text.display(window)
-    guess_number_text.display(window)
-
-
-    # prepare end of game assets (replay/quit window)
-    game_end_window = FakeWindow(
-        x = window.get_width() // 2,
-        y = window.get_height() // 2,
-        width = 300,
-        height = 200,
-        anchor = 'center'
-        )
-
-    replay_button = Button(
-        text="Rejouer",
-        x=game_end_window.rect.bottomleft[0] + 0.1 * game_end_window.width,
-        y=game_end_window.rect.bottomleft[1] - 0.1 * game_end_window.height,
-        width=0.3 * game_end_window.width,
-        height=0.2 * game_end_window.height,
-        anchor='bottomleft'
-        )
-
-    quit_button = Button(
-        text = "Quitter",
-        x = game_end_window.rect.bottomright[0] - 0.1 * game_end_window.width,
-        y = game_end_window.rect.bottomright[1] - 0.1 * game_end_window.height,
-        width = 0.3 * game_end_window.width,
-        height = 0.2 * game_end_window.height,
-        anchor = 'bottomright'
-        )
-
-    end_game_text = Text(
-        text=f"Score final: {total_score}",
-        x=game_end_window.rect.topleft[0] + 0.1 * game_end_window.width,
-        y=game_end_window.rect.topleft[1] + 0.1 * game_end_window.height,
-        anchor='topleft'
-        )
-
-    # Update the display
-    pygame.display.update()
-
-    # Main Loop
-    running = True
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            
-            if has_game_ended == 1:
-                # If game has ended all events go to the button
-                replay_button.handle_event(event)
-                quit_button.handle_event(event)
-            
-            if event.type == pygame.MOUSEBUTTONUP and has_guessed == 1:
-                # If player click to go to next city
-                has_guessed = 0
-                # new target
-                # city_data = database.get_city_data()
-                city_data = database.get_city_data()
-                city_name = city_data['city_name_raw'].iloc[0]
-                target_city_text.text = f"{city_name}"  # update display
-                target_pos = Location(marker_surface=target_marker_surface,
-                                    loc=(city_data['longitude'].iloc[0], city_data['latitude'].iloc[0]),
-                                    coord_type='gps',
-                                    geo_map=geo_map)
-                target_pos.gps2pixel()
-                target_pos.name_marker(name=city_name)
-                
-                
-                if current_game_number < max_game_number:
-                    # Update game number
-                    current_game_number += 1
-                    guess_number_text.text = f"Ville {current_game_number} / {max_game_number}"
-                else:
-                    # End of current game
-                    has_game_ended = 1
-                    end_game_text.text = f"Score final: {total_score}"
-                
-            elif event.type == pygame.MOUSEBUTTONUP and has_guessed == 0:
-                has_guessed = 1
-
-                player_pos = Location(marker_surface=player_marker_surface,
-                                    loc=pygame.mouse.get_pos(),
-                                    coord_type='pixel',
-                                    geo_map=geo_map)
-                player_pos.pixel2gps()
-                
-                # calculate score
-                distance = round(player_pos.calculate_distance((target_pos.x_gps, target_pos.y_gps)), 1)
-                score = calculate_score(distance, config_dict)
-                total_score += score
-                
-                player_pos.name_marker(name=f'{distance} km = {score} pts')
-                
-                # Update score
-                score_text.text = f"Score: {total_score}"
-        
-        # Display loop when there is no event
-        window.fill(white)  # Clear the screen
-        geo_map.display(window)  # Draw the map
-        top_band.display(window)  # draw the topband
-        
-        score_text.update()
-        score_text.display(window)  # display score
-        if not has_game_ended:
-            target_city_text.update()
-            target_city_text.display(window)  # display target name
-        guess_number_text.update()
-        guess_number_text.display(window)  # current game number
-
-        if has_game_ended:
-            game_end_window.display(window)
-            replay_button.display(window)
-            quit_button.display(window)
-            end_game_text.update()
-            end_game_text.display(window)
-            
+    marker_size = (map_width * marker_map_ratio, map_height * marker_map_ratio * marker_dim_ratio)
+    target_marker_surface = asset_manager.get_scaled(target_marker_file, marker_size, convert=convert)
+    player_marker_surface = asset_manager.get_scaled(player_marker_file, marker_size, convert=convert)
+    return(target_marker_surface, player_marker_surface)
+
+
+class Game():
+    '''
+    Hold the game state, the display elements and the main loop
+    Can be driven programmatically (see simulation.py) with run(frame_callback=...)
+    '''
+    def __init__(self, seed: int|None=config_dict['game_seed']) -> None:
+        # load some colors
+        self.black = color_dict['black']
+        self.white = color_dict['white']
+        self.grey = color_dict['grey']
+        self.red = color_dict['red']
+
+        # Some base variable
+        self.total_score = 0  # Cummulated score
+        self.has_guessed = 0  # To control display if player just made a guess
+        self.current_game_number = 1  # Game number to know when to end the game
+        self.max_game_number = config_dict['max_game_number']
+        self.has_game_ended = 0
+        self.running = False
+
+        # pygame setup
+        pygame.init()
+        startup_report.mark('pygame.init')
+        # Sleep until an input arrives when idle, limit FPS to max_fps when animating
+        self.scheduler = FrameScheduler(max_fps=config_dict['max_fps'], idle_timeout_ms=config_dict['idle_timeout_ms'])
+        # Optional frame timing overlay (F3)
+        self.perf_hud = PerfHUD()
+
+        # Setup window
+        self.window = pygame.display.set_mode((config_dict['WINDOW_WIDTH'], config_dict['WINDOW_HEIGHT']))
+        pygame.display.set_caption("Geo game v2")
+        startup_report.mark('window')
+
+        # Slow loads run on worker threads while a progress screen is shown
+        self.loader = BackgroundLoader()
+        self.loader.submit('map', 'carte', asset_manager.get_map,
+                           config_dict['map_file'], config_dict['MAP_WIDTH'], config_dict['MAP_HEIGHT'], convert=False)
+        self.loader.submit('markers', 'marqueurs', load_marker_surfaces,
+                           config_dict['MAP_WIDTH'], config_dict['MAP_HEIGHT'], convert=False)
+        self.loader.submit('database', 'villes', Database, seed=seed)
+        self.quit_requested = not LoadingScreen(self.window).run(self.loader)
+        if self.quit_requested:
+            # window closed during loading: the game is not built, run() returns at once
+            self.loader.shutdown()
+            return
+        for name in ['map', 'markers']:
+            self.loader.result(name)  # raise the error of a failed load
+        self.loader.shutdown()
+        startup_report.mark('background loading')
+
+        # Map and markers come from the asset manager cache, converted to the display format here
+        self.geo_map = GeoMap()
+
+        # Create top band
+        self.top_band = TopBand(height=self.geo_map.topleft_y)
+
+        self.target_marker_surface, self.player_marker_surface = load_marker_surfaces(self.geo_map.width, self.geo_map.height)
+        startup_report.mark('map and markers')
+
+        # City database
+        self.database = self.loader.result('database')
+
+        # Prepare text to display
+        self.score_text = Text(
+            text=f"Score: {self.total_score}",
+            x=self.geo_map.width * 0.78,
+            y=self.top_band.height / 2 - 0.2 * self.top_band.height,
+            anchor='topleft')
+
+        self.target_city_text = Text(
+            text="",
+            x=self.geo_map.width * 0.01,
+            y=self.score_text.y,
+            anchor='topleft')
+
+        self.guess_number_text = Text(
+            text=f"Ville {self.current_game_number} / {self.max_game_number}",
+            x=self.score_text.rect.bottomright[0] - self.geo_map.width * 0.2,
+            y=self.score_text.rect.bottomright[1],
+            anchor='bottomright')
+
+        # prepare end of game assets (replay/quit window)
+        self.game_end_window = FakeWindow(
+            x = self.window.get_width() // 2,
+            y = self.window.get_height() // 2,
+            width = 300,
+            height = 200,
+            anchor = 'center'
+            )
+
+        self.replay_button = Button(
+            text="Rejouer",
+            x=self.game_end_window.rect.bottomleft[0] + 0.1 * self.game_end_window.width,
+            y=self.game_end_window.rect.bottomleft[1] - 0.1 * self.game_end_window.height,
+            width=0.3 * self.game_end_window.width,
+            height=0.2 * self.game_end_window.height,
+            anchor='bottomleft'
+            )
+
+        self.quit_button = Button(
+            text = "Quitter",
+            x = self.game_end_window.rect.bottomright[0] - 0.1 * self.game_end_window.width,
+            y = self.game_end_window.rect.bottomright[1] - 0.1 * self.game_end_window.height,
+            width = 0.3 * self.game_end_window.width,
+            height = 0.2 * self.game_end_window.height,
+            anchor = 'bottomright'
+            )
+
+        self.end_game_text = Text(
+            text=f"Score final: {self.total_score}",
+            x=self.game_end_window.rect.topleft[0] + 0.1 * self.game_end_window.width,
+            y=self.game_end_window.rect.topleft[1] + 0.1 * self.game_end_window.height,
+            anchor='topleft'
+            )
+
+        startup_report.mark('texts and buttons')
+
+        # Retained scene: only what changed is redrawn and pushed to the screen
+        self.scene = Scene(self.window, background_color=self.white)
+        self.scene.add('map', self.geo_map, layer=0)
+        self.scene.add('top_band', self.top_band, layer=0)
+        self.scene.add('score_text', self.score_text, layer=1)
+        self.scene.add('target_city_text', self.target_city_text, layer=1)
+        self.scene.add('guess_number_text', self.guess_number_text, layer=1)
+        # markers and error line (added after a guess) use layers 2 and 3
+        self.scene.add('game_end_window', self.game_end_window, layer=4, visible=False)
+        self.scene.add('replay_button', self.replay_button, layer=5, visible=False)
+        self.scene.add('quit_button', self.quit_button, layer=5, visible=False)
+        self.scene.add('end_game_text', self.end_game_text, layer=5, visible=False)
+        self.end_game_name_lst = ['game_end_window', 'replay_button', 'quit_button', 'end_game_text']
+
+        # Get first target data
+        self.new_target()
+        startup_report.mark('scene and first target')
+
+
+    def set_text(self, name: str, text: Text, value: str) -> None:
+        '''
+        Change a displayed text and mark it for redraw
+        '''
+        text.text = value
+        text.update()
+        self.scene.mark_dirty(name)
+
+
+    def new_target(self) -> None:
+        '''
+        Draw the next city to find
+        '''
+        city_data = self.database.get_city_data()
+        city_name = city_data.city_name_raw
+        self.set_text('target_city_text', self.target_city_text, f"{city_name}")  # update display
+        self.target_pos = Location(marker_surface=self.target_marker_surface,
+                                   loc=(city_data.longitude, city_data.latitude),
+                                   coord_type='gps',
+                                   geo_map=self.geo_map)
+        self.target_pos.gps2pixel()
+        self.target_pos.name_marker(name=city_name)
+
+
+    def guess(self, pos: tuple[int, int]) -> None:
+        '''
+        Player clicked at pos to locate the target
+        '''
+        self.has_guessed = 1
+
+        self.player_pos = Location(marker_surface=self.player_marker_surface,
+                                   loc=pos,
+                                   coord_type='pixel',
+                                   geo_map=self.geo_map)
+        self.player_pos.pixel2gps()
+
+        # calculate score
+        distance = round(self.player_pos.calculate_distance((self.target_pos.x_gps, self.target_pos.y_gps)), 1)
+        score = calculate_score(distance, config_dict)
+        self.total_score += score
+
+        # commune the player clicked on
+        nearest_distance, nearest_index = self.player_pos.find_nearest_cities(self.database.spatial_index, k=1)
+        clicked_city_name = self.database.store['city_name_raw'][nearest_index[0]]
+
+        self.player_pos.name_marker(name=f'{clicked_city_name}: {distance} km = {score} pts')
+
+        # Update score
+        self.set_text('score_text', self.score_text, f"Score: {self.total_score}")
+
+        # display line between markers, under the markers
+        # Add score along the line with km distance
+        self.error_line = Line(window=self.window,
+                               marker_A=self.player_pos,
+                               marker_B=self.target_pos,
+                               draw=False)
+        # error_line.find_score_distance_positions()
+        self.scene.add('error_line', self.error_line, layer=2)
+
+        # Display marker
+        self.scene.add('player_marker', self.player_pos, layer=3)
+        self.scene.add('target_marker', self.target_pos, layer=3)
+
+        # display score and distance
+        # error_line.display_distance_score(window)
+        # error_line.display_guess_score(window)
+
+
+    def next_round(self) -> None:
+        '''
+        Player clicked to go to next city
+        '''
+        self.has_guessed = 0
+        self.scene.remove('error_line')
+        self.scene.remove('player_marker')
+        self.scene.remove('target_marker')
+
+        # new target
+        self.new_target()
+
+        if self.current_game_number < self.max_game_number:
+            # Update game number
+            self.current_game_number += 1
+            self.set_text('guess_number_text', self.guess_number_text, f"Ville {self.current_game_number} / {self.max_game_number}")
+        else:
+            # End of current game
+            self.has_game_ended = 1
+            self.end_game_text.text = f"Score final: {self.total_score}"
+            self.end_game_text.update()
+            self.scene.hide('target_city_text')
+            for name in self.end_game_name_lst:
+                self.scene.show(name)
+
+
+    def replay(self) -> None:
+        '''
+        Restart a game from the end game window
+        '''
+        # restart the variables
+            # score displayed
+        self.total_score = 0
+        self.set_text('score_text', self.score_text, f"Score: {self.total_score}")
+            # Game number
+        self.current_game_number = 1
+        self.set_text('guess_number_text', self.guess_number_text, f"Ville {self.current_game_number} / {self.max_game_number}")
+
+            # New sequence of cities
+        self.database.new_game()
+        self.new_target()
+
+            # Reset variables
+        self.has_guessed = 0
+        self.has_game_ended = 0
+        self.replay_button.clicked = False
+        self.replay_button.hovered = False
+        self.replay_button.update()
+        for name in self.end_game_name_lst:
+            self.scene.hide(name)
+        self.scene.show('target_city_text')
+
+
+    def handle_event(self, event: pygame.event.Event) -> None:
+        if event.type == pygame.QUIT:
+            self.running = False
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+            self.perf_hud.toggle()
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+            print(f"Frame timings saved to {self.perf_hud.dump_csv()}")
+
+        if self.has_game_ended == 1:
+            # If game has ended all events go to the button
+            for button_name, button in [('replay_button', self.replay_button), ('quit_button', self.quit_button)]:
+                was_hovered = button.hovered
+                button.handle_event(event)
+                if button.hovered != was_hovered:
+                    self.scene.mark_dirty(button_name)
+
+        if event.type == pygame.MOUSEBUTTONUP and self.has_guessed == 1:
+            with self.perf_hud.phase('logic'):
+                self.next_round()
+        elif event.type == pygame.MOUSEBUTTONUP and self.has_guessed == 0 and self.has_game_ended == 0:
+            with self.perf_hud.phase('logic'):
+                self.guess(event.pos)
+
+
+    def update(self) -> None:
+        '''
+        Game logic that does not depend on a single event
+        '''
+        if self.has_game_ended:
             # Check if end game button clicked
-            if quit_button.clicked == True:
-                running = False
-            elif replay_button.clicked == True:
-                # restart the variables
-                    # score displayed
-                total_score = 0
-                score_text.text = f"Score: {total_score}"
-                    # Game number
-                current_game_number = 1
-                guess_number_text.text = f"Ville {current_game_number} / {max_game_number}"
-                
-                    # Reset variables
-                has_guessed = 0
-                has_game_ended = 0
-                replay_button.clicked = False
-                replay_button.hovered = False
-                replay_button.update()
-                
-        # Display marker if relevant
-        if has_guessed == 1:
-            # display line between markers
-            # Do it first to be under markers
-            # Add score along the line with km distance
-            error_line = Line(window=window,
-                            marker_A=player_pos,
-                            marker_B=target_pos)
-            # error_line.find_score_distance_positions()
-            
-            # Display marker
-            player_pos.place_marker(window)
-            target_pos.place_marker(window)
-            
-            # display score and distance
-            # error_line.display_distance_score(window)
-            # error_line.display_guess_score(window)
-            
-        # Update the display
-        pygame.display.update()     
-        clock.tick(max_fps)
+            if self.quit_button.clicked == True:
+                self.running = False
+            elif self.replay_button.clicked == True:
+                with self.perf_hud.phase('logic'):
+                    self.replay()
+
+
+    def render(self) -> list[pygame.Rect]:
+        # Only redraw and push to the screen what changed since last frame
+        with self.perf_hud.phase('blit'):
+            dirty_rect_lst = self.scene.render()
+        with self.perf_hud.phase('display'):
+            if dirty_rect_lst:
+                pygame.display.update(dirty_rect_lst)
+        return(dirty_rect_lst)
+
+
+    def run(self, frame_callback: 'callable|None'=None) -> None:
+        '''
+        Main Loop
+        frame_callback(game) is called at the start of every frame (used to inject events in tests)
+        '''
+        if self.quit_requested:
+            # window closed during loading
+            return
+
+        # Initial display of the screen
+        self.render()
+
+        self.running = True
+        while self.running:
+            self.perf_hud.begin_frame()
+            if frame_callback is not None:
+                frame_callback(self)
+            with self.perf_hud.phase('wait'):
+                event_lst = self.scheduler.get_events()
+            with self.perf_hud.phase('events'):
+                for event in event_lst:
+                    self.handle_event(event)
+            self.update()
+            with self.perf_hud.phase('hud'):
+                self.perf_hud.refresh(self.scene)
+            self.render()
+            self.perf_hud.end_frame()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Geo game')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='print import and initialisation times until the first frame, then quit')
+    args = parser.parse_args()
+
+    game = Game()
+    if args.startup_report and not game.quit_requested:
+        game.render()
+        startup_report.mark('first frame')
+        startup_report.print_report()
+    else:
+        game.run()
 
     # Quit Pygame
     pygame.quit()
 
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,8 @@ import pandas as pd
 import re
 import matplotlib.pyplot as plt
 from pyproj import CRS, Transformer
+from config import config_dict
+from map_pyramid import build_map_pyramid
 
 """
 NUTS description:
@@ -37,6 +39,7 @@ neighbours_code_lst = ['DE', 'ES', 'LU', 'BE', 'IT', 'UK', 'NL']
 output_file = 'data/geo_data/france_map.png'
 output_format = 'png'
 nb_dpi = 300
+pyramid_size_lst = config_dict['map_pyramid_sizes']  # prescaled copies loaded by the game
 
 plot_size = (10,10)
 map_color = 'forestgreen'
@@ -103,6 +106,15 @@ xmax_gps, ymax_gps = to_gps.transform(xmax + pad, ymax + pad)
 print('xlim: ', xmin_gps, xmax_gps)
 print('ylim: ', ymin_gps, ymax_gps)
 
+# Save prescaled copies of the map for the game (see map_pyramid.py)
+# Same naming as config_dict['COORD_LIMITS_DICT']: lat_min is the top of the map
+map_lim = {
+    'lon_min' : xmin_gps,
+    'lon_max' : xmax_gps,
+    'lat_max' : ymin_gps,
+    'lat_min' : ymax_gps}
+build_map_pyramid(map_file=output_file, size_lst=pyramid_size_lst, map_lim=map_lim)
+
 '''
 limit coordinates:
     xmin = -4.88788,
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Prescaled versions of the map (resolution pyramid)
+
+map_generation.py saves a large 300 dpi map. Decoding it and scaling it down at every launch is slow
+and uses a lot of memory, so the map is saved once at every size in config_dict['map_pyramid_sizes'].
+A json file next to the map lists the variants and the map bounds (gps coordinates).
+GeoMap then loads the variant matching its size directly.
+
+Build the variants from an existing map with: python map_pyramid.py
+"""
+import os
+import json
+import pygame
+from config import config_dict
+
+
+def get_pyramid_file(map_file: str) -> str:
+    '''
+    Path of the json describing the variants of a map
+    '''
+    return(os.path.splitext(map_file)[0] + '_pyramid.json')
+
+
+def get_variant_file(map_file: str, width: int, height: int) -> str:
+    root, extension = os.path.splitext(map_file)
+    return(f'{root}_{width}x{height}{extension}')
+
+
+def build_map_pyramid(
+        map_file: str=config_dict['map_file'],
+        size_lst: list[tuple[int, int]]=config_dict['map_pyramid_sizes'],
+        map_lim: dict[str:float]=config_dict['COORD_LIMITS_DICT']
+            ) -> dict:
+    '''
+    Save a scaled copy of the map for each size and the json listing them
+    Scaling is the same as the one GeoMap did at startup so the game looks the same
+    '''
+    source_surface = pygame.image.load(map_file)
+    # Drop the alpha channel if the map is fully opaque (faster blits)
+    is_opaque = source_surface.get_flags() & pygame.SRCALPHA == 0 or min(pygame.surfarray.pixels_alpha(source_surface).flat) == 255
+
+    variant_lst = []
+    for width, height in size_lst:
+        variant_surface = pygame.transform.scale(source_surface, (width, height))
+        if is_opaque:
+            opaque_surface = pygame.Surface((width, height), 0, 24)
+            opaque_surface.blit(variant_surface, (0, 0))
+            variant_surface = opaque_surface
+        variant_file = get_variant_file(map_file, width, height)
+        pygame.image.save(variant_surface, variant_file)
+        variant_lst.append({'width': width,
+                            'height': height,
+                            'file': os.path.basename(variant_file),
+                            'has_alpha': not is_opaque})
+
+    pyramid_dict = {
+        'source_file': os.path.basename(map_file),
+        'source_size': list(source_surface.get_size()),
+        'map_limits': map_lim,
+        'variants': variant_lst}
+    with open(get_pyramid_file(map_file), 'w') as f:
+        json.dump(pyramid_dict, f, indent=4)
+    return(pyramid_dict)
+
+
+def load_map_surface(map_file: str, width: int, height: int, convert: bool=True) -> pygame.Surface:
+    '''
+    Return the map at the requested size, converted to the display format if a display exists
+    (and convert is True, use False from worker threads)
+    Uses the prescaled variant if there is one, otherwise loads and scales the full map
+    '''
+    surface = None
+    has_alpha = True
+    pyramid_file = get_pyramid_file(map_file)
+    if os.path.exists(pyramid_file):
+        with open(pyramid_file, 'r') as f:
+            pyramid_dict = json.load(f)
+        for variant_dict in pyramid_dict['variants']:
+            if variant_dict['width'] == width and variant_dict['height'] == height:
+                surface = pygame.image.load(os.path.join(os.path.dirname(map_file), variant_dict['file']))
+                has_alpha = variant_dict['has_alpha']
+                break
+
+    if surface is None:
+        print(f"WARNING: no prescaled map for {width}x{height}, scaling the full map (run map_pyramid.py)")
+        surface = pygame.image.load(map_file)
+        surface = pygame.transform.scale(surface, (width, height))
+
+    # Match the display pixel format so blits do not convert every pixel
+    if convert and pygame.display.get_surface() is not None:
+        surface = surface.convert_alpha() if has_alpha else surface.convert()
+    return(surface)
+
+
+if __name__ == '__main__':
+    build_map_pyramid()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+City name normalization used to join the location and population data
+
+Lower case, accents removed, apostrophes and hyphens replaced by spaces,
+saint/sainte shortened to st/ste and repeated spaces collapsed.
+
+Gives the same result as the 14 regex passes previously done in clean_population_data
+(kept as normalize_column_regex for tests and benchmarks) with:
+    - a replacement table for the characters replaced before the saint/sainte rule
+    - one compiled regex for saint/sainte
+    - a replacement table for the characters replaced after
+      (kept separate: 'saînt' was not shortened by the old pipeline)
+Names are memoized. New names of a column are normalized together: joined with new lines
+in one string, each step then runs once over the whole text.
+"""
+import re
+
+
+# Characters replaced before the saint/sainte rule in the old pipeline
+# hyphens were replaced after, moving them does not change the word boundaries
+_before_saint_dict = {
+    "'": ' ',
+    '-': ' ',
+    'é': 'e', 'è': 'e', 'ê': 'e', 'ë': 'e',
+    'œ': 'oe',
+    'ñ': 'n',
+    'ÿ': 'y'}
+
+# Characters replaced after the saint/sainte rule
+_after_saint_dict = {
+    'û': 'u', 'ù': 'u', 'ú': 'u', 'ü': 'u',
+    'î': 'i', 'ì': 'i', 'í': 'i', 'ï': 'i',
+    'ô': 'o', 'ò': 'o', 'ó': 'o', 'õ': 'o', 'ö': 'o',
+    'à': 'a', 'â': 'a', 'á': 'a', 'ã': 'a', 'ä': 'a',
+    'ç': 'c'}
+
+# Starting with the literal lets the regex engine jump between candidates,
+# the word boundary before is checked in _replace_saint (much faster than a leading \b)
+_saint_regex = re.compile(r'saint(?:e)?\b')
+_saint_dict = {'saint': 'st', 'sainte': 'ste'}
+
+_memo_dict = {}  # name: normalized name
+
+
+def _replace_chars(text: str, replace_dict: dict[str:str]) -> str:
+    # str.replace is a fast C loop, much faster than str.translate with multi character replacements
+    for char, replacement in replace_dict.items():
+        if char in text:
+            text = text.replace(char, replacement)
+    return(text)
+
+
+def _replace_saint(match: re.Match) -> str:
+    start = match.start()
+    if start > 0:
+        previous_char = match.string[start - 1]
+        if previous_char.isalnum() or previous_char == '_':
+            # same definition of a word character as the regex \b
+            return(match.group(0))
+    return(_saint_dict[match.group(0)])
+
+
+def _normalize_text(text: str) -> str:
+    text = _replace_chars(text.lower(), _before_saint_dict)
+    text = _saint_regex.sub(_replace_saint, text)
+    text = _replace_chars(text, _after_saint_dict)
+    while '  ' in text:
+        text = text.replace('  ', ' ')
+    return(text)
+
+
+def normalize_name(name: str) -> str:
+    '''
+    Normalized version of a city name, eg "Saint-Étienne" --> "st etienne"
+    '''
+    normalized_name = _memo_dict.get(name)
+    if normalized_name is None:
+        normalized_name = _normalize_text(name)
+        _memo_dict[name] = normalized_name
+    return(normalized_name)
+
+
+def normalize_names(name_lst: list[str]) -> list[str]:
+    '''
+    Normalize many names at once
+    '''
+    new_name_lst = [name for name in dict.fromkeys(name_lst) if name not in _memo_dict]
+    if any('\n' in name for name in new_name_lst):
+        # the separator would be changed, one name at a time
+        for name in new_name_lst:
+            normalize_name(name)
+    elif new_name_lst:
+        # new lines are not word characters nor spaces: same result as separate strings
+        normalized_lst = _normalize_text('\n'.join(new_name_lst)).split('\n')
+        _memo_dict.update(zip(new_name_lst, normalized_lst))
+    return([_memo_dict[name] for name in name_lst])
+
+
+def clear_memo() -> None:
+    _memo_dict.clear()
+
+
+def normalize_column(series: 'pd.Series') -> 'pd.Series':
+    '''
+    Normalize a column of names, missing values are kept
+    non string values become NaN like with the pandas str methods
+    '''
+    name_lst = [name for name in series.dropna().unique() if isinstance(name, str)]
+    return(series.map(dict(zip(name_lst, normalize_names(name_lst)))))
+
+
+# Former implementation, reference for the tests and benchmark
+regex_pattern_lst = [
+    [r"[\' ]", " "],
+    [r'[éèêë]','e'],
+    [r'œ','oe'],
+    [r'ñ','n'],
+    [r'ÿ','y'],
+    [r'\bsaint\b','st'],
+    [r'\bsainte\b','ste'],
+    [r'[ûùúü]','u'],
+    [r'[îìíï]','i'],
+    [r'[ôòóõö]','o'],
+    [r'[àâáãä]','a'],
+    [r'[ç]','c'],
+    [r'-',' '],
+    [r' +',' ']]
+
+
+def normalize_column_regex(series: 'pd.Series') -> 'pd.Series':
+    '''
+    One regex pass over the column per pattern (old clean_population_data)
+    '''
+    series = series.str.lower()
+    for search, replace in regex_pattern_lst:
+        series = series.str.replace(search, replace, regex=True)
+    return(series)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Frame timing overlay
+
+Splits every frame of the main loop into phases:
+    wait     sleeping in the scheduler until an event (not work, excluded from the frame time)
+    events   event handling
+    logic    Database and Location work (new target, guess, next round, replay)
+    blit     drawing the dirty areas on the window
+    display  pygame.display.update
+    hud      refreshing this overlay
+    other    the rest of the loop
+Phases can be nested, the time of an inner phase is not counted in the outer one.
+
+Enable with config_dict['perf_hud'] or the GEOGAME_PERF_HUD=1 environment variable,
+toggle in game with F3, F4 dumps the recorded frames to config_dict['perf_csv_file'].
+"""
+import os
+import csv
+import time
+from collections import deque
+import numpy as np
+import pygame
+from text_render import font_registry
+from config import config_dict
+
+
+PHASE_LST = ['wait', 'events', 'logic', 'blit', 'display', 'hud', 'other']
+
+
+class _Phase():
+    '''
+    Context manager timing one phase of the current frame
+    '''
+    def __init__(self, hud: 'PerfHUD', name: str) -> None:
+        self.hud = hud
+        self.name = name
+
+
+    def __enter__(self) -> None:
+        # [name, start time, time spent in nested phases]
+        self.hud.phase_stack.append([self.name, time.perf_counter(), 0.0])
+
+
+    def __exit__(self, *exc_info) -> None:
+        name, start_time, child_time = self.hud.phase_stack.pop()
+        elapsed = time.perf_counter() - start_time
+        self.hud.frame_dict[name] += elapsed - child_time
+        if self.hud.phase_stack:
+            self.hud.phase_stack[-1][2] += elapsed
+
+
+class _NoPhase():
+    '''
+    Do nothing context manager used when the HUD is off
+    '''
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+class PerfHUD():
+    '''
+    Record per phase frame timings and display them on top of the game
+    Usage in the main loop:
+        hud.begin_frame()
+        with hud.phase('events'):
+            ...
+        hud.end_frame()
+    Is a scene element (rect, display) when added to a Scene
+    '''
+    def __init__(
+            self,
+            enabled: bool|None=None,
+            sample_count: int=config_dict['perf_hud_samples'],
+            record_count: int=config_dict['perf_record_frames'],
+            refresh_ms: int=config_dict['perf_hud_refresh_ms'],
+            font_size: int=16
+                ) -> None:
+        if enabled is None:
+            enabled = config_dict['perf_hud'] or os.environ.get('GEOGAME_PERF_HUD', '0') not in ('', '0')
+        self.enabled = enabled
+        self.refresh_ms = refresh_ms
+        self.font_size = font_size
+
+        self.sample_lst = deque(maxlen=sample_count)  # frames displayed in the percentiles
+        self.record_lst = deque(maxlen=record_count)  # frames recorded while enabled, for the csv
+        self.nb_frames = 0
+        self.frame_dict = None
+        self.frame_start = None
+        self.phase_stack = []
+        self.no_phase = _NoPhase()
+
+        # Overlay
+        self.color = (255, 255, 255)
+        self.background_color = (0, 0, 0, 180)
+        self.surface = None
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.last_refresh = 0
+
+
+    def toggle(self) -> None:
+        '''
+        Turn the HUD on or off, takes effect at the next frame
+        '''
+        self.enabled = not self.enabled
+        self.sample_lst.clear()
+
+
+    def phase(self, name: str) -> '_Phase|_NoPhase':
+        if self.frame_dict is None:
+            return(self.no_phase)
+        return(_Phase(self, name))
+
+
+    def begin_frame(self) -> None:
+        if not self.enabled:
+            return
+        self.frame_start = time.perf_counter()
+        self.frame_dict = dict.fromkeys(PHASE_LST, 0.0)
+
+
+    def end_frame(self) -> None:
+        if self.frame_dict is None:
+            return
+        total = time.perf_counter() - self.frame_start
+        self.frame_dict['other'] = max(total - sum(self.frame_dict.values()), 0.0)
+        # ms for every phase, frame time is the work time (without waiting)
+        sample_dict = {name: value * 1000 for name, value in self.frame_dict.items()}
+        sample_dict['frame'] = (total - self.frame_dict['wait']) * 1000
+        sample_dict['interval'] = total * 1000
+        self.sample_lst.append(sample_dict)
+        self.record_lst.append((self.nb_frames, self.frame_start, sample_dict))
+        self.nb_frames += 1
+        self.frame_dict = None
+
+
+    def get_stats(self) -> dict[str:float]:
+        '''
+        FPS, frame time percentiles and mean time of each phase over the last frames (ms)
+        '''
+        if not self.sample_lst:
+            return({})
+        frame_arr = np.array([sample_dict['frame'] for sample_dict in self.sample_lst])
+        interval_arr = np.array([sample_dict['interval'] for sample_dict in self.sample_lst])
+        stat_dict = {
+            'fps': 1000 / interval_arr.mean() if interval_arr.mean() > 0 else 0.0,
+            'p50': np.percentile(frame_arr, 50),
+            'p95': np.percentile(frame_arr, 95),
+            'p99': np.percentile(frame_arr, 99),
+            'max': frame_arr.max()}
+        for name in PHASE_LST:
+            stat_dict[name] = np.mean([sample_dict[name] for sample_dict in self.sample_lst])
+        return(stat_dict)
+
+
+    def get_lines(self) -> list[str]:
+        stat_dict = self.get_stats()
+        if not stat_dict:
+            return(['perf: waiting for frames'])
+        line_lst = [f"{stat_dict['fps']:5.1f} fps  {len(self.sample_lst)} frames",
+                    f"frame p50 {stat_dict['p50']:.2f}  p95 {stat_dict['p95']:.2f}",
+                    f"      p99 {stat_dict['p99']:.2f}  max {stat_dict['max']:.2f} ms"]
+        for name in PHASE_LST:
+            line_lst.append(f"{name:<8} {stat_dict[name]:8.3f} ms")
+        return(line_lst)
+
+
+    def refresh(self, scene: 'Scene', name: str='perf_hud') -> None:
+        '''
+        Redraw the overlay text every refresh_ms, shows or hides it in the scene
+        '''
+        if not self.enabled:
+            if scene.has(name) and scene.visible_dict[name]:
+                scene.hide(name)
+            return
+
+        now = pygame.time.get_ticks()
+        if self.surface is not None and now - self.last_refresh < self.refresh_ms and scene.visible_dict.get(name):
+            return
+        self.last_refresh = now
+
+        # Rendered directly, the numbers change too often for the shared text cache
+        font = font_registry.get_font('freesansbold.ttf', self.font_size, sys_font=False)
+        line_surface_lst = [font.render(line, True, self.color) for line in self.get_lines()]
+        width = max(line_surface.get_width() for line_surface in line_surface_lst) + 10
+        height = sum(line_surface.get_height() for line_surface in line_surface_lst) + 10
+        self.surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.surface.fill(self.background_color)
+        y = 5
+        for line_surface in line_surface_lst:
+            self.surface.blit(line_surface, (5, y))
+            y += line_surface.get_height()
+        self.rect = self.surface.get_rect(bottomleft=scene.window.get_rect().bottomleft)
+
+        if not scene.has(name):
+            scene.add(name, self, layer=10)
+        elif not scene.visible_dict[name]:
+            scene.show(name)
+        else:
+            scene.mark_dirty(name)
+
+
+    def display(self, window: pygame.Surface) -> None:
+        if self.surface is not None:
+            window.blit(self.surface, self.rect)
+
+
+    def dump_csv(self, file: str=config_dict['perf_csv_file']) -> str:
+        '''
+        Write one row per recorded frame, times in ms
+        '''
+        directory = os.path.dirname(file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'time_s', 'interval_ms', 'frame_ms'] + [f'{name}_ms' for name in PHASE_LST])
+            for frame_index, frame_start, sample_dict in self.record_lst:
+                writer.writerow([frame_index, f'{frame_start:.6f}', f"{sample_dict['interval']:.4f}", f"{sample_dict['frame']:.4f}"]
+                                + [f'{sample_dict[name]:.4f}' for name in PHASE_LST])
+        return(file)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Conversion between GPS coordinates (WGS84) and map pixels
+The map image is drawn in the EPSG:3857 projection, pixels are linear in this system
+
+Two backends share the same API:
+    - 'mercator' : closed form spherical Web Mercator in pure python/numpy (default, used by the game)
+    - 'pyproj' : pyproj transformers, kept as the reference implementation
+"""
+import math
+from abc import ABC, abstractmethod
+from functools import lru_cache
+import numpy as np
+from config import config_dict
+
+# Radius of the sphere used by EPSG:3857 (WGS84 semi major axis) in meters
+EARTH_RADIUS_M = 6378137.0
+
+
+class BaseProjection(ABC):
+    '''
+    Hold the map bounds in EPSG:3857 and convert map pixels from/to GPS coordinates
+    Meant to be created once (by GeoMap) and shared by every Location
+    Pixel coordinates are relative to the map (0,0 is the topleft of the map)
+    Subclasses only define how to go from GPS to EPSG:3857 and back (abstract methods)
+    '''
+    def __init__(
+            self,
+            map_width: int=config_dict['MAP_WIDTH'],
+            map_height: int=config_dict['MAP_HEIGHT'],
+            map_lim: dict[str:float]=config_dict['COORD_LIMITS_DICT']
+                ) -> None:
+
+        self.map_width = map_width
+        self.map_height = map_height
+        self.map_lim = map_lim
+
+        # convert map corner coordinates to proj map coord once
+        # x axis is lon and y axis is lat
+        self.xmin_map, self.ymin_map = self.gps2map(self.map_lim['lon_min'], self.map_lim['lat_min'])
+        self.xmax_map, self.ymax_map = self.gps2map(self.map_lim['lon_max'], self.map_lim['lat_max'])
+
+        # Get map scale in map proj unit/px
+        # ymin_map refers to the value at the top of the map and the y scale is negative
+        self.map_scale_x = (self.xmax_map - self.xmin_map) / self.map_width
+        self.map_scale_y = (self.ymax_map - self.ymin_map) / self.map_height
+
+
+    @abstractmethod
+    def gps2map(self, lon: float, lat: float) -> tuple[float, float]:
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def map2gps(self, x_map: float, y_map: float) -> tuple[float, float]:
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def gps2map_array(self, lon: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+
+    @abstractmethod
+    def map2gps_array(self, x_map: np.ndarray, y_map: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+
+    def pixel2gps(self, x: int|float, y: int|float) -> tuple[float, float]:
+        '''
+        Convert map pixel coordinates to GPS (lon, lat)
+        '''
+        # Extrapolate pixels to map proj units (linear in proj system, not linear in GPS system)
+        x_map = self.xmin_map + x * self.map_scale_x
+        y_map = self.ymin_map + y * self.map_scale_y
+        return(self.map2gps(x_map, y_map))
+
+
+    def gps2pixel(self, lon: int|float, lat: int|float) -> tuple[int, int]:
+        '''
+        Convert GPS coordinates (lon, lat) to map pixel coordinates
+        '''
+        x_map, y_map = self.gps2map(lon, lat)
+        x = math.floor((x_map - self.xmin_map) / (self.xmax_map - self.xmin_map) * self.map_width)
+        y = math.floor((y_map - self.ymin_map) / (self.ymax_map - self.ymin_map) * self.map_height)
+        return(x, y)
+
+
+    def pixel2gps_array(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Vectorized pixel2gps, returns arrays of lon and lat
+        '''
+        x_map = self.xmin_map + np.asarray(x, dtype=np.float64) * self.map_scale_x
+        y_map = self.ymin_map + np.asarray(y, dtype=np.float64) * self.map_scale_y
+        return(self.map2gps_array(x_map, y_map))
+
+
+    def gps2pixel_array(self, lon: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Vectorized gps2pixel, returns integer arrays of x and y pixels
+        '''
+        x_map, y_map = self.gps2map_array(np.asarray(lon, dtype=np.float64),
+                                          np.asarray(lat, dtype=np.float64))
+        x = np.floor((x_map - self.xmin_map) / (self.xmax_map - self.xmin_map) * self.map_width)
+        y = np.floor((y_map - self.ymin_map) / (self.ymax_map - self.ymin_map) * self.map_height)
+        return(x.astype(np.int64), y.astype(np.int64))
+
+
+class MercatorProjection(BaseProjection):
+    '''
+    Spherical Web Mercator (EPSG:3857) using its closed form
+        x = R * lon
+        y = R * ln(tan(pi/4 + lat/2))
+    No dependency besides numpy
+    '''
+    def gps2map(self, lon: float, lat: float) -> tuple[float, float]:
+        x_map = EARTH_RADIUS_M * math.radians(lon)
+        y_map = EARTH_RADIUS_M * math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+        return(x_map, y_map)
+
+
+    def map2gps(self, x_map: float, y_map: float) -> tuple[float, float]:
+        lon = math.degrees(x_map / EARTH_RADIUS_M)
+        lat = math.degrees(2 * math.atan(math.exp(y_map / EARTH_RADIUS_M)) - math.pi / 2)
+        return(lon, lat)
+
+
+    def gps2map_array(self, lon: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        x_map = EARTH_RADIUS_M * np.radians(lon)
+        y_map = EARTH_RADIUS_M * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+        return(x_map, y_map)
+
+
+    def map2gps_array(self, x_map: np.ndarray, y_map: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        lon = np.degrees(x_map / EARTH_RADIUS_M)
+        lat = np.degrees(2 * np.arctan(np.exp(y_map / EARTH_RADIUS_M)) - np.pi / 2)
+        return(lon, lat)
+
+
+class PyprojProjection(BaseProjection):
+    '''
+    Reference implementation using pyproj transformers
+    pyproj is only imported when this class is used
+    '''
+    def __init__(self, *args, **kwargs) -> None:
+        from pyproj import CRS, Transformer
+
+        # initialize coord systems
+        self.proj_map = CRS('epsg:3857')
+        self.proj_gps = CRS("WGS84")
+        # create functions to transform coord from one system to another
+        # usage : self.to_gps.transform(map_coord_x, map_coord_y) = (gps_x, gps_y)
+        self.to_gps = Transformer.from_crs(self.proj_map, self.proj_gps, always_xy=True)
+        self.to_map = Transformer.from_crs(self.proj_gps, self.proj_map, always_xy=True)
+        super().__init__(*args, **kwargs)
+
+
+    def gps2map(self, lon: float, lat: float) -> tuple[float, float]:
+        return(self.to_map.transform(lon, lat))
+
+
+    def map2gps(self, x_map: float, y_map: float) -> tuple[float, float]:
+        return(self.to_gps.transform(x_map, y_map))
+
+
+    def gps2map_array(self, lon: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return(self.to_map.transform(lon, lat))
+
+
+    def map2gps_array(self, x_map: np.ndarray, y_map: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return(self.to_gps.transform(x_map, y_map))
+
+
+projection_backend_dict = {
+    'mercator': MercatorProjection,
+    'pyproj': PyprojProjection}
+
+
+def make_projection(
+        map_width: int=config_dict['MAP_WIDTH'],
+        map_height: int=config_dict['MAP_HEIGHT'],
+        map_lim: dict[str:float]=config_dict['COORD_LIMITS_DICT'],
+        backend: str=config_dict['projection_backend']
+            ) -> BaseProjection:
+    '''
+    Create a projection with the requested backend ('mercator' or 'pyproj')
+    '''
+    if backend not in projection_backend_dict:
+        raise ValueError(f"Unknown projection backend: {backend}")
+    return(projection_backend_dict[backend](map_width=map_width,
+                                            map_height=map_height,
+                                            map_lim=map_lim))
+
+
+@lru_cache(maxsize=None)
+def default_projection(
+        map_width: int=config_dict['MAP_WIDTH'],
+        map_height: int=config_dict['MAP_HEIGHT']
+            ) -> BaseProjection:
+    '''
+    Return a shared projection using the map limits from the config file
+    Used when no GeoMap is available
+    '''
+    return(make_projection(map_width=map_width, map_height=map_height))
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Retained scene drawn with dirty rectangles
+
+The scene keeps the elements to display (map, top band, texts, markers, end game window...).
+Any object with a rect attribute and a display(window) method can be an element.
+Elements are only redrawn when they changed: the scene remembers where each element was drawn,
+repaints the old and new areas of changed elements and only sends these areas to pygame.display.update.
+A frame where nothing changed costs nothing.
+"""
+import pygame
+
+
+class Scene():
+    '''
+    Hold the elements to display by name
+    Elements with a higher layer are drawn on top
+    Call mark_dirty(name) after changing an element (text, surface, position...)
+    '''
+    def __init__(self, window: pygame.Surface, background_color: tuple[int, int, int]=(255, 255, 255)) -> None:
+        self.window = window
+        self.background_color = background_color
+
+        self.element_dict = {}  # name: element
+        self.layer_dict = {}  # name: layer
+        self.visible_dict = {}  # name: bool
+        self.drawn_rect_dict = {}  # name: rect where the element is on screen
+        self.dirty_rect_lst = []
+
+        # Draw everything on first render
+        self.dirty_rect_lst.append(self.window.get_rect())
+
+
+    def add(self, name: str, element: object, layer: int=0, visible: bool=True) -> None:
+        '''
+        Add (or replace) an element
+        '''
+        if name in self.element_dict:
+            self.remove(name)
+        self.element_dict[name] = element
+        self.layer_dict[name] = layer
+        self.visible_dict[name] = visible
+        if visible:
+            self.mark_dirty(name)
+
+
+    def remove(self, name: str) -> None:
+        if name not in self.element_dict:
+            return
+        self.hide(name)
+        del self.element_dict[name]
+        del self.layer_dict[name]
+        del self.visible_dict[name]
+
+
+    def has(self, name: str) -> bool:
+        return(name in self.element_dict)
+
+
+    def show(self, name: str) -> None:
+        if not self.visible_dict[name]:
+            self.visible_dict[name] = True
+            self.mark_dirty(name)
+
+
+    def hide(self, name: str) -> None:
+        if self.visible_dict[name]:
+            self.visible_dict[name] = False
+            drawn_rect = self.drawn_rect_dict.pop(name, None)
+            if drawn_rect is not None:
+                self.dirty_rect_lst.append(drawn_rect)
+
+
+    def mark_dirty(self, name: str) -> None:
+        '''
+        The element changed: repaint where it was and where it is now
+        '''
+        if not self.visible_dict[name]:
+            return
+        drawn_rect = self.drawn_rect_dict.get(name)
+        if drawn_rect is not None:
+            self.dirty_rect_lst.append(drawn_rect)
+        new_rect = pygame.Rect(self.element_dict[name].rect)
+        self.dirty_rect_lst.append(new_rect)
+        self.drawn_rect_dict[name] = new_rect
+
+
+    def merge_dirty_rects(self) -> list[pygame.Rect]:
+        '''
+        Union overlapping dirty rects so no area is drawn twice
+        '''
+        window_rect = self.window.get_rect()
+        merged_lst = []
+        for rect in self.dirty_rect_lst:
+            rect = rect.clip(window_rect)
+            if rect.width == 0 or rect.height == 0:
+                continue
+            # Absorb every merged rect touching the new one until none is left
+            overlap_index = rect.collidelist(merged_lst)
+            while overlap_index != -1:
+                rect = rect.union(merged_lst.pop(overlap_index))
+                overlap_index = rect.collidelist(merged_lst)
+            merged_lst.append(rect)
+        return(merged_lst)
+
+
+    def render(self) -> list[pygame.Rect]:
+        '''
+        Redraw the dirty areas on the window
+        return the areas that changed
+        '''
+        if not self.dirty_rect_lst:
+            return([])
+
+        dirty_rect_lst = self.merge_dirty_rects()
+        self.dirty_rect_lst = []
+
+        draw_order = sorted((name for name in self.element_dict if self.visible_dict[name]),
+                            key=lambda name: self.layer_dict[name])
+        for dirty_rect in dirty_rect_lst:
+            self.window.set_clip(dirty_rect)
+            self.window.fill(self.background_color)
+            for name in draw_order:
+                if self.drawn_rect_dict.get(name, dirty_rect).colliderect(dirty_rect):
+                    self.element_dict[name].display(self.window)
+        self.window.set_clip(None)
+        return(dirty_rect_lst)
+
+
+    def update_display(self) -> list[pygame.Rect]:
+        '''
+        Render the dirty areas and only push these to the screen
+        '''
+        dirty_rect_lst = self.render()
+        if dirty_rect_lst:
+            pygame.display.update(dirty_rect_lst)
+        return(dirty_rect_lst)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Headless simulation of full games to measure the game loop
+
+Runs the real Game (main.py) with the SDL dummy video driver and injects synthetic clicks:
+every round the player clicks somewhere on the map, then clicks again to go to the next city,
+at the end of a game the replay button is clicked (quit button after the last game).
+Reports frame time percentiles, per-round latency and memory allocations.
+
+Usage: python simulation.py --games 10
+"""
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import pygame
+from helper import print_color
+
+
+class ClickScript():
+    '''
+    Frame callback posting the synthetic player inputs
+    Waits idle_frames frames between two clicks (frames with no input)
+    '''
+    def __init__(self, nb_games: int=10, idle_frames: int=2, seed: int=0, trace_allocations: bool=True) -> None:
+        self.nb_games = nb_games
+        self.idle_frames = idle_frames
+        self.rng = np.random.default_rng(seed)
+        self.trace_allocations = trace_allocations
+
+        self.nb_finished_games = 0
+        self.frames_to_wait = idle_frames
+        self.last_frame_time = None
+        self.pending_action = None  # action posted at the previous frame
+
+        self.frame_time_lst = []  # ms, all frames
+        self.action_time_dict = {'guess': [], 'next_round': [], 'replay': []}  # ms, frames handling a click
+        self.memory_lst = []  # (current, peak) bytes traced at the end of each game
+
+
+    def post_click(self, pos: tuple[int, int]) -> None:
+        pygame.event.post(pygame.event.Event(pygame.MOUSEMOTION, pos=pos, rel=(0, 0), buttons=(0, 0, 0)))
+        pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=pos, button=1))
+        pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=pos, button=1))
+
+
+    def __call__(self, game: 'Game') -> None:
+        # Time of the previous frame
+        now = time.perf_counter()
+        if self.last_frame_time is not None:
+            frame_time = (now - self.last_frame_time) * 1000
+            self.frame_time_lst.append(frame_time)
+            if self.pending_action is not None:
+                self.action_time_dict[self.pending_action].append(frame_time)
+        self.last_frame_time = now
+        self.pending_action = None
+
+        if self.frames_to_wait > 0:
+            # Idle frame, an empty user event keeps the scheduler from sleeping
+            self.frames_to_wait -= 1
+            pygame.event.post(pygame.event.Event(pygame.USEREVENT))
+            return
+        self.frames_to_wait = self.idle_frames
+
+        if game.has_game_ended:
+            self.nb_finished_games += 1
+            if self.trace_allocations:
+                self.memory_lst.append(tracemalloc.get_traced_memory())
+            if self.nb_finished_games >= self.nb_games:
+                self.post_click(game.quit_button.rect.center)
+                return
+            self.post_click(game.replay_button.rect.center)
+            self.pending_action = 'replay'
+        elif game.has_guessed:
+            # anywhere to go to the next city
+            self.post_click(game.geo_map.rect.center)
+            self.pending_action = 'next_round'
+        else:
+            map_rect = game.geo_map.rect
+            pos = (int(self.rng.integers(map_rect.left, map_rect.right)),
+                   int(self.rng.integers(map_rect.top, map_rect.bottom)))
+            self.post_click(pos)
+            self.pending_action = 'guess'
+
+
+def get_percentiles(time_lst: list[float]) -> dict[str:float]:
+    if not time_lst:
+        return({})
+    time_arr = np.asarray(time_lst)
+    return({'n': len(time_arr),
+            'mean': time_arr.mean(),
+            'p50': np.percentile(time_arr, 50),
+            'p90': np.percentile(time_arr, 90),
+            'p99': np.percentile(time_arr, 99),
+            'max': time_arr.max()})
+
+
+def run_simulation(nb_games: int=10, idle_frames: int=2, seed: int=0, trace_allocations: bool=True) -> dict:
+    '''
+    Play nb_games full games and return the measures
+    '''
+    from main import Game
+
+    if trace_allocations:
+        tracemalloc.start()
+
+    start_time = time.perf_counter()
+    game = Game(seed=seed)
+    startup_time = (time.perf_counter() - start_time) * 1000
+    if trace_allocations:
+        startup_memory = tracemalloc.get_traced_memory()
+        snapshot_before = tracemalloc.take_snapshot()
+
+    script = ClickScript(nb_games=nb_games, idle_frames=idle_frames, seed=seed, trace_allocations=trace_allocations)
+    game.run(frame_callback=script)
+    run_time = (time.perf_counter() - start_time) * 1000 - startup_time
+
+    report_dict = {
+        'nb_games': script.nb_finished_games,
+        'startup_ms': startup_time,
+        'run_ms': run_time,
+        'frame_ms': get_percentiles(script.frame_time_lst),
+        'action_ms': {action: get_percentiles(time_lst) for action, time_lst in script.action_time_dict.items()}}
+
+    if trace_allocations:
+        snapshot_after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        report_dict['startup_memory_kb'] = startup_memory[0] / 1024
+        report_dict['game_memory_kb'] = [current / 1024 for current, peak in script.memory_lst]
+        report_dict['peak_memory_kb'] = max([peak for current, peak in script.memory_lst] + [startup_memory[1]]) / 1024
+        # Allocation sites that grew the most while playing
+        report_dict['top_allocations'] = [str(stat) for stat in snapshot_after.compare_to(snapshot_before, 'lineno')[:10]]
+
+    pygame.quit()
+    return(report_dict)
+
+
+def print_percentiles(name: str, percentile_dict: dict[str:float]) -> None:
+    if not percentile_dict:
+        return
+    print(f"{name:<12} n={percentile_dict['n']:<6} mean={percentile_dict['mean']:8.3f}  p50={percentile_dict['p50']:8.3f}  "
+          f"p90={percentile_dict['p90']:8.3f}  p99={percentile_dict['p99']:8.3f}  max={percentile_dict['max']:8.3f} ms")
+
+
+def print_report(report_dict: dict) -> None:
+    print_color(f"{report_dict['nb_games']} games, startup {report_dict['startup_ms']:.1f} ms, run {report_dict['run_ms']:.1f} ms", color='green')
+    print_percentiles('frame', report_dict['frame_ms'])
+    for action, percentile_dict in report_dict['action_ms'].items():
+        print_percentiles(action, percentile_dict)
+    if 'peak_memory_kb' in report_dict:
+        print(f"memory: startup {report_dict['startup_memory_kb']:.1f} kB, peak {report_dict['peak_memory_kb']:.1f} kB")
+        print('memory at the end of each game (kB):', ' '.join(f'{value:.1f}' for value in report_dict['game_memory_kb']))
+        print('top allocation growth while playing:')
+        for line in report_dict['top_allocations']:
+            print('   ', line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless simulation of GeoGame games')
+    parser.add_argument('--games', type=int, default=10, help='number of full games to play')
+    parser.add_argument('--idle-frames', type=int, default=2, help='frames without input between two clicks')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the cities and the clicks')
+    parser.add_argument('--no-alloc', action='store_true', help='do not trace memory allocations (faster)')
+    args = parser.parse_args()
+
+    print_report(run_simulation(nb_games=args.games,
+                                idle_frames=args.idle_frames,
+                                seed=args.seed,
+                                trace_allocations=not args.no_alloc))
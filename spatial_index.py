@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial index to find the communes closest to a GPS position
+
+Cities are bucketed in a regular lon/lat grid (cells of cell_size degrees).
+A query looks at growing rings of cells around the query cell and stops once the k-th candidate is closer
+than anything that could be outside the visited cells.
+Candidates are ranked with unit-sphere vectors (dot product), the returned distances are haversine distances.
+Batched queries are grouped by grid cell so each cell is only searched once.
+The coordinates are not copied (they can be the memory-mapped float32 columns of the city store):
+the unit vectors of the candidates are computed in float64 by each query, only the grid is kept in memory.
+"""
+import math
+import numpy as np
+from geo_math import haversine_array
+
+# Same earth radius as haversine
+EARTH_RADIUS_KM = 6371.0
+# km for one degree of latitude
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+
+def to_unit_vector(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    '''
+    Convert degrees to (x, y, z) positions on the unit sphere, shape (n, 3)
+    '''
+    lon_rad = np.radians(lon)
+    lat_rad = np.radians(lat)
+    cos_lat = np.cos(lat_rad)
+    return(np.stack([cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad), np.sin(lat_rad)], axis=-1))
+
+
+class SpatialIndex():
+    '''
+    Grid index over city coordinates (in degrees)
+    Points of cell c are point_order[cell_start[c]:cell_start[c + 1]]
+    '''
+    def __init__(self, lon: np.ndarray, lat: np.ndarray, cell_size: float=0.1) -> None:
+        self.lon = np.asarray(lon)
+        self.lat = np.asarray(lat)
+        self.nb_points = len(self.lon)
+        self.cell_size = cell_size
+
+        # Grid bounds
+        self.lon_min = float(self.lon.min())
+        self.lat_min = float(self.lat.min())
+        self.nb_cell_x = int((float(self.lon.max()) - self.lon_min) // cell_size) + 1
+        self.nb_cell_y = int((float(self.lat.max()) - self.lat_min) // cell_size) + 1
+
+        # Smallest cos(lat) in the grid, converts a longitude gap to a minimal distance
+        self.lat_abs_max = max(abs(self.lat_min), abs(float(self.lat.max())))
+
+        # Sort points by cell
+        cell_x, cell_y = self.get_cell(self.lon.astype(np.float64), self.lat.astype(np.float64))
+        cell_id = cell_y * self.nb_cell_x + cell_x
+        self.point_order = np.argsort(cell_id, kind='stable').astype(np.int32)
+        self.cell_start = np.searchsorted(cell_id[self.point_order],
+                                          np.arange(self.nb_cell_x * self.nb_cell_y + 1)).astype(np.int32)
+
+
+    @property
+    def nbytes(self) -> int:
+        '''
+        Memory of the grid (the coordinates are not copied)
+        '''
+        return(self.point_order.nbytes + self.cell_start.nbytes)
+
+
+    def get_coordinates(self, index: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        float64 lon and lat of some points
+        '''
+        return(self.lon[index].astype(np.float64), self.lat[index].astype(np.float64))
+
+
+    def get_unit_vectors(self, index: np.ndarray) -> np.ndarray:
+        '''
+        Position on the unit sphere of some points, the closest point has the largest dot product
+        '''
+        return(to_unit_vector(*self.get_coordinates(index)))
+
+
+    def get_cell(self, lon: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        return the grid cell of positions, positions outside the grid go to the closest border cell
+        '''
+        cell_x = np.floor((lon - self.lon_min) / self.cell_size).astype(np.int64)
+        cell_y = np.floor((lat - self.lat_min) / self.cell_size).astype(np.int64)
+        return(np.clip(cell_x, 0, self.nb_cell_x - 1), np.clip(cell_y, 0, self.nb_cell_y - 1))
+
+
+    def get_points_in_box(self, x_min: int, x_max: int, y_min: int, y_max: int) -> np.ndarray:
+        '''
+        return the points of the cells in the box (bounds included)
+        '''
+        row_start = np.arange(y_min, y_max + 1) * self.nb_cell_x
+        start_arr = self.cell_start[row_start + x_min]
+        end_arr = self.cell_start[row_start + x_max + 1]
+        # cells of a grid row are contiguous in point_order
+        return(np.concatenate([self.point_order[start:end] for start, end in zip(start_arr, end_arr)]))
+
+
+    def get_outside_distance(self, lon: np.ndarray|float, lat: np.ndarray|float, x_min: int, x_max: int, y_min: int, y_max: int, cos_min: float) -> np.ndarray|float:
+        '''
+        Lower bound of the distance in km from positions to any point outside a box of cells
+        Sides of the box on the grid border are ignored (no point beyond), inf if the box is the whole grid
+        '''
+        outside_distance = np.inf
+        if x_min > 0:
+            outside_distance = np.minimum(outside_distance, (lon - (self.lon_min + x_min * self.cell_size)) * KM_PER_DEGREE * cos_min)
+        if x_max < self.nb_cell_x - 1:
+            outside_distance = np.minimum(outside_distance, (self.lon_min + (x_max + 1) * self.cell_size - lon) * KM_PER_DEGREE * cos_min)
+        if y_min > 0:
+            outside_distance = np.minimum(outside_distance, (lat - (self.lat_min + y_min * self.cell_size)) * KM_PER_DEGREE)
+        if y_max < self.nb_cell_y - 1:
+            outside_distance = np.minimum(outside_distance, (self.lat_min + (y_max + 1) * self.cell_size - lat) * KM_PER_DEGREE)
+        return(outside_distance)
+
+
+    def query_cell(self, lon: np.ndarray, lat: np.ndarray, cell_x: int, cell_y: int, k: int) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        k nearest points of queries that share the same grid cell
+        return distances in km and indices, both of shape (nb_query, k) sorted by distance
+        '''
+        cos_min = math.cos(math.radians(max(self.lat_abs_max, np.abs(lat).max())))
+        query_xyz = to_unit_vector(lon, lat)
+        ring = 1
+        while True:
+            x_min = max(cell_x - ring, 0)
+            x_max = min(cell_x + ring, self.nb_cell_x - 1)
+            y_min = max(cell_y - ring, 0)
+            y_max = min(cell_y + ring, self.nb_cell_y - 1)
+            candidates = self.get_points_in_box(x_min, x_max, y_min, y_max)
+            is_whole_grid = (x_min == 0 and y_min == 0
+                             and x_max == self.nb_cell_x - 1 and y_max == self.nb_cell_y - 1)
+
+            if len(candidates) >= k:
+                dot = query_xyz @ self.get_unit_vectors(candidates).T
+                nearest = np.argpartition(-dot, k - 1, axis=1)[:, :k]
+
+                if is_whole_grid:
+                    break
+
+                # Angle to the k-th candidate in km
+                kth_dot = np.take_along_axis(dot, nearest, axis=1).min(axis=1)
+                kth_distance = np.arccos(np.clip(kth_dot, -1, 1)) * EARTH_RADIUS_KM
+
+                outside_distance = self.get_outside_distance(lon, lat, x_min, x_max, y_min, y_max, cos_min)
+
+                if np.all(kth_distance <= outside_distance):
+                    break
+            ring *= 2
+
+        # Haversine distance of the k nearest, sorted
+        nearest = candidates[nearest]
+        nearest_distance = haversine_array(lon[:, None], lat[:, None], *self.get_coordinates(nearest))
+        order = np.argsort(nearest_distance, axis=1, kind='stable')
+        nearest_distance = np.take_along_axis(nearest_distance, order, axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        return(nearest_distance, nearest)
+
+
+    def query(self, lon: float, lat: float, k: int=1) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        k nearest points of one position
+        return distances in km and indices (arrays of size k) sorted by distance
+        Same search as query_cell with python scalars for the per-query work
+        '''
+        k = min(k, self.nb_points)
+        cell_x = min(max(math.floor((lon - self.lon_min) / self.cell_size), 0), self.nb_cell_x - 1)
+        cell_y = min(max(math.floor((lat - self.lat_min) / self.cell_size), 0), self.nb_cell_y - 1)
+        cos_min = math.cos(math.radians(max(self.lat_abs_max, abs(lat))))
+        cos_lat = math.cos(math.radians(lat))
+        sin_lat = math.sin(math.radians(lat))
+        ring = 1
+        while True:
+            x_min = max(cell_x - ring, 0)
+            x_max = min(cell_x + ring, self.nb_cell_x - 1)
+            y_min = max(cell_y - ring, 0)
+            y_max = min(cell_y + ring, self.nb_cell_y - 1)
+            candidates = self.get_points_in_box(x_min, x_max, y_min, y_max)
+
+            if len(candidates) >= k:
+                # dot product of the unit vectors, without building them
+                candidate_lon, candidate_lat = self.get_coordinates(candidates)
+                candidate_lat = np.radians(candidate_lat)
+                dot = cos_lat * np.cos(candidate_lat) * np.cos(np.radians(candidate_lon - lon)) + sin_lat * np.sin(candidate_lat)
+                if k == 1:
+                    nearest = dot.argmax(keepdims=True)
+                else:
+                    nearest = np.argpartition(-dot, k - 1)[:k]
+                kth_distance = math.acos(min(float(dot[nearest].min()), 1.0)) * EARTH_RADIUS_KM
+                if kth_distance <= self.get_outside_distance(lon, lat, x_min, x_max, y_min, y_max, cos_min):
+                    break
+            ring *= 2
+
+        # Haversine distance of the k nearest, sorted
+        nearest = candidates[nearest]
+        nearest_distance = haversine_array(lon, lat, *self.get_coordinates(nearest))
+        order = np.argsort(nearest_distance, kind='stable')
+        return(nearest_distance[order], nearest[order])
+
+
+    def query_batch(self, lon: np.ndarray, lat: np.ndarray, k: int=1) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        k nearest points for an array of positions
+        return distances in km and indices of shape (nb_query, k) sorted by distance
+        '''
+        k = min(k, self.nb_points)
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        distance = np.empty((len(lon), k), dtype=np.float64)
+        index = np.empty((len(lon), k), dtype=np.int64)
+
+        # Group queries by cell to search each cell once
+        cell_x, cell_y = self.get_cell(lon, lat)
+        cell_id = cell_y * self.nb_cell_x + cell_x
+        query_order = np.argsort(cell_id, kind='stable')
+        unique_cell, group_start = np.unique(cell_id[query_order], return_index=True)
+        group_end = np.r_[group_start[1:], len(query_order)]
+
+        for cell, start, end in zip(unique_cell.tolist(), group_start.tolist(), group_end.tolist()):
+            query_index = query_order[start:end]
+            distance[query_index], index[query_index] = self.query_cell(
+                lon[query_index], lat[query_index], cell % self.nb_cell_x, cell // self.nb_cell_x, k)
+        return(distance, index)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Startup timing (python main.py --startup-report)
+
+Records the import time of each module (its own time, without the modules it imports)
+and the time of each initialisation step until the first frame is on screen.
+Only the standard library is imported here so it can be loaded before everything else.
+"""
+import sys
+import time
+import builtins
+
+
+class StartupReport():
+    '''
+    Usage:
+        startup_report.start()                 # before the imports to time
+        import ...
+        startup_report.stop_import_timing()
+        startup_report.mark('step name')       # after each initialisation step
+    Does nothing unless started
+    '''
+    def __init__(self) -> None:
+        self.enabled = False
+        self.start_time = None
+        self.last_mark_time = None
+        self.import_time_dict = {}  # module: own import time (s)
+        self.step_lst = []  # (step, time since previous step (s))
+        self.import_stack = []  # [module, time spent importing nested modules]
+        self.original_import = None
+
+
+    def start(self) -> None:
+        self.enabled = True
+        self.start_time = time.perf_counter()
+        self.last_mark_time = self.start_time
+        self.original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level != 0 or name in sys.modules:
+            # relative or already loaded, nothing to time
+            return(self.original_import(name, globals, locals, fromlist, level))
+
+        self.import_stack.append([name, 0.0])
+        start_time = time.perf_counter()
+        try:
+            return(self.original_import(name, globals, locals, fromlist, level))
+        finally:
+            elapsed = time.perf_counter() - start_time
+            _, child_time = self.import_stack.pop()
+            self.import_time_dict[name] = self.import_time_dict.get(name, 0.0) + elapsed - child_time
+            if self.import_stack:
+                self.import_stack[-1][1] += elapsed
+
+
+    def stop_import_timing(self) -> None:
+        if self.original_import is not None:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+        self.mark('imports')
+
+
+    def mark(self, step: str) -> None:
+        '''
+        End of an initialisation step
+        '''
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.step_lst.append((step, now - self.last_mark_time))
+        self.last_mark_time = now
+
+
+    def print_report(self, nb_modules: int=15) -> None:
+        if not self.enabled:
+            return
+        print(f"{'module':<40} {'import (ms)':>12}")
+        import_time_lst = sorted(self.import_time_dict.items(), key=lambda item: item[1], reverse=True)
+        for module, import_time in import_time_lst[:nb_modules]:
+            print(f'{module:<40} {import_time * 1000:>12.1f}')
+        print(f"{'(' + str(len(import_time_lst)) + ' modules)':<40} {sum(self.import_time_dict.values()) * 1000:>12.1f}")
+        print()
+        print(f"{'step':<40} {'time (ms)':>12}")
+        for step, step_time in self.step_lst:
+            print(f'{step:<40} {step_time * 1000:>12.1f}')
+        print(f"{'launch to first frame':<40} {(self.last_mark_time - self.start_time) * 1000:>12.1f}")
+
+
+# Process wide instance
+startup_report = StartupReport()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fonts and rendered text surfaces
+
+Loading a font and rendering text are slow compared to a blit, and the same texts are drawn every frame.
+Fonts are loaded once per (name, size) and rendered surfaces are kept in a LRU cache.
+Cached surfaces are shared: they must not be drawn on, copy them first if needed.
+"""
+from collections import OrderedDict
+import pygame
+from config import config_dict
+
+
+class FontRegistry():
+    '''
+    Load each font once
+    sys_font=True uses pygame.font.SysFont (font name), otherwise pygame.font.Font (font file)
+    '''
+    def __init__(self) -> None:
+        self.font_dict = {}
+
+
+    def get_font(self, font_name: str, font_size: int, sys_font: bool=True) -> pygame.font.Font:
+        key = (font_name, int(font_size), sys_font)
+        font = self.font_dict.get(key)
+        if font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            if sys_font:
+                font = pygame.font.SysFont(font_name, int(font_size))
+            else:
+                font = pygame.font.Font(font_name, int(font_size))
+            self.font_dict[key] = font
+        return(font)
+
+
+class TextRenderCache():
+    '''
+    LRU cache of rendered text surfaces keyed by (text, font, size, color, antialias)
+    Keeps count of hits and misses
+    '''
+    def __init__(self, font_registry: FontRegistry, max_size: int=config_dict['text_cache_size']) -> None:
+        self.font_registry = font_registry
+        self.max_size = max_size
+        self.surface_dict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def render(
+            self,
+            text: str,
+            font_name: str,
+            font_size: int,
+            color: tuple[int, int, int],
+            antialias: bool=True,
+            sys_font: bool=True
+                ) -> pygame.Surface:
+        '''
+        Return the rendered surface of the text, rendering it only if not in cache
+        '''
+        key = (text, font_name, int(font_size), tuple(color), antialias, sys_font)
+        surface = self.surface_dict.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surface_dict.move_to_end(key)
+            return(surface)
+
+        self.misses += 1
+        font = self.font_registry.get_font(font_name, font_size, sys_font=sys_font)
+        surface = font.render(text, antialias, color)
+        self.surface_dict[key] = surface
+        if len(self.surface_dict) > self.max_size:
+            # remove least recently used
+            self.surface_dict.popitem(last=False)
+        return(surface)
+
+
+    def stats(self) -> dict[str:int]:
+        return({'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.surface_dict),
+                'max_size': self.max_size,
+                'fonts': len(self.font_registry.font_dict)})
+
+
+    def clear(self) -> None:
+        self.surface_dict.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# Process wide instances
+font_registry = FontRegistry()
+text_render_cache = TextRenderCache(font_registry)
+
+
+def render_text(topleft_x:int, topleft_y:int, text:int, font_name:str, font_size:int, color:str) -> tuple[pygame.Surface, pygame.Rect]:
+    '''
+    Display some text
+    Pass argument as a dict with following keys:
+        font, font_size, text, topleft_x, topleft_y, color
+    '''
+    # Load arg
+    x = topleft_x
+    y = topleft_y
+    textMessage = text
+    fontName = font_name
+    fontSize = font_size
+    colorMessage = color
+
+    # Create text objects (fonts and surfaces are cached)
+    text_surface = text_render_cache.render(textMessage, fontName, fontSize, colorMessage)
+    text_rect = text_surface.get_rect()
+    text_rect.topleft = (x, y)
+    return(text_surface, text_rect)
@@ -3,9 +3,14 @@
 For individual tests
 """
 
+import json
 from gui_classes import Location, GeoMap
 from config import config_dict, print_color_dict
 from helper import print_color
+from geo_math import haversine, haversine_array, calculate_score, calculate_score_array
+from projection import MercatorProjection, PyprojProjection
+import numpy as np
+import pandas as pd
     
 
 def test_Location_pixel2gps_ifPixelInput() -> None:
@@ -102,6 +107,577 @@ def test_Location_gps2pixel_ifPixelInput() -> None:
         print_color("Location_gps2pixel_ifPixelInput: FAIL", color = "red")
 
 
+def test_Location_sharesGeoMapProjection() -> None:
+    geo_map = GeoMap()
+    loc_a = Location(loc=(0,0), geo_map=geo_map, coord_type="gps")
+    loc_b = Location(loc=(100,100), geo_map=geo_map, coord_type="pixel")
+    if loc_a.projection is geo_map.projection and loc_b.projection is geo_map.projection:
+        print_color("Location_sharesGeoMapProjection: OK", color = "green")
+    else:
+        print_color("Location_sharesGeoMapProjection: FAIL", color = "red")
+
+
+def test_MercatorProjection_matchesPyproj() -> None:
+    # Compare the built-in mercator with pyproj over the whole map box
+    mercator = MercatorProjection()
+    reference = PyprojProjection()
+    lim = config_dict['COORD_LIMITS_DICT']
+    lon, lat = np.meshgrid(np.linspace(lim['lon_min'], lim['lon_max'], 200),
+                           np.linspace(lim['lat_min'], lim['lat_max'], 200))
+    lon = lon.ravel()
+    lat = lat.ravel()
+
+    # GPS to EPSG:3857, error in meters
+    x_map, y_map = mercator.gps2map_array(lon, lat)
+    x_ref, y_ref = reference.gps2map_array(lon, lat)
+    map_error = max(np.abs(x_map - x_ref).max(), np.abs(y_map - y_ref).max())
+
+    # EPSG:3857 to GPS, error in degrees
+    lon_back, lat_back = mercator.map2gps_array(x_ref, y_ref)
+    gps_error = max(np.abs(lon_back - lon).max(), np.abs(lat_back - lat).max())
+
+    # Scalar path gives the same pixels
+    nb_diff = 0
+    for i in range(0, len(lon), 97):
+        if mercator.gps2pixel(lon[i], lat[i]) != reference.gps2pixel(lon[i], lat[i]):
+            nb_diff += 1
+
+    if map_error < 1e-3 and gps_error < 1e-9 and nb_diff == 0:
+        print_color("MercatorProjection_matchesPyproj: OK", color = "green")
+    else:
+        print_color("MercatorProjection_matchesPyproj: FAIL", color = "red")
+        print('max error in m:', map_error, '--- max error in degrees:', gps_error, '--- pixel mismatches:', nb_diff)
+
+
+def test_BaseProjection_incompleteSubclassFails() -> None:
+    from projection import BaseProjection
+    class ScalarOnlyProjection(BaseProjection):
+        def gps2map(self, lon: float, lat: float) -> tuple[float, float]:
+            return(lon, lat)
+
+        def map2gps(self, x_map: float, y_map: float) -> tuple[float, float]:
+            return(x_map, y_map)
+    try:
+        ScalarOnlyProjection()
+        print_color("BaseProjection_incompleteSubclassFails: FAIL", color = "red")
+    except TypeError:
+        print_color("BaseProjection_incompleteSubclassFails: OK", color = "green")
+
+
+def test_MercatorProjection_arrayMatchesScalar() -> None:
+    mercator = MercatorProjection()
+    x = np.arange(0, config_dict['MAP_WIDTH'], 7)
+    y = np.arange(0, config_dict['MAP_HEIGHT'], 7)
+    lon, lat = mercator.pixel2gps_array(x, y)
+    scalar_lst = [mercator.pixel2gps(x_i, y_i) for x_i, y_i in zip(x, y)]
+    x_back, y_back = mercator.gps2pixel_array(lon, lat)
+    scalar_pixel_lst = [mercator.gps2pixel(lon_i, lat_i) for lon_i, lat_i in zip(lon, lat)]
+    if (np.allclose(lon, [elem[0] for elem in scalar_lst], rtol=0, atol=1e-12)
+        and np.allclose(lat, [elem[1] for elem in scalar_lst], rtol=0, atol=1e-12)
+        and list(zip(x_back.tolist(), y_back.tolist())) == scalar_pixel_lst):
+        print_color("MercatorProjection_arrayMatchesScalar: OK", color = "green")
+    else:
+        print_color("MercatorProjection_arrayMatchesScalar: FAIL", color = "red")
+
+
+def test_haversine_array_matchesScalar() -> None:
+    # N guesses vs N targets and one guess vs all targets
+    rng = np.random.default_rng(0)
+    lim = config_dict['COORD_LIMITS_DICT']
+    lon1, lon2 = rng.uniform(lim['lon_min'], lim['lon_max'], (2, 10000))
+    lat1, lat2 = rng.uniform(lim['lat_max'], lim['lat_min'], (2, 10000))
+
+    distance_arr = haversine_array(lon1, lat1, lon2, lat2)
+    one_vs_all_arr = haversine_array(lon1[0], lat1[0], lon2, lat2)
+    distance_lst = [haversine(*elem) for elem in zip(lon1, lat1, lon2, lat2)]
+    one_vs_all_lst = [haversine(lon1[0], lat1[0], *elem) for elem in zip(lon2, lat2)]
+
+    # numpy and math can differ on the last bit of atan2
+    if (np.allclose(distance_arr, distance_lst, rtol=1e-12, atol=0)
+        and np.allclose(one_vs_all_arr, one_vs_all_lst, rtol=1e-12, atol=0)):
+        print_color("haversine_array_matchesScalar: OK", color = "green")
+    else:
+        print_color("haversine_array_matchesScalar: FAIL", color = "red")
+
+
+def test_calculate_score_array_matchesScalar() -> None:
+    distance_arr = np.round(np.random.default_rng(0).uniform(0, 1500, 10000), 1)
+    distance_arr[:3] = [0, 200, 1500]
+    score_arr = calculate_score_array(distance_arr, config_dict)
+    score_lst = [calculate_score(distance, config_dict) for distance in distance_arr]
+    if score_arr.tolist() == score_lst:
+        print_color("calculate_score_array_matchesScalar: OK", color = "green")
+    else:
+        print_color("calculate_score_array_matchesScalar: FAIL", color = "red")
+
+
+def test_CityStore_matchesCsv() -> None:
+    from city_store import load_city_store
+    store_df = load_city_store().to_dataframe()
+    csv_df = pd.read_csv(config_dict['city_data_file'], sep=";", header=0, dtype={'department_number': str})
+    try:
+        pd.testing.assert_frame_equal(store_df, csv_df, check_dtype=False)
+        print_color("CityStore_matchesCsv: OK", color = "green")
+    except AssertionError as error:
+        print_color("CityStore_matchesCsv: FAIL", color = "red")
+        print(error)
+
+
+def test_Database_defaultPoolMatchesPandas() -> None:
+    # Default pool must be the same as the former pandas sort + groupby selection
+    from database_class import Database
+    database = Database()
+    csv_df = pd.read_csv(config_dict['city_data_file'], sep=";", header=0, dtype={'department_number': str})
+    csv_df = csv_df.sort_values(by = ['department_number', 'city_population'], ascending = [True, False])
+    expected_index = csv_df.groupby('department_number').head(database.rule.rule_lst[0].top_n).index.to_list()
+    if database.city_index.tolist() == expected_index:
+        print_color("Database_defaultPoolMatchesPandas: OK", color = "green")
+    else:
+        print_color("Database_defaultPoolMatchesPandas: FAIL", color = "red")
+
+
+def test_RoundSampler_noRepeatAndSeeded() -> None:
+    from database_class import RoundSampler
+    pool = np.arange(100, 200)
+    sampler = RoundSampler(pool, seed=42)
+    first_game = [sampler.draw() for i in range(len(pool))]
+    sampler.shuffle(seed=42)
+    replayed_game = [sampler.draw() for i in range(len(pool))]
+    if sorted(first_game) == pool.tolist() and first_game == replayed_game:
+        print_color("RoundSampler_noRepeatAndSeeded: OK", color = "green")
+    else:
+        print_color("RoundSampler_noRepeatAndSeeded: FAIL", color = "red")
+
+
+def test_SpatialIndex_matchesBruteForce() -> None:
+    from city_store import load_city_store
+    from spatial_index import SpatialIndex
+    store = load_city_store()
+    # index on the float32 store columns, reference computed in float64
+    spatial_index = SpatialIndex(store['longitude'], store['latitude'])
+    lon = np.asarray(store['longitude'], dtype=np.float64)
+    lat = np.asarray(store['latitude'], dtype=np.float64)
+
+    # Clicks over the whole map, including the sea
+    rng = np.random.default_rng(0)
+    lim = config_dict['COORD_LIMITS_DICT']
+    query_lon = rng.uniform(lim['lon_min'], lim['lon_max'], 200)
+    query_lat = rng.uniform(lim['lat_max'], lim['lat_min'], 200)
+    batch_distance, batch_index = spatial_index.query_batch(query_lon, query_lat, k=3)
+
+    nb_ok = 0
+    for i in range(len(query_lon)):
+        expected_distance = np.sort(haversine_array(query_lon[i], query_lat[i], lon, lat))[:3]
+        distance, index = spatial_index.query(query_lon[i], query_lat[i], k=3)
+        if (np.allclose(distance, expected_distance) and np.allclose(batch_distance[i], expected_distance)
+            and index.tolist() == batch_index[i].tolist()):
+            nb_ok += 1
+
+    if nb_ok == len(query_lon):
+        print_color("SpatialIndex_matchesBruteForce: OK", color = "green")
+    else:
+        print_color("SpatialIndex_matchesBruteForce: FAIL", color = "red")
+
+
+def test_Text_updateUsesRenderCache() -> None:
+    from gui_classes import Text
+    from text_render import text_render_cache
+    text = Text(text="cache test", color=(1, 2, 3))
+    surface = text.surface
+    stats_before = text_render_cache.stats()
+    for i in range(10):
+        text.update()  # unchanged text: no render at all
+    text.text = "cache test 2"
+    text.update()
+    text.text = "cache test"
+    text.update()  # previous text: served from cache
+    stats_after = text_render_cache.stats()
+    if (text.surface is surface and stats_after['misses'] - stats_before['misses'] == 1
+        and stats_after['hits'] - stats_before['hits'] == 1):
+        print_color("Text_updateUsesRenderCache: OK", color = "green")
+    else:
+        print_color("Text_updateUsesRenderCache: FAIL", color = "red")
+
+
+def test_Scene_dirtyRenderMatchesFullRedraw() -> None:
+    import pygame
+    from gui_classes import Text, FakeWindow
+    from scene import Scene
+    window = pygame.Surface((200, 200))
+    scene = Scene(window, background_color=(255, 255, 255))
+    box = FakeWindow(x=20, y=20, width=100, height=60, color=(0, 0, 255))
+    text = Text(text="12", x=30, y=30, color=(255, 0, 0))
+    scene.add('box', box, layer=0)
+    scene.add('text', text, layer=1)
+    first_rect_lst = scene.render()
+
+    # Change the text, move the box and render only what changed
+    text.text = "123456"
+    text.update()
+    scene.mark_dirty('text')
+    box.rect.topleft = (60, 90)
+    scene.mark_dirty('box')
+    dirty_rect_lst = scene.render()
+    idle_rect_lst = scene.render()
+
+    expected = pygame.Surface((200, 200))
+    expected.fill((255, 255, 255))
+    box.display(expected)
+    text.display(expected)
+
+    if (pygame.image.tobytes(window, 'RGB') == pygame.image.tobytes(expected, 'RGB')
+        and first_rect_lst == [window.get_rect()] and dirty_rect_lst and not idle_rect_lst):
+        print_color("Scene_dirtyRenderMatchesFullRedraw: OK", color = "green")
+    else:
+        print_color("Scene_dirtyRenderMatchesFullRedraw: FAIL", color = "red")
+
+
+def test_FrameScheduler_idleWaitsForEvents() -> None:
+    import os
+    import time
+    import pygame
+    from frame_scheduler import FrameScheduler
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.event.clear()
+    scheduler = FrameScheduler(max_fps=60, idle_timeout_ms=0)
+
+    # A posted event wakes the idle loop right away
+    pygame.event.post(pygame.event.Event(pygame.USEREVENT))
+    event_lst = scheduler.get_events()
+    # Nothing posted: sleep until the scheduled wake up
+    scheduler.schedule_wakeup(50)
+    start_time = time.perf_counter()
+    wakeup_event_lst = scheduler.get_events()
+    wakeup_time = time.perf_counter() - start_time
+
+    if ([event.type for event in event_lst] == [pygame.USEREVENT] and wakeup_event_lst == []
+        and 0.03 < wakeup_time < 0.5 and not scheduler.is_active() and scheduler.wakeup_lst == []):
+        print_color("FrameScheduler_idleWaitsForEvents: OK", color = "green")
+    else:
+        print_color("FrameScheduler_idleWaitsForEvents: FAIL", color = "red")
+
+
+def test_AssetManager_sharesScaledSurfaces() -> None:
+    from asset_manager import AssetManager
+    manager = AssetManager()
+    marker_file = config_dict['target_marker_file']
+    surface_a = manager.get_scaled(marker_file, (24, 45.6))
+    surface_b = manager.get_scaled(marker_file, (24.0, 45))
+    report_lst = manager.report()
+    if surface_a is surface_b and surface_a.get_size() == (24, 45) and len(report_lst) == 2:
+        print_color("AssetManager_sharesScaledSurfaces: OK", color = "green")
+    else:
+        print_color("AssetManager_sharesScaledSurfaces: FAIL", color = "red")
+
+
+def test_simulation_playsFullGames() -> None:
+    from simulation import run_simulation
+    report_dict = run_simulation(nb_games=2, idle_frames=1, seed=0, trace_allocations=False)
+    nb_rounds = 2 * config_dict['max_game_number']
+    if (report_dict['nb_games'] == 2
+            and report_dict['action_ms']['guess']['n'] == nb_rounds
+            and report_dict['action_ms']['next_round']['n'] == nb_rounds
+            and report_dict['action_ms']['replay']['n'] == 1):
+        print_color("simulation_playsFullGames: OK", color = "green")
+    else:
+        print_color("simulation_playsFullGames: FAIL", color = "red")
+
+
+def test_compare_to_baseline_flagsRegressions() -> None:
+    from benchmark import compare_to_baseline
+    baseline_dict = {'fast': 10.0, 'same': 10.0, 'slow': 10.0}
+    result_dict = {'fast': 5.0, 'same': 11.0, 'slow': 13.0, 'new': 1.0}
+    regression_lst = compare_to_baseline(result_dict, baseline_dict, tolerance=0.25)
+    if regression_lst == ['slow']:
+        print_color("compare_to_baseline_flagsRegressions: OK", color = "green")
+    else:
+        print_color("compare_to_baseline_flagsRegressions: FAIL", color = "red")
+
+
+def test_PerfHUD_nestedPhasesNotCountedTwice() -> None:
+    import time
+    from perf_hud import PerfHUD
+    hud = PerfHUD(enabled=True)
+    hud.begin_frame()
+    with hud.phase('events'):
+        time.sleep(0.01)
+        with hud.phase('logic'):
+            time.sleep(0.02)
+    hud.end_frame()
+    sample_dict = hud.sample_lst[-1]
+    phase_sum = sum(sample_dict[name] for name in ['wait', 'events', 'logic', 'blit', 'display', 'hud', 'other'])
+    if (9 < sample_dict['events'] < 19
+            and 19 < sample_dict['logic'] < 29
+            and abs(phase_sum - sample_dict['interval']) < 1e-6):
+        print_color("PerfHUD_nestedPhasesNotCountedTwice: OK", color = "green")
+    else:
+        print_color("PerfHUD_nestedPhasesNotCountedTwice: FAIL", color = "red")
+
+
+def test_dataModules_doNotImportPygame() -> None:
+    import subprocess
+    import sys
+    code = "import sys, data_loading, geo_math, helper; print('pygame' in sys.modules, 'pandas' in sys.modules)"
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True).stdout.strip()
+    if output == 'False False':
+        print_color("dataModules_doNotImportPygame: OK", color = "green")
+    else:
+        print_color("dataModules_doNotImportPygame: FAIL", color = "red")
+
+
+def test_BackgroundLoader_resultsAndErrors() -> None:
+    import time
+    from loading import BackgroundLoader
+    loader = BackgroundLoader(max_workers=2)
+    loader.submit('fast', 'fast', lambda: 1)
+    loader.submit('slow', 'slow', lambda: time.sleep(0.05) or 2)
+    loader.submit('failing', 'failing', lambda: 1 / 0)
+    while not loader.is_ready():
+        loader.wait(0.01)
+    try:
+        loader.result('failing')
+        error_raised = False
+    except ZeroDivisionError:
+        error_raised = True
+    loader.shutdown()
+    if loader.result('fast') == 1 and loader.result('slow') == 2 and error_raised and loader.progress() == 1.0:
+        print_color("BackgroundLoader_resultsAndErrors: OK", color = "green")
+    else:
+        print_color("BackgroundLoader_resultsAndErrors: FAIL", color = "red")
+
+
+def test_LoadingScreen_quitDoesNotWait() -> None:
+    import os
+    import time
+    import pygame
+    from loading import BackgroundLoader, LoadingScreen
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.init()
+    window = pygame.display.set_mode((200, 200))
+    loader = BackgroundLoader(max_workers=1)
+    loader.submit('slow', 'slow', time.sleep, 0.5)
+    pygame.event.clear()
+    pygame.event.post(pygame.event.Event(pygame.QUIT))
+    start_time = time.perf_counter()
+    keep_running = LoadingScreen(window).run(loader)
+    elapsed_time = time.perf_counter() - start_time
+    loader.shutdown()
+    if not keep_running and elapsed_time < 0.25:
+        print_color("LoadingScreen_quitDoesNotWait: OK", color = "green")
+    else:
+        print_color("LoadingScreen_quitDoesNotWait: FAIL", color = "red")
+
+
+def test_normalize_column_matchesRegexPipeline() -> None:
+    from name_normalizer import normalize_column, normalize_column_regex, normalize_name, clear_memo
+    name_series = pd.read_csv(config_dict['city_data_file'], sep=';', usecols=['city_name_raw'])['city_name_raw']
+    edge_case_series = pd.Series(["Saint-Étienne", "SAÏNT Denis", "saiñt-x", "Sainte--Marie  l'Église", "saintes",
+                                  "Œuvre-Saint", "xsaint saint", "_saint", "saintété", None, 3], dtype=object)
+    name_series = pd.concat([name_series, edge_case_series], ignore_index=True)
+    clear_memo()
+    if (normalize_column(name_series).equals(normalize_column_regex(name_series))
+            and normalize_name("Saint-Étienne") == "st etienne"):
+        print_color("normalize_column_matchesRegexPipeline: OK", color = "green")
+    else:
+        print_color("normalize_column_matchesRegexPipeline: FAIL", color = "red")
+
+
+def test_load_loc_data_matchesJsonLoad() -> None:
+    import json
+    import os
+    import tempfile
+    from database_generation import iter_json_array, load_loc_data
+    city_lst = [{"insee_code": str(i), "city_code": f"ville {i}", "zip_code": "01000", "label": "x",
+                 "latitude": f"{45 + i / 100}", "longitude": "5.1", "department_name": "ain",
+                 "department_number": ["01", "971", "2A"][i % 3], "region_name": "auvergne-rhône-alpes",
+                 "region_geojson_name": "x"} for i in range(300)]
+    city_lst[5]['city_code'] = 'brace } and ] in "name"'
+    city_lst[8] = dict(city_lst[6])  # duplicate
+    del city_lst[9]['label']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, 'cities_location.json')
+        with open(file, 'w') as f:
+            json.dump({"cities": city_lst}, f, indent=4)
+        is_ok = all([item for batch in iter_json_array(file, 'cities', chunk_size) for item in batch] == city_lst
+                    for chunk_size in [7, 100, 4096, 1 << 20])
+        # former pipeline: whole json in a DataFrame then filtered
+        expected_df = pd.DataFrame(city_lst)
+        expected_df = expected_df[expected_df['department_number'].str.len() < 3]
+        expected_df = expected_df.drop(columns=['insee_code', 'zip_code', 'region_geojson_name', 'label'])
+        loc_df = load_loc_data(file)
+    if (is_ok and loc_df.astype(object).equals(expected_df.astype(object))
+            and list(loc_df.columns) == list(expected_df.columns) and loc_df.index.equals(expected_df.index)):
+        print_color("load_loc_data_matchesJsonLoad: OK", color = "green")
+    else:
+        print_color("load_loc_data_matchesJsonLoad: FAIL", color = "red")
+
+
+def test_match_names_recoversMisspellings() -> None:
+    from fuzzy_join import match_names, edit_distance
+    loc_name_lst = ['villeneuve sous charigny', 'lamothe goas', 'st jean', 'pastricciola', 'beaumont hague']
+    pop_name_lst = ['st jeoire', 'pasticciola', 'lamothe gas', 'villeneuve sosu charigny', 'la hague']
+    match_lst = match_names(loc_name_lst, pop_name_lst, threshold=0.8)
+    expected_lst = [(0, 3), (1, 2), (3, 1)]  # st jean/st jeoire and the merged commune are different towns
+    if (sorted((loc_index, pop_index) for loc_index, pop_index, _ in match_lst) == expected_lst
+            and all(0.8 <= score < 1 for _, _, score in match_lst)
+            and edit_distance('sosu', 'sous') == 1 and edit_distance('kitten', 'sitting') == 3
+            and edit_distance('kitten', 'sitting', max_distance=1) == 2):
+        print_color("match_names_recoversMisspellings: OK", color = "green")
+    else:
+        print_color("match_names_recoversMisspellings: FAIL", color = "red")
+
+
+def test_merge_department_data_sumsArrondissements() -> None:
+    from database_generation import merge_department_data
+    loc_df = pd.DataFrame({'city_code': ['paris 01', 'nice', 'paris 02', 'grande ville 1', 'grande ville 2'],
+                           'latitude': ['48.86', '43.7', '48.87', '45.0', '45.1'],
+                           'longitude': ['2.34', '7.26', '2.35', '5.0', '5.1'],
+                           'department_name': 'dpt',
+                           'department_number': '99',
+                           'region_name': 'region'})
+    loc_df['cleaned_name'] = loc_df['city_code']
+    loc_df['_loc_order'] = range(len(loc_df))
+    population_df = pd.DataFrame({'Code région': 1,
+                                  'Nom de la région': 'Région',
+                                  'Code département': '99',
+                                  'Nom de la commune': ['Paris 1er Arrondissement', 'Nice', 'Paris 2e Arrondissement',
+                                                        'Grande-Ville 1er Arrondissement', 'Grande-Ville 3e Arrondissement',
+                                                        'Petite-Ville 1er Arrondissement'],
+                                  'Population municipale': [10, 5, 20, 1, 2, 7],
+                                  'department_number': '99',
+                                  'department_name': 'dpt'})
+    population_df['cleaned_name'] = ['paris 1er arrondissement', 'nice', 'paris 2e arrondissement',
+                                     'grande ville 1er arrondissement', 'grande ville 3e arrondissement',
+                                     'petite ville 1er arrondissement']
+    merge_df = merge_department_data(loc_df, population_df, fuzzy_threshold=0.8).sort_values('_loc_order')
+    if (merge_df['city_name'].tolist() == ['nice', 'paris', 'grande ville']
+            and merge_df['city_population'].tolist() == [5, 30, 3]
+            and merge_df['city_name_raw'].tolist() == ['Nice', 'Paris', 'Grande-Ville']
+            and merge_df['latitude'].tolist() == ['43.7', '48.86', '45.0']):
+        print_color("merge_department_data_sumsArrondissements: OK", color = "green")
+    else:
+        print_color("merge_department_data_sumsArrondissements: FAIL", color = "red")
+
+
+def test_Database_memoryReportIsCompact() -> None:
+    from database_class import Database
+    database = Database(seed=0)
+    report_dict = database.memory_report()
+    store = database.store
+    if (store['latitude'].dtype == np.float32 and store['department_number'].codes.dtype == np.int8
+            and report_dict['shared'] == sum(nbytes for name, nbytes in report_dict.items() if name.startswith('store.'))
+            and report_dict['private'] < report_dict['shared'] / 4
+            and not hasattr(database.spatial_index, 'xyz')):
+        print_color("Database_memoryReportIsCompact: OK", color = "green")
+    else:
+        print_color("Database_memoryReportIsCompact: FAIL", color = "red")
+
+
+def test_GameMode_combinesCachedMasks() -> None:
+    from city_store import load_city_store
+    from game_mode import GameMode, PopulationRule, RegionRule, PrefectureRule, get_rule_mask, game_mode_dict
+    from database_class import Database
+    store = load_city_store()
+    population = np.asarray(store['city_population'])
+    region = np.asarray(store['region_name'].to_list())
+    # two modes sharing the population rule
+    mode_a = GameMode("a", [RegionRule(['bretagne']), PopulationRule(min_population=2000)])
+    mode_b = GameMode("b", [RegionRule(['corse']), PopulationRule(min_population=2000)])
+    pool_a = mode_a.select(store)
+    pool_b = mode_b.select(store)
+    expected_a = np.flatnonzero((region == 'bretagne') & (population >= 2000))
+    expected_b = np.flatnonzero((region == 'corse') & (population >= 2000))
+    shared = get_rule_mask(PopulationRule(min_population=2000), store) is get_rule_mask(mode_b.rule_lst[1], store)
+    # one prefecture per department
+    prefecture_pool = PrefectureRule().select(store)
+    nb_department = len(store['department_number'].category_lst)
+    department_lst = [store['department_number'][i] for i in prefecture_pool]
+    # an edited prefecture list gets a new key (and pool file)
+    import os, shutil, tempfile
+    tmp_dir = tempfile.mkdtemp()
+    prefecture_file = os.path.join(tmp_dir, 'prefecture_data.csv')
+    shutil.copy(config_dict['prefecture_file'], prefecture_file)
+    old_key = PrefectureRule(prefecture_file).key
+    with open(prefecture_file, 'a', encoding='utf-8') as f:
+        f.write('01;Oyonnax\n')
+    new_key = PrefectureRule(prefecture_file).key
+    shutil.rmtree(tmp_dir)
+    # switching to a compiled mode does not recompute the pool
+    database = Database()
+    database.compile_modes()
+    pool = database.city_index
+    database.set_mode('facile')
+    database.set_mode('classique')
+    if (np.array_equal(pool_a, expected_a) and np.array_equal(pool_b, expected_b) and shared
+            and len(prefecture_pool) == nb_department and len(set(department_lst)) == nb_department and old_key != new_key
+            and database.city_index is pool
+            and np.array_equal(database.city_index, game_mode_dict['classique'].rule_lst[0].select(store))):
+        print_color("GameMode_combinesCachedMasks: OK", color = "green")
+    else:
+        print_color("GameMode_combinesCachedMasks: FAIL", color = "red")
+
+
+def _parse_pickle_department(excel_file: str, cache_file: str) -> str:
+    # stands for the xlsx parser in the worker processes (the test files are pickles)
+    df = pd.read_pickle(excel_file)
+    if df.empty:
+        raise ValueError(f'{excel_file} has no town')
+    df.to_pickle(cache_file)
+    return(cache_file)
+
+
+def test_update_population_cache_rebuildsChangedFiles() -> None:
+    import os
+    import shutil
+    import tempfile
+    from database_generation import update_population_cache, read_population_table
+    tmp_dir = tempfile.mkdtemp()
+    source_dir = os.path.join(tmp_dir, 'source')
+    cache_dir = os.path.join(tmp_dir, 'cache')
+    os.makedirs(source_dir)
+    def write_source(dpt_number: str, town_lst: list[str]) -> None:
+        pd.DataFrame({'Nom de la commune': town_lst}).to_pickle(os.path.join(source_dir, f'dep{dpt_number}.xlsx'))
+    def update(nb2name_dict: dict[str:str]) -> dict:
+        return(update_population_cache(nb2name_dict, cache_dir, max_workers=2, source_dir=source_dir,
+                                       parse_func=_parse_pickle_department))
+    def cache_mtime(dpt_number: str) -> int:
+        return(os.stat(os.path.join(cache_dir, f'dep{dpt_number}.pkl')).st_mtime_ns)
+
+    write_source('01', ['Bourg-en-Bresse'])
+    write_source('02', ['Laon'])
+    nb2name_dict = {'01': 'ain', '02': 'aisne'}
+    first_manifest = update(nb2name_dict)
+    mtime_lst = [cache_mtime('01'), cache_mtime('02')]
+    # nothing changed: cache hit
+    update(nb2name_dict)
+    is_cached = [cache_mtime('01'), cache_mtime('02')] == mtime_lst
+    # only the department whose file changed is parsed again
+    write_source('02', ['Laon', 'Soissons'])
+    second_manifest = update(nb2name_dict)
+    is_rebuilt = (cache_mtime('01') == mtime_lst[0]
+                  and read_population_table('02', 'aisne', cache_dir)['Nom de la commune'].tolist() == ['Laon', 'Soissons']
+                  and second_manifest['files']['02']['hash'] != first_manifest['files']['02']['hash'])
+    # a failing worker: the error is raised, the other departments are still in the manifest
+    write_source('02', ['Laon'])
+    write_source('03', [])
+    try:
+        update(nb2name_dict | {'03': 'allier'})
+        error_raised = False
+    except ValueError:
+        error_raised = True
+    with open(os.path.join(cache_dir, 'manifest.json'), 'r') as f:
+        file_dict = json.load(f)['files']
+    is_recorded = file_dict.get('02', {}).get('hash') == first_manifest['files']['02']['hash'] and '03' not in file_dict
+    shutil.rmtree(tmp_dir)
+
+    if is_cached and is_rebuilt and error_raised and is_recorded:
+        print_color("update_population_cache_rebuildsChangedFiles: OK", color = "green")
+    else:
+        print_color("update_population_cache_rebuildsChangedFiles: FAIL", color = "red")
+        print(is_cached, is_rebuilt, error_raised, is_recorded)
+
+
 def run_tests() -> None:
     '''
     run all tests
@@ -110,6 +686,33 @@ def run_tests() -> None:
     test_Location_pixel2gps_ifGPSInput()
     test_Location_gps2pixel_ifGPSInput()
     test_Location_gps2pixel_ifPixelInput()
+    test_Location_sharesGeoMapProjection()
+    test_MercatorProjection_matchesPyproj()
+    test_BaseProjection_incompleteSubclassFails()
+    test_MercatorProjection_arrayMatchesScalar()
+    test_haversine_array_matchesScalar()
+    test_calculate_score_array_matchesScalar()
+    test_CityStore_matchesCsv()
+    test_Database_defaultPoolMatchesPandas()
+    test_RoundSampler_noRepeatAndSeeded()
+    test_SpatialIndex_matchesBruteForce()
+    test_Text_updateUsesRenderCache()
+    test_Scene_dirtyRenderMatchesFullRedraw()
+    test_FrameScheduler_idleWaitsForEvents()
+    test_AssetManager_sharesScaledSurfaces()
+    test_simulation_playsFullGames()
+    test_compare_to_baseline_flagsRegressions()
+    test_PerfHUD_nestedPhasesNotCountedTwice()
+    test_dataModules_doNotImportPygame()
+    test_BackgroundLoader_resultsAndErrors()
+    test_LoadingScreen_quitDoesNotWait()
+    test_normalize_column_matchesRegexPipeline()
+    test_load_loc_data_matchesJsonLoad()
+    test_match_names_recoversMisspellings()
+    test_merge_department_data_sumsArrondissements()
+    test_Database_memoryReportIsCompact()
+    test_GameMode_combinesCachedMasks()
+    test_update_population_cache_rebuildsChangedFiles()
 
 
 if __name__ == '__main__':